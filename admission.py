@@ -0,0 +1,203 @@
+import os
+import re
+import time
+import logging
+
+from catalog import normalize_text
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Umbrales de sobrecarga (solicitudes a OpenAI en curso y latencia media en segundos)
+ADMISSION_SOFT_INFLIGHT = int(os.getenv('ADMISSION_SOFT_INFLIGHT', '16'))
+ADMISSION_HARD_INFLIGHT = int(os.getenv('ADMISSION_HARD_INFLIGHT', '32'))
+ADMISSION_SOFT_LATENCY = float(os.getenv('ADMISSION_SOFT_LATENCY', '8'))
+ADMISSION_HARD_LATENCY = float(os.getenv('ADMISSION_HARD_LATENCY', '15'))
+# Segundos por debajo de los umbrales antes de volver a un modo menos restrictivo
+ADMISSION_RECOVER_AFTER = float(os.getenv('ADMISSION_RECOVER_AFTER', '30'))
+# Tiempo máximo de espera a OpenAI antes de responder con el modo degradado
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '20'))
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+SHEDDING = 'shedding'
+MODES = (NORMAL, DEGRADED, SHEDDING)
+
+HIGH_DEMAND_MESSAGE = (
+    "⚡ En este momento tenemos mucha demanda y no puedo darte una respuesta detallada.\n"
+    "Mientras tanto puedes usar /productos, /ofertas o /info, o escribirme de nuevo en unos minutos."
+)
+
+
+class AdmissionController:
+    """
+    Control de admisión de solicitudes a OpenAI.
+
+    Observa las solicitudes en curso y la latencia media (EWMA) de OpenAI:
+    - normal: se admite todo
+    - degraded: las consultas que se pueden responder con plantillas no llegan a OpenAI
+    - shedding: solo se admite una solicitud de sondeo a la vez; el resto recibe respuesta local
+    La vuelta a un modo menos restrictivo exige `recover_after` segundos por debajo
+    de los umbrales, para no oscilar entre modos.
+    """
+
+    def __init__(self, soft_inflight=ADMISSION_SOFT_INFLIGHT, hard_inflight=ADMISSION_HARD_INFLIGHT,
+                 soft_latency=ADMISSION_SOFT_LATENCY, hard_latency=ADMISSION_HARD_LATENCY,
+                 recover_after=ADMISSION_RECOVER_AFTER, alpha=0.2, metrics=None, tenant=None):
+        self.soft_inflight = soft_inflight
+        self.hard_inflight = hard_inflight
+        self.soft_latency = soft_latency
+        self.hard_latency = hard_latency
+        self.recover_after = recover_after
+        self.alpha = alpha
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+
+        self.mode = NORMAL
+        self.inflight = 0
+        self.latency = 0.0
+        self._calm_since = None
+
+    def _pressure(self):
+        """Modo que corresponde a la carga actual, sin histéresis"""
+        if self.inflight >= self.hard_inflight or self.latency >= self.hard_latency:
+            return SHEDDING
+        if self.inflight >= self.soft_inflight or self.latency >= self.soft_latency:
+            return DEGRADED
+        return NORMAL
+
+    def _update_mode(self, now=None):
+        now = time.monotonic() if now is None else now
+        target = self._pressure()
+        if MODES.index(target) >= MODES.index(self.mode):
+            self._calm_since = None
+            if target != self.mode:
+                self._set_mode(target)
+            return
+        # Recuperación: bajar un nivel tras un periodo de calma sostenido
+        if self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.recover_after:
+            self._set_mode(MODES[MODES.index(self.mode) - 1])
+            self._calm_since = now
+
+    def _set_mode(self, mode):
+        logger.warning(f"🚦 Modo de servicio: {self.mode} → {mode} "
+                       f"({self.inflight} en curso, latencia media {self.latency:.1f} s)")
+        self.mode = mode
+        self.metrics.set('admission_mode', MODES.index(mode), tenant=self.tenant)
+        self.metrics.inc('admission_mode_changes_total', tenant=self.tenant, mode=mode)
+
+    def under_pressure(self):
+        """Indica si el servicio está en un modo degradado"""
+        self._update_mode()
+        return self.mode != NORMAL
+
+    def try_admit(self, low_priority=False):
+        """Decidir si una solicitud va a OpenAI; si se admite hay que llamar a `release`"""
+        self._update_mode()
+        if self.mode == SHEDDING:
+            admitted = self.inflight == 0
+        elif self.mode == DEGRADED:
+            admitted = not low_priority
+        else:
+            admitted = True
+
+        if admitted:
+            self.inflight += 1
+            self.metrics.inc('admission_admitted_total', tenant=self.tenant, mode=self.mode)
+        else:
+            self.metrics.inc('admission_shed_total', tenant=self.tenant, mode=self.mode)
+        self.metrics.set('admission_inflight', self.inflight, tenant=self.tenant)
+        return admitted
+
+    def release(self, latency):
+        """Registrar el fin de una solicitud admitida y su latencia"""
+        self.inflight = max(0, self.inflight - 1)
+        self.latency = latency if self.latency == 0 else self.alpha * latency + (1 - self.alpha) * self.latency
+        self.metrics.set('admission_inflight', self.inflight, tenant=self.tenant)
+        self.metrics.set('admission_latency_ewma_seconds', self.latency, tenant=self.tenant)
+        self._update_mode()
+
+
+class TemplateResponder:
+    """
+    Respuestas locales construidas con `store_info` y el catálogo, usadas cuando
+    OpenAI está saturado. Solo cubre preguntas frecuentes y productos concretos.
+    """
+
+    TOPICS = (
+        (('horario', 'abren', 'cierran', 'abierto', 'hora'), 'horario', "🕒 Nuestro horario: {value}"),
+        (('direccion', 'ubicacion', 'donde estan', 'donde queda', 'local'), 'direccion', "📍 Estamos en: {value}"),
+        (('telefono', 'llamar', 'contacto', 'whatsapp'), 'telefono', "📞 Puedes llamarnos al {value}"),
+        (('email', 'correo'), 'email', "📧 Escríbenos a {value}"),
+        (('envio', 'envios', 'entrega', 'domicilio'), 'politica_envios', "🚚 Envíos: {value}"),
+        (('devolucion', 'devoluciones', 'devolver', 'garantia', 'cambio'), 'politica_devoluciones',
+         "🔄 Devoluciones: {value}"),
+    )
+    PAYMENT_WORDS = ('pago', 'pagar', 'tarjeta', 'paypal', 'transferencia')
+    OFFER_WORDS = ('oferta', 'ofertas', 'descuento', 'promocion', 'rebaja')
+
+    def __init__(self):
+        self.store_info = {}
+        self.products = []
+        self._name_tokens = []
+
+    def update(self, store_info, products):
+        """Reconstruir el índice de nombres de productos tras cambiar el catálogo"""
+        self.store_info = store_info
+        self.products = list(products)
+        self._name_tokens = [
+            (set(re.findall(r'\w+', normalize_text(product.get('name', '')))), product)
+            for product in self.products
+        ]
+
+    def match_product(self, text):
+        """Producto cuyo nombre comparte más palabras con el texto (al menos dos, o el nombre entero)"""
+        words = set(re.findall(r'\w+', normalize_text(text)))
+        best, best_score = None, 0
+        for tokens, product in self._name_tokens:
+            score = len(tokens & words)
+            if score > best_score and (score >= 2 or score == len(tokens)):
+                best, best_score = product, score
+        return best
+
+    @staticmethod
+    def _mentions(keywords, normalized, words):
+        # Palabras sueltas se comparan enteras ("hora" no debe coincidir con "ahora")
+        return any((keyword in normalized) if ' ' in keyword else (keyword in words) for keyword in keywords)
+
+    def answer(self, text, offers=()):
+        """Respuesta local para `text`, o None si la pregunta necesita al modelo"""
+        normalized = normalize_text(text)
+        words = set(re.findall(r'\w+', normalized))
+        parts = []
+        for keywords, field, template in self.TOPICS:
+            if self._mentions(keywords, normalized, words) and self.store_info.get(field):
+                parts.append(template.format(value=self.store_info[field]))
+        if self._mentions(self.PAYMENT_WORDS, normalized, words):
+            parts.append("💳 Puedes pagar con tarjeta de crédito, PayPal o transferencia bancaria.")
+        if self._mentions(self.OFFER_WORDS, normalized, words):
+            if offers:
+                parts.append("🔥 Ofertas vigentes:\n" + "\n".join(
+                    f"• {product.get('name', '')}: ${product.get('ofertas', {}).get('precio_oferta', 0):.2f}"
+                    for product in offers
+                ))
+            else:
+                parts.append("Ahora mismo no tenemos ofertas activas.")
+
+        product = self.match_product(text)
+        if product is not None:
+            ofertas = product.get('ofertas', {})
+            line = f"📦 {product.get('name', '')}: ${product.get('price', 0):.2f}"
+            if ofertas.get('activa', False):
+                line += f" (🔥 oferta: ${ofertas.get('precio_oferta', 0):.2f})"
+            stock = product.get('stock', 0)
+            line += f"\n{'✅ Disponible' if product.get('disponible', False) and stock else '❌ Sin stock'}"
+            if product.get('description'):
+                line += f"\n{product['description']}"
+            parts.append(line)
+
+        if not parts:
+            return None
+        return "\n\n".join(parts)
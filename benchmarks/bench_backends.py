@@ -0,0 +1,99 @@
+"""
+Comparar la latencia de las consultas del catálogo en los tres almacenes: JSON, SQLite y MongoDB.
+
+Uso:
+    python benchmarks/bench_backends.py --sizes 1000 10000 100000 [--mongo] [--repeat 200]
+
+Genera catálogos sintéticos a partir de migration/products.json y ejecuta las
+mismas consultas sobre cada `CatalogRepository`: producto por ID, productos de
+una categoría, ofertas activas y búsqueda de texto. Muestra la mediana y el
+p95 de cada consulta. `--mongo` necesita MONGODB_URI y usa la base de datos
+`BackendBench`.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_snapshot import synthetic_catalog
+
+SEARCH_TERMS = ['samsung', 'auriculares', 'port', 'bluetooth inalambrico', 'pro']
+
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def run_queries(repository, data, repeat):
+    rng = random.Random(42)
+    ids = [product['id'] for product in data['products']]
+    categories = data['categories']
+    queries = {
+        'get': lambda: repository.get(rng.choice(ids)),
+        'by_category': lambda: repository.by_category(rng.choice(categories)),
+        'active_offers': lambda: repository.active_offers(),
+        'search': lambda: repository.search(rng.choice(SEARCH_TERMS), limit=10),
+    }
+    # Las consultas que devuelven muchas filas se repiten menos para no alargar la prueba
+    bulky = max(5, repeat // 10)
+    return {
+        name: timed(query, bulky if name in ('by_category', 'active_offers') else repeat)
+        for name, query in queries.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--mongo', action='store_true')
+    args = parser.parse_args()
+
+    from catalog_repository import JsonCatalogRepository, SqliteCatalogRepository, MongoCatalogRepository
+
+    print(f"{'productos':>10} {'almacén':>8} {'consulta':>14} {'mediana':>10} {'p95':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            data = synthetic_catalog(size)
+            json_path = os.path.join(directory, f'{size}.json')
+            with open(json_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+            sqlite = SqliteCatalogRepository(os.path.join(directory, f'{size}.db'), create=True)
+            sqlite.replace_all(data)
+
+            repositories = [JsonCatalogRepository(json_path), sqlite]
+            if args.mongo:
+                from pymongo import MongoClient
+                db = MongoClient(os.getenv('MONGODB_URI'))['BackendBench']
+                for collection in ('storeInfo', 'categories', 'products'):
+                    db[collection].delete_many({})
+                db.storeInfo.insert_one(dict(data['store_info']))
+                db.categories.insert_many([{'name': category} for category in data['categories']])
+                db.products.insert_many([dict(product) for product in data['products']])
+                db.products.create_index('id', unique=True)
+                db.products.create_index('category')
+                db.products.create_index('ofertas.activa')
+                repositories.append(MongoCatalogRepository(db))
+
+            for repository in repositories:
+                for name, (median, p95) in run_queries(repository, data, args.repeat).items():
+                    print(f"{size:>10} {repository.backend:>8} {name:>14} "
+                          f"{median * 1000:>8.3f}ms {p95 * 1000:>8.3f}ms")
+                repository.close()
+
+
+if __name__ == "__main__":
+    main()
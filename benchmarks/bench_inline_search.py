@@ -0,0 +1,96 @@
+"""
+Medir la latencia de la búsqueda inline (trie de prefijos) por pulsación de tecla.
+
+Uso:
+    python benchmarks/bench_inline_search.py --products 1000 20000 100000
+
+Para cada tamaño de catálogo sintético construye el índice, simula las
+consultas que envía Telegram mientras se escribe (una por letra) y muestra
+la latencia media y p99 por consulta, el coste de actualizar un producto y,
+como referencia, el de filtrar el catálogo completo en cada consulta.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_snapshot import synthetic_catalog
+
+QUERIES = ['iphone 15', 'galaxy', 'portatil gaming', 'auriculares', 'macbook air', 'smartphone galaxy x', 'funda']
+
+
+def keystrokes(queries):
+    """Todas las consultas intermedias de escribir cada texto letra a letra"""
+    return [query[:length] for query in queries for length in range(1, len(query) + 1)]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def timed(search, queries, repeat):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def scan(products, limit):
+    """Filtro lineal del catálogo completo, como referencia"""
+    from inline_search import search_words, InlineSearchIndex
+
+    words_by_product = [(product, search_words(product.get('name', '')) + search_words(product.get('category', '')))
+                        for product in products]
+
+    def search(text):
+        words = search_words(text)
+        matches = [product for product, product_words in words_by_product
+                   if all(any(candidate.startswith(word) for candidate in product_words) for word in words)]
+        return sorted(matches, key=InlineSearchIndex.rank)[:limit]
+    return search
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, nargs='+', default=[1000, 20000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from inline_search import InlineSearchIndex
+
+    queries = keystrokes(QUERIES)
+    print(f"{len(queries)} consultas por pasada (una por letra), {args.repeat} pasadas")
+    print(f"{'productos':>10} {'construir':>10} {'media':>10} {'p99':>10} {'actualizar':>11} {'filtro lineal':>14}")
+    for size in args.products:
+        products = synthetic_catalog(size)['products']
+        index = InlineSearchIndex()
+        start = time.perf_counter()
+        index.build(products)
+        build = time.perf_counter() - start
+
+        samples = timed(index.search, queries, args.repeat)
+
+        rng = random.Random(1)
+        updates = []
+        for _ in range(200):
+            product = dict(rng.choice(products), stock=rng.randint(0, 5))
+            start = time.perf_counter()
+            index.upsert([product])
+            updates.append(time.perf_counter() - start)
+
+        linear = timed(scan(products, index.limit), queries, 1)
+        print(f"{size:>10} {build:>9.2f}s {sum(samples) / len(samples) * 1e6:>8.1f}µs "
+              f"{percentile(samples, 0.99) * 1e6:>8.1f}µs {sum(updates) / len(updates) * 1000:>9.2f}ms "
+              f"{sum(linear) / len(linear) * 1000:>12.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Comparar memoria y CPU por tienda: un proceso por tienda frente al modo multi-tienda.
+
+Uso:
+    python benchmarks/bench_multitenant.py --tenants 5
+
+Requiere MONGODB_URI y OPENAI_API_KEY en el entorno (igual que productsv2.py).
+Cada tienda usa la base de datos MONGODB_DB; los tokens de Telegram son ficticios
+porque solo se construyen las aplicaciones, sin iniciar el polling.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FAKE_TOKEN = '123456:BENCHMARK'
+
+
+def rss_mb():
+    """Memoria residente actual del proceso en MB"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_worker(tenants, db_name):
+    """Construir `tenants` bots en este proceso y reportar RSS y CPU"""
+    from multitenant import create_bots
+
+    bots = create_bots(
+        [{'name': f'bench{i}', 'telegram_token': FAKE_TOKEN, 'mongodb_db': db_name} for i in range(tenants)]
+    )
+    apps = [bot.build_application() for bot in bots]
+    print(json.dumps({'rss_mb': rss_mb(), 'cpu_s': cpu_seconds(), 'bots': len(apps)}))
+
+
+def spawn(tenants, db_name):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', '--tenants', str(tenants), '--db', db_name],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tenants', type=int, default=5)
+    parser.add_argument('--db', default=os.getenv('MONGODB_DB', 'TechStore'))
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.tenants, args.db)
+        return
+
+    start = time.time()
+    separate = [spawn(1, args.db) for _ in range(args.tenants)]
+    separate_time = time.time() - start
+
+    start = time.time()
+    shared = spawn(args.tenants, args.db)
+    shared_time = time.time() - start
+
+    separate_rss = sum(result['rss_mb'] for result in separate)
+    separate_cpu = sum(result['cpu_s'] for result in separate)
+
+    print("=" * 50)
+    print(f"📊 {args.tenants} tiendas")
+    print("=" * 50)
+    print(f"Un proceso por tienda: {separate_rss / args.tenants:.1f} MB y {separate_cpu / args.tenants:.2f} s CPU por tienda "
+          f"(total {separate_rss:.1f} MB, {separate_time:.2f} s)")
+    print(f"Multi-tienda:          {shared['rss_mb'] / args.tenants:.1f} MB y {shared['cpu_s'] / args.tenants:.2f} s CPU por tienda "
+          f"(total {shared['rss_mb']:.1f} MB, {shared_time:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Medir la latencia que ahorra reutilizar conexiones con el cliente compartido de OpenAI.
+
+Uso:
+    python benchmarks/bench_openai_client.py --requests 200 --concurrency 1 8 --handshake 0.05
+
+Arranca un servidor local que imita la API (benchmarks/fake_openai_server.py)
+y envía las mismas solicitudes de tres formas:
+- compartido: un solo cliente con pool y keep-alive (openai_client.py)
+- sin keep-alive: un solo cliente que abre una conexión por solicitud
+- cliente por solicitud: se crea y se cierra un cliente en cada llamada
+`--handshake` simula el coste de abrir una conexión contra la API real
+(TCP y TLS, varios viajes de ida y vuelta). Muestra la latencia media, p50 y
+p95 por solicitud, las conexiones abiertas y el ahorro frente al compartido.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_openai_server import FakeOpenAIServer
+
+MESSAGES = [
+    {"role": "system", "content": "Eres el asistente de una tienda de electrónica. " * 20},
+    {"role": "user", "content": "¿Tienen el iPhone 15 Pro en stock?"},
+]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_mode(mode, server, requests, concurrency):
+    from openai_client import create_openai_client
+
+    shared = None
+    if mode == 'compartido':
+        shared = create_openai_client(api_key='bench', base_url=server.base_url, max_retries=0)
+    elif mode == 'sin keep-alive':
+        shared = create_openai_client(api_key='bench', base_url=server.base_url, max_retries=0, max_keepalive=0)
+
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with slots:
+            start = time.perf_counter()
+            if shared is not None:
+                await shared.chat.completions.create(model='gpt-3.5-turbo', messages=MESSAGES, max_tokens=300)
+            else:
+                client = create_openai_client(api_key='bench', base_url=server.base_url, max_retries=0)
+                try:
+                    await client.chat.completions.create(model='gpt-3.5-turbo', messages=MESSAGES, max_tokens=300)
+                finally:
+                    await client.close()
+            latencies.append(time.perf_counter() - start)
+
+    connections = server.connections
+    await asyncio.gather(*(one() for _ in range(requests)))
+    if shared is not None:
+        await shared.close()
+    return latencies, server.connections - connections
+
+
+async def measure(args):
+    server = await FakeOpenAIServer(latency=args.latency, handshake=args.handshake).start()
+    print(f"{args.requests} solicitudes, generación {args.latency * 1000:.0f} ms, "
+          f"apertura de conexión {args.handshake * 1000:.0f} ms")
+    print(f"{'modo':>22} {'conc.':>6} {'media':>9} {'p50':>9} {'p95':>9} {'conexiones':>11} {'ahorro/solicitud':>17}")
+    for concurrency in args.concurrency:
+        reference = None
+        for mode in ('compartido', 'sin keep-alive', 'cliente por solicitud'):
+            latencies, connections = await run_mode(mode, server, args.requests, concurrency)
+            mean = sum(latencies) / len(latencies)
+            reference = reference if reference is not None else mean
+            saved = f"{(mean - reference) * 1000:>15.1f}ms" if mode != 'compartido' else f"{'-':>17}"
+            print(f"{mode:>22} {concurrency:>6} {mean * 1000:>7.1f}ms {percentile(latencies, 0.5) * 1000:>7.1f}ms "
+                  f"{percentile(latencies, 0.95) * 1000:>7.1f}ms {connections:>11} {saved}")
+    await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--latency', type=float, default=0.02, help="Tiempo de generación simulado (segundos)")
+    parser.add_argument('--handshake', type=float, default=0.05, help="Coste simulado de abrir una conexión (segundos)")
+    args = parser.parse_args()
+    asyncio.run(measure(args))
+
+
+if __name__ == "__main__":
+    main()
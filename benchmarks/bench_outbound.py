@@ -0,0 +1,108 @@
+"""
+Medir la cola de salida contra una Bot API falsa que aplica los límites de Telegram.
+
+Uso:
+    python benchmarks/bench_outbound.py --recipients 300 --interactive 50
+
+La Bot API falsa responde con `RetryAfter` si se superan 30 mensajes/segundo en
+total o 1 mensaje/segundo por chat (con ráfagas de 3), igual que Telegram.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from collections import deque, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import RetryAfter
+
+from outbound import OutboundScheduler
+from broadcast import broadcast
+
+
+class FakeBotAPI:
+    """Bot API local que rechaza los envíos que superan los límites"""
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, latency=0.02):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.latency = latency
+        self.global_log = deque()
+        self.chat_log = defaultdict(deque)
+        self.delivered = 0
+        self.rejected = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        while self.global_log and now - self.global_log[0] > 1:
+            self.global_log.popleft()
+        chat_log = self.chat_log[chat_id]
+        while chat_log and now - chat_log[0] > self.chat_burst / self.chat_rate:
+            chat_log.popleft()
+        if len(self.global_log) >= self.global_rate or len(chat_log) >= self.chat_burst:
+            self.rejected += 1
+            raise RetryAfter(1)
+        self.global_log.append(now)
+        chat_log.append(now)
+        self.delivered += 1
+        return {'chat_id': chat_id, 'text': text}
+
+
+class MemoryRegistry:
+    def __init__(self, chat_ids):
+        self.chat_ids = chat_ids
+
+    def iter_batches(self, batch_size):
+        for i in range(0, len(self.chat_ids), batch_size):
+            yield self.chat_ids[i:i + batch_size]
+
+    def mark_blocked(self, chat_ids):
+        pass
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def run(recipients, interactive):
+    api = FakeBotAPI()
+    outbound = OutboundScheduler()
+    outbound.start(api)
+
+    registry = MemoryRegistry(list(range(1, recipients + 1)))
+    broadcast_task = asyncio.create_task(broadcast(outbound, registry, "🔥 Nueva oferta", batch_size=100))
+
+    # Respuestas interactivas a chats distintos mientras dura la difusión
+    latencies = []
+    for i in range(interactive):
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        await outbound.send(10_000 + i, "respuesta")
+        latencies.append(time.monotonic() - start)
+
+    report = await broadcast_task
+    await outbound.stop()
+
+    print("=" * 50)
+    print(f"📣 Difusión: {report.sent} enviados, {report.failed} fallidos en {report.elapsed:.1f} s "
+          f"({report.rate:.1f} mensajes/segundo)")
+    print(f"⏳ Rechazos de la Bot API falsa (flood wait): {api.rejected}")
+    print(f"💬 Latencia interactiva durante la difusión: p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=300)
+    parser.add_argument('--interactive', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.recipients, args.interactive))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Comparar arranque y memoria al cargar el catálogo desde JSON, snapshot binario y MongoDB.
+
+Uso:
+    python benchmarks/bench_snapshot.py --sizes 1000 10000 100000 [--mongo]
+
+Genera catálogos sintéticos a partir de migration/products.json. Cada carga se
+mide en un proceso nuevo: tiempo hasta tener el catálogo listo y leer un
+producto por ID, y memoria residente (RSS) después de la carga. `--mongo`
+necesita MONGODB_URI y usa la base de datos `SnapshotBench`.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def synthetic_catalog(size):
+    with open(os.path.join(ROOT, 'migration', 'products.json'), encoding='utf-8') as file:
+        base = json.load(file)
+    products = []
+    for i in range(size):
+        product = dict(base['products'][i % len(base['products'])])
+        product['id'] = f"P{i:07d}"
+        product['name'] = f"{product['name']} #{i}"
+        products.append(product)
+    return {'store_info': base['store_info'], 'categories': base['categories'], 'products': products}
+
+
+def worker(mode, path, lookup_id):
+    baseline = rss_mb()
+    start = time.perf_counter()
+    if mode == 'json':
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        product = next(p for p in data['products'] if p['id'] == lookup_id)
+    elif mode == 'snapshot':
+        from catalog_snapshot import CatalogSnapshot
+        product = CatalogSnapshot(path)[lookup_id]
+    else:
+        from pymongo import MongoClient
+        db = MongoClient(os.getenv('MONGODB_URI'))['SnapshotBench']
+        products = list(db.products.find({}, {'_id': 0}))
+        product = next(p for p in products if p['id'] == lookup_id)
+    elapsed = time.perf_counter() - start
+    assert product['name']
+    print(json.dumps({'seconds': elapsed, 'rss_mb': rss_mb() - baseline}))
+
+
+def measure(mode, path, lookup_id):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', mode, path, lookup_id],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--mongo', action='store_true')
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    from catalog_snapshot import write_snapshot
+
+    print(f"{'productos':>10} {'modo':>9} {'arranque':>10} {'RSS':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            data = synthetic_catalog(size)
+            json_path = os.path.join(directory, f'{size}.json')
+            snapshot_path = os.path.join(directory, f'{size}.snap')
+            with open(json_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+            write_snapshot(data, snapshot_path)
+            lookup_id = data['products'][size // 2]['id']
+
+            modes = [('json', json_path), ('snapshot', snapshot_path)]
+            if args.mongo:
+                from pymongo import MongoClient
+                db = MongoClient(os.getenv('MONGODB_URI'))['SnapshotBench']
+                db.products.delete_many({})
+                db.products.insert_many([dict(product) for product in data['products']])
+                modes.append(('mongo', ''))
+
+            for mode, path in modes:
+                result = measure(mode, path, lookup_id)
+                print(f"{size:>10} {mode:>9} {result['seconds'] * 1000:>8.1f}ms {result['rss_mb']:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Medir cómo escala el renderizado del catálogo con el pool de procesos y cuánto bloquea el bucle de eventos.
+
+Uso:
+    python benchmarks/bench_workers.py --products 200000 --workers 0 1 2 4 8
+
+Para cada número de procesos (0 = en un hilo del proceso principal) construye
+el contexto de GPT y el listado de /productos de un catálogo sintético y
+muestra el tiempo total, la aceleración frente a 0 procesos y el retraso
+máximo del bucle de eventos mientras tanto (un latido cada 10 ms).
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_snapshot import synthetic_catalog
+
+
+async def heartbeat(stop, interval=0.01):
+    """Retraso máximo observado entre latidos del bucle de eventos"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def measure(workers, products, chunk_size):
+    from workers import CatalogWorkerPool, CONTEXT, LISTING
+
+    pool = CatalogWorkerPool(max_workers=workers, chunk_size=chunk_size, min_products=0)
+    pool.start()
+    if workers > 0:
+        # Esperar a que los procesos estén listos para no medir su arranque
+        await asyncio.to_thread(pool.run_sync, CONTEXT, products[:workers * 10])
+
+    stop = asyncio.Event()
+    lag = asyncio.ensure_future(heartbeat(stop))
+    start = time.perf_counter()
+    await pool.run(CONTEXT, products, key='bench')
+    await pool.run(LISTING, products, key='bench')
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst_lag = await lag
+    pool.shutdown()
+    return elapsed, worst_lag
+
+
+async def superseded(products, chunk_size):
+    """Comprobar que una versión nueva cancela la construcción en curso"""
+    from workers import CatalogWorkerPool, BuildSuperseded, CONTEXT
+
+    pool = CatalogWorkerPool(max_workers=2, chunk_size=chunk_size, min_products=0)
+    first = asyncio.ensure_future(pool.run(CONTEXT, products, key='bench'))
+    await asyncio.sleep(0.05)
+    second = await pool.run(CONTEXT, products[:1000], key='bench')
+    try:
+        await first
+        outcome = "la primera construcción terminó"
+    except BuildSuperseded:
+        outcome = "la primera construcción se canceló"
+    pool.shutdown()
+    return outcome, len(second)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=200000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    products = synthetic_catalog(args.products)['products']
+    print(f"{args.products} productos, {os.cpu_count()} CPUs")
+    print(f"{'procesos':>9} {'tiempo':>10} {'aceleración':>12} {'retraso máx. del bucle':>24}")
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        elapsed, worst_lag = asyncio.run(measure(workers, products, args.chunk_size))
+        baseline = baseline or elapsed
+        print(f"{workers:>9} {elapsed:>9.2f}s {baseline / elapsed:>11.2f}x {worst_lag * 1000:>22.1f}ms")
+
+    outcome, rendered = asyncio.run(superseded(products, args.chunk_size))
+    print(f"Cancelación por versión nueva: {outcome}; la nueva renderizó {rendered} productos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Servidor HTTP local que imita `POST /v1/chat/completions` de OpenAI, para benchmarks.
+
+Uso:
+    python benchmarks/fake_openai_server.py --port 8089 --latency 0.8 --handshake 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python productsv2.py
+
+Atiende HTTP/1.1 con keep-alive. `--latency` es el tiempo de "generación"
+de cada respuesta y `--handshake` simula el coste de abrir una conexión
+nueva (TCP y TLS contra la API real), que se paga una vez por conexión.
+Cuenta las conexiones abiertas y las solicitudes atendidas.
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+
+
+def completion(messages, model, completion_tokens):
+    prompt_tokens = sum(len(message.get('content') or '') for message in messages) // 4
+    return {
+        'id': f'chatcmpl-fake-{random.getrandbits(48):x}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': 'respuesta ' * completion_tokens},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class FakeOpenAIServer:
+    """
+    `latency` es un número o una función sin argumentos que devuelve los
+    segundos de cada respuesta; `handshake` se espera al abrir cada conexión.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, handshake=0.0, seed=1):
+        self.host = host
+        self.port = port
+        self.latency = latency if callable(latency) else (lambda: latency)
+        self.handshake = handshake
+        self.rng = random.Random(seed)
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/v1'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            if self.handshake:
+                await asyncio.sleep(self.handshake)
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', '0') or 0))
+                self.requests += 1
+
+                request = json.loads(body or b'{}')
+                await asyncio.sleep(self.latency())
+                payload = json.dumps(completion(
+                    request.get('messages', []), request.get('model', 'gpt-3.5-turbo'),
+                    self.rng.randint(40, 250)
+                )).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    + f'Content-Length: {len(payload)}\r\n'.encode()
+                    + (b'Connection: keep-alive\r\n' if keep_alive else b'Connection: close\r\n')
+                    + b'\r\n' + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    server = await FakeOpenAIServer(args.host, args.port, args.latency, args.handshake).start()
+    print(f"🧪 Servidor OpenAI simulado en {server.base_url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.8)
+    parser.add_argument('--handshake', type=float, default=0.05)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
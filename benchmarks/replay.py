@@ -0,0 +1,399 @@
+"""
+Reproducir una traza de actualizaciones grabada (TRACE_FILE) contra un StoreBot local y detectar regresiones.
+
+Uso:
+    python benchmarks/replay.py trace.jsonl.gz [--speed 10] [--save-baseline baseline.json]
+    python benchmarks/replay.py trace.jsonl.gz --speed 10 --baseline baseline.json
+    python benchmarks/replay.py --sample-trace trace.jsonl.gz   # traza sintética de ejemplo
+
+Telegram y MongoDB se sustituyen por dobles en memoria y OpenAI por un
+servidor local (benchmarks/fake_openai_server.py), todos con latencias
+configurables, así que la prueba mide el propio bot: colas, control de
+admisión, cuotas, renderizado del catálogo y recomendaciones. Con `--speed`
+mayor que 1 la traza se acelera (y la ventana de la cuota por usuario se
+reduce en la misma proporción). Muestra la distribución de latencias por
+handler, el rendimiento y la memoria, y con `--baseline` termina con código 1
+si alguna métrica empeora más allá de los umbrales.
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import asyncio
+import argparse
+import resource
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# productsv2 exige estas variables al importarse; en la reproducción nunca se usan
+os.environ.setdefault('OPENAI_API_KEY', 'replay')
+os.environ.setdefault('MONGODB_URI', 'mongodb://replay')
+os.environ.setdefault('TELEGRAM_TOKEN', 'replay')
+
+from bench_snapshot import synthetic_catalog
+from fake_openai_server import FakeOpenAIServer
+from category_summaries import summarize_products
+
+
+def rss_peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# --- MongoDB en memoria -------------------------------------------------------
+
+def _lookup(document, path):
+    for part in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def _matches(document, query):
+    for path, condition in (query or {}).items():
+        value = _lookup(document, path)
+        if isinstance(condition, dict):
+            if '$ne' in condition and value == condition['$ne']:
+                return False
+            if '$in' in condition and value not in condition['$in']:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document, projection):
+    document = dict(document)
+    if projection and projection.get('_id') == 0:
+        document.pop('_id', None)
+    return document
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def batch_size(self, size):
+        return self
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class FakeCollection:
+    """Colección en memoria con las operaciones que usa el bot y una latencia por operación"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.documents = []
+        self.writes = 0
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def find(self, query=None, projection=None):
+        self._wait()
+        return FakeCursor([_project(document, projection) for document in self.documents if _matches(document, query)])
+
+    def find_one(self, query=None, projection=None):
+        for document in self.find(query, projection):
+            return document
+        return None
+
+    def insert_many(self, documents):
+        self.documents.extend(dict(document) for document in documents)
+
+    def bulk_write(self, operations, ordered=True):
+        self._wait()
+        self.writes += len(operations)
+
+    def update_many(self, query, update):
+        self._wait()
+        self.writes += 1
+
+    def delete_many(self, query):
+        self._wait()
+        self.writes += 1
+
+    def aggregate(self, pipeline, **kwargs):
+        self._wait()
+        return FakeCursor([])
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+
+class FakeDatabase(dict):
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def __getattr__(self, name):
+        if name not in self:
+            self[name] = FakeCollection(self.latency)
+        return dict.__getitem__(self, name)
+
+    __getitem__ = __getattr__
+
+
+class FakeConnections:
+    """Sustituto de MongoConnectionManager con una base de datos en memoria por tienda"""
+
+    def __init__(self, data, latency):
+        self.databases = {}
+        self.data = data
+        self.latency = latency
+
+    def database(self, name):
+        if name not in self.databases:
+            db = self.databases[name] = FakeDatabase(self.latency)
+            db.storeInfo.insert_many([self.data['store_info']])
+            db.categories.insert_many({'name': category} for category in self.data['categories'])
+            db.products.insert_many(self.data['products'])
+            db.category_summaries.insert_many(summarize_products(self.data['products']))
+        return self.databases[name]
+
+    catalog_database = database
+
+    def warmup(self, name):
+        pass
+
+
+# --- Telegram y OpenAI --------------------------------------------------------
+
+class FakeBot:
+    """Bot de Telegram que solo cuenta los envíos, con una latencia por llamada"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        return types.SimpleNamespace(chat_id=chat_id, text=text)
+
+    async def send_chat_action(self, chat_id, action, **kwargs):
+        await asyncio.sleep(self.latency)
+
+
+async def start_fake_openai(mean_latency, handshake, seed):
+    """
+    Servidor local que imita la API de OpenAI, con latencia log-normal; el bot
+    lo usa a través de su cliente real (OPENAI_BASE_URL), con el mismo pool de conexiones
+    """
+    rng = random.Random(seed)
+    server = await FakeOpenAIServer(latency=lambda: rng.lognormvariate(0, 0.5) * mean_latency,
+                                    handshake=handshake, seed=seed).start()
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    return server
+
+
+def make_update(user_id, text):
+    async def reply_text(reply, **kwargs):
+        return reply
+
+    user = types.SimpleNamespace(id=user_id, first_name=f'replay-{user_id}')
+    message = types.SimpleNamespace(from_user=user, text=text, chat_id=user_id, reply_text=reply_text)
+    return types.SimpleNamespace(message=message, effective_message=message,
+                                 effective_chat=types.SimpleNamespace(id=user_id), effective_user=user)
+
+
+# --- Reproducción -------------------------------------------------------------
+
+async def replay(events, args):
+    openai_server = await start_fake_openai(args.openai_latency, args.openai_handshake, args.seed)
+    # Los textos de las fichas de producto se redactan una vez por producto y se guardan en MongoDB:
+    # en producción no compiten con los mensajes, así que la reproducción no los genera
+    os.environ.setdefault('PRODUCT_CARDS_COPY', '0')
+    from productsv2 import StoreBot, CONCURRENT_UPDATES
+
+    data = synthetic_catalog(args.catalog_size)
+    memory_before = rss_peak_mb()
+    fake_bot = FakeBot(args.telegram_latency)
+    bot = StoreBot(telegram_token='replay', db_name='Replay',
+                   connections=FakeConnections(data, args.mongo_latency), tenant='replay',
+                   warmup_manifest=args.warmup_manifest)
+    bot.quota.rate_window = bot.quota.rate_window / args.speed
+    await bot.post_init(types.SimpleNamespace(bot=fake_bot))
+    # Como en un despliegue, el calentamiento termina antes de que llegue el tráfico
+    await bot.warmup.wait()
+
+    user_ids = {}
+    slots = asyncio.Semaphore(CONCURRENT_UPDATES)
+    latencies = {}
+    errors = {}
+    dispatch_lag = []
+
+    async def dispatch(event, scheduled):
+        handler = getattr(bot, event['handler'], None)
+        if handler is None:
+            return
+        user_id = user_ids.setdefault(event['user'], 1000 + len(user_ids))
+        text = event.get('text', '')
+        context = types.SimpleNamespace(bot=fake_bot, args=text.split()[1:] if text.startswith('/') else [])
+        async with slots:
+            try:
+                await handler(make_update(user_id, text), context)
+            except Exception:
+                errors[event['handler']] = errors.get(event['handler'], 0) + 1
+        latencies.setdefault(event['handler'], []).append(time.monotonic() - scheduled)
+
+    start = time.monotonic()
+    tasks = []
+    for event in events:
+        scheduled = start + event['t'] / args.speed
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        dispatch_lag.append(max(0.0, time.monotonic() - scheduled))
+        tasks.append(asyncio.ensure_future(dispatch(event, scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start
+    await bot.post_shutdown(types.SimpleNamespace(bot=fake_bot))
+    await openai_server.stop()
+
+    all_latencies = [latency for samples in latencies.values() for latency in samples]
+    handlers = {
+        name: {
+            'count': len(samples),
+            'p50': percentile(samples, 0.50),
+            'p95': percentile(samples, 0.95),
+            'p99': percentile(samples, 0.99),
+            'errors': errors.get(name, 0),
+        }
+        for name, samples in sorted(latencies.items())
+    }
+    handlers['all'] = {
+        'count': len(all_latencies),
+        'p50': percentile(all_latencies, 0.50),
+        'p95': percentile(all_latencies, 0.95),
+        'p99': percentile(all_latencies, 0.99),
+        'errors': sum(errors.values()),
+    }
+    return {
+        'events': len(events),
+        'speed': args.speed,
+        'seconds': elapsed,
+        'throughput': len(events) / elapsed if elapsed > 0 else 0.0,
+        'dispatch_lag_max': max(dispatch_lag, default=0.0),
+        'memory_mb': rss_peak_mb() - memory_before,
+        'messages_sent': fake_bot.sent,
+        'quota_rejections': bot.quota.rejected,
+        'openai_connections': openai_server.connections,
+        'response_cache_hits': dict(bot.responses.hits),
+        'handlers': handlers,
+    }
+
+
+def print_results(results):
+    print(f"\n{results['events']} actualizaciones a {results['speed']}x en {results['seconds']:.1f} s "
+          f"({results['throughput']:.1f}/s), memoria +{results['memory_mb']:.1f} MB, "
+          f"retraso máx. de despacho {results['dispatch_lag_max'] * 1000:.1f} ms, "
+          f"{results['messages_sent']} mensajes enviados, {results['quota_rejections']} rechazos por cuota, "
+          f"{results.get('openai_connections', 0)} conexiones con OpenAI")
+    hits = results.get('response_cache_hits')
+    if hits:
+        print(f"Respuestas desde caché: {sum(hits.values())} ({hits.get('warmup', 0)} precargadas por el calentamiento)")
+    print(f"{'handler':>20} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'errores':>8}")
+    for name, stats in results['handlers'].items():
+        print(f"{name:>20} {stats['count']:>6} {stats['p50'] * 1000:>7.1f}ms {stats['p95'] * 1000:>7.1f}ms "
+              f"{stats['p99'] * 1000:>7.1f}ms {stats['errors']:>8}")
+
+
+def compare(results, baseline, args):
+    """Lista de regresiones frente a la línea base"""
+    regressions = []
+    for name, stats in results['handlers'].items():
+        reference = baseline['handlers'].get(name)
+        if reference is None or stats['count'] < args.min_samples:
+            continue
+        limit = reference['p95'] * (1 + args.max_latency_regression) + args.latency_floor
+        if stats['p95'] > limit:
+            regressions.append(f"p95 de {name}: {stats['p95'] * 1000:.1f} ms (línea base {reference['p95'] * 1000:.1f} ms)")
+        if stats['errors'] > reference['errors']:
+            regressions.append(f"errores en {name}: {stats['errors']} (línea base {reference['errors']})")
+    if results['throughput'] < baseline['throughput'] * (1 - args.max_throughput_drop):
+        regressions.append(f"rendimiento: {results['throughput']:.1f}/s (línea base {baseline['throughput']:.1f}/s)")
+    if results['memory_mb'] > baseline['memory_mb'] * (1 + args.max_memory_growth) + args.memory_floor:
+        regressions.append(f"memoria: +{results['memory_mb']:.1f} MB (línea base +{baseline['memory_mb']:.1f} MB)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('trace', nargs='?', help="Traza grabada con TRACE_FILE (se leen todas sus sesiones) o una sesión concreta")
+    parser.add_argument('--speed', type=float, default=1.0, help="Factor de aceleración (1 = tiempo real)")
+    parser.add_argument('--limit', type=int, help="Reproducir solo las primeras N actualizaciones")
+    parser.add_argument('--catalog-size', type=int, default=1000)
+    parser.add_argument('--openai-latency', type=float, default=1.2, help="Latencia media de OpenAI (segundos)")
+    parser.add_argument('--openai-handshake', type=float, default=0.05, help="Coste de abrir una conexión con OpenAI")
+    parser.add_argument('--telegram-latency', type=float, default=0.03)
+    parser.add_argument('--mongo-latency', type=float, default=0.002)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', help="Comparar con esta línea base y salir con 1 si hay regresiones")
+    parser.add_argument('--save-baseline', help="Guardar los resultados como línea base")
+    parser.add_argument('--max-latency-regression', type=float, default=0.25)
+    parser.add_argument('--latency-floor', type=float, default=0.005, help="Margen absoluto de latencia (segundos)")
+    parser.add_argument('--max-throughput-drop', type=float, default=0.15)
+    parser.add_argument('--max-memory-growth', type=float, default=0.25)
+    parser.add_argument('--memory-floor', type=float, default=5.0, help="Margen absoluto de memoria (MB)")
+    parser.add_argument('--min-samples', type=int, default=20)
+    parser.add_argument('--warmup-manifest', metavar='PATH',
+                        help="Manifiesto de calentamiento que el bot reproduce al arrancar")
+    parser.add_argument('--sample-trace', metavar='PATH', help="Escribir una traza sintética de ejemplo y salir")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    from tracing import read_trace, write_trace, sample_trace
+
+    if args.sample_trace:
+        events = sample_trace()
+        write_trace(args.sample_trace, events)
+        print(f"✅ Traza sintética con {len(events)} actualizaciones escrita en {args.sample_trace}")
+        return 0
+    if not args.trace:
+        parser.error("indica una traza o usa --sample-trace")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR, force=True)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+    events = read_trace(args.trace)[:args.limit]
+    results = asyncio.run(replay(events, args))
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f"\n💾 Línea base guardada en {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args)
+        if regressions:
+            print("\n❌ Regresiones frente a la línea base:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("\n✅ Sin regresiones frente a la línea base")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from telegram.error import Forbidden
+
+from outbound import BULK
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '500'))
+CUSTOMERS_FLUSH_INTERVAL = float(os.getenv('CUSTOMERS_FLUSH_INTERVAL', '30'))
+
+
+class CustomerRegistry:
+    """
+    Registro de los chats que han hablado con el bot (colección `customers`).
+    Los chats vistos se acumulan en memoria y se guardan por lotes.
+    """
+
+    def __init__(self, collection, flush_interval=CUSTOMERS_FLUSH_INTERVAL):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self._seen = {}
+        self._last_flush = time.time()
+
+    def touch(self, chat_id):
+        self._seen[chat_id] = datetime.now(timezone.utc)
+
+    def should_flush(self):
+        return bool(self._seen) and time.time() - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        """Guardar los chats vistos con una sola escritura por lotes"""
+        if not self._seen:
+            return 0
+        seen, self._seen = self._seen, {}
+        self._last_flush = time.time()
+
+        from pymongo import UpdateOne
+
+        operations = [
+            UpdateOne({"chat_id": chat_id}, {"$set": {"last_seen": last_seen, "blocked": False}}, upsert=True)
+            for chat_id, last_seen in seen.items()
+        ]
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"❌ Error al guardar clientes: {str(e)}")
+            for chat_id, last_seen in seen.items():
+                self._seen.setdefault(chat_id, last_seen)
+            return 0
+        return len(operations)
+
+    def iter_batches(self, batch_size=BROADCAST_BATCH_SIZE):
+        """Recorrer los chats activos en lotes sin cargar toda la colección en memoria"""
+        cursor = self.collection.find({"blocked": {"$ne": True}}, {"chat_id": 1, "_id": 0}).batch_size(batch_size)
+        batch = []
+        for customer in cursor:
+            batch.append(customer['chat_id'])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def mark_blocked(self, chat_ids):
+        if chat_ids:
+            self.collection.update_many({"chat_id": {"$in": list(chat_ids)}}, {"$set": {"blocked": True}})
+
+
+class BroadcastReport:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rate(self):
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"📣 Difusión completada en {self.elapsed:.1f} segundos\n"
+            f"✅ Enviados: {self.sent}\n"
+            f"🚫 Bloqueados: {self.blocked}\n"
+            f"❌ Fallidos: {self.failed}\n"
+            f"📈 Velocidad: {self.rate:.1f} mensajes/segundo"
+        )
+
+
+async def broadcast(outbound, registry, text, batch_size=BROADCAST_BATCH_SIZE, on_progress=None):
+    """
+    Enviar `text` a todos los clientes con prioridad baja.
+
+    Los destinatarios se leen de MongoDB lote a lote y cada lote se encola
+    solo cuando el anterior ha salido, así que la cola nunca contiene más de
+    `batch_size` mensajes masivos y las respuestas interactivas no esperan.
+    """
+    report = BroadcastReport()
+    batches = registry.iter_batches(batch_size)
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        futures = [outbound.send(chat_id, text, priority=BULK) for chat_id in batch]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        blocked = []
+        for chat_id, result in zip(batch, results):
+            if isinstance(result, Forbidden):
+                blocked.append(chat_id)
+                report.blocked += 1
+            elif isinstance(result, Exception):
+                report.failed += 1
+            else:
+                report.sent += 1
+        if blocked:
+            await asyncio.to_thread(registry.mark_blocked, blocked)
+
+        logger.info(f"📣 Difusión: {report.sent} enviados, {report.failed + report.blocked} fallidos, "
+                    f"{report.rate:.1f} mensajes/segundo")
+        if on_progress is not None:
+            await on_progress(report)
+
+    report.finished = time.time()
+    return report
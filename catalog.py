@@ -0,0 +1,169 @@
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+
+def format_product_line(product):
+    """Representación de un producto para el contexto del sistema de GPT"""
+    product_info = (
+        f"ID: {product.get('id', 'N/A')}, "
+        f"Nombre: {product.get('name', 'N/A')}, "
+        f"Categoría: {product.get('category', 'N/A')}, "
+        f"Precio: ${product.get('price', 0):.2f}, "
+        f"Descripción: {product.get('description', 'N/A')}, "
+        f"Stock: {product.get('stock', 0)} unidades, "
+        f"Disponible: {'Sí' if product.get('disponible', False) else 'No'}"
+    )
+
+    # Añadir información de ofertas si existe
+    ofertas = product.get('ofertas', {})
+    if ofertas.get('activa', False):
+        product_info += (
+            f", OFERTA: {ofertas.get('descuento', '')} de descuento, "
+            f"Precio de oferta: ${ofertas.get('precio_oferta', 0):.2f}, "
+            f"Válido hasta: {ofertas.get('fecha_fin', 'N/A')}"
+        )
+
+    return product_info
+
+
+def build_system_context(store_info, products_info):
+    """
+    Crear el mensaje del sistema a partir de la tienda y las líneas de productos ya formateadas.
+
+    Lo que casi nunca cambia va primero (instrucciones, luego datos de la tienda) y el
+    catálogo al final: así el prefijo del prompt se mantiene idéntico entre versiones y
+    la caché de prefijos de OpenAI lo reutiliza.
+    """
+    store_name = store_info.get('name', 'Nuestra Tienda')
+    store_desc = store_info.get('description', '')
+
+    return f"""
+Eres un asistente virtual para la tienda {store_name}. 
+{store_desc}
+
+INSTRUCCIONES:
+1. Debes actuar siempre como un representante amable y profesional de {store_name}.
+2. Proporciona información precisa sobre los productos, precios y disponibilidad.
+3. Si un producto está en oferta, asegúrate de mencionarlo y destacar el descuento.
+4. Si un cliente pregunta por un producto que no está en el catálogo, indícale amablemente que no está disponible pero sugiere alternativas similares.
+5. Para compras, indica al cliente que puede realizar el pedido en nuestra tienda física, a través de nuestra web o en este mismo chat.
+6. Cuando el cliente pregunte por el proceso de compra, explícale que puede pagar con tarjeta de crédito, PayPal o transferencia bancaria.
+7. Mantén un tono conversacional, amable y cercano en todo momento.
+8. Si te preguntan sobre un tema que no está relacionado con la tienda o los productos, redirígelos amablemente de vuelta a temas relacionados con nuestra tienda.
+
+INFORMACIÓN DE LA TIENDA:
+- Nombre: {store_info.get('name', 'N/A')}
+- Horario: {store_info.get('horario', 'N/A')}
+- Dirección: {store_info.get('direccion', 'N/A')}
+- Teléfono: {store_info.get('telefono', 'N/A')}
+- Email: {store_info.get('email', 'N/A')}
+- Política de envíos: {store_info.get('politica_envios', 'N/A')}
+- Política de devoluciones: {store_info.get('politica_devoluciones', 'N/A')}
+
+CATÁLOGO DE PRODUCTOS:
+{chr(10).join(products_info)}
+"""
+
+
+def product_sort_key(product_id):
+    """Orden estable de los IDs de producto (numéricos primero, luego como texto)"""
+    if isinstance(product_id, (int, float)) and not isinstance(product_id, bool):
+        return (0, product_id, '')
+    return (1, 0, str(product_id))
+
+
+def ordered_lines(product_lines, product_ids=None):
+    """
+    Líneas del catálogo ordenadas por ID, independientemente del orden en que se
+    cargaron o actualizaron: todas las instancias generan el mismo prompt
+    """
+    product_ids = product_lines.keys() if product_ids is None else product_ids
+    return [product_lines[product_id] for product_id in sorted(product_ids, key=product_sort_key)]
+
+
+def format_listing_line(product):
+    """Línea de un producto en el listado de /productos"""
+    price = product.get('price', 0)
+    name = product.get('name', 'Producto sin nombre')
+
+    # Verificar si hay oferta
+    ofertas = product.get('ofertas', {})
+    if ofertas.get('activa', False):
+        price_text = f"${price:.2f} 🔥 OFERTA: ${ofertas.get('precio_oferta', 0):.2f}"
+    else:
+        price_text = f"${price:.2f}"
+
+    return f"• {name}: {price_text}"
+
+
+def group_listing_lines(products):
+    """Agrupar las líneas del listado por categoría, en el orden del catálogo"""
+    categories = {}
+    for product in products:
+        category = product.get('category', 'Sin categoría')
+        categories.setdefault(category, []).append(format_listing_line(product))
+    return categories
+
+
+def build_catalog_listing(categories):
+    """Mensaje de /productos a partir de las líneas agrupadas por categoría"""
+    message_parts = ["📋 Nuestro catálogo de productos:\n"]
+
+    for category, items in categories.items():
+        message_parts.append(f"\n📁 {category}:")
+        message_parts.extend(items)
+
+    message_parts.append("\n\nToca un producto para ver su ficha completa o pregúntame por su nombre.")
+    return "\n".join(message_parts)
+
+
+def normalize_text(text):
+    """Minúsculas y sin acentos, para comparar texto escrito por usuarios con el catálogo"""
+    decomposed = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def validate_catalog(data):
+    """Comprobar la estructura de un catálogo; devuelve la lista de errores encontrados"""
+    if not isinstance(data, dict):
+        return ["El catálogo debe ser un objeto JSON"]
+    errors = []
+    if not isinstance(data.get('store_info', {}), dict):
+        errors.append("`store_info` debe ser un objeto")
+    products = data.get('products')
+    if products is None:
+        return errors + ["Falta la lista `products`"]
+
+    seen = set()
+    for position, product in enumerate(products):
+        label = f"Producto #{position + 1}"
+        if not hasattr(product, 'get'):
+            errors.append(f"{label}: debe ser un objeto")
+            continue
+        product_id = product.get('id')
+        if not product_id:
+            errors.append(f"{label}: falta `id`")
+        elif product_id in seen:
+            errors.append(f"{label}: `id` duplicado ({product_id})")
+        seen.add(product_id)
+        if not product.get('name'):
+            errors.append(f"{label} ({product_id}): falta `name`")
+        price = product.get('price', 0)
+        if not isinstance(price, (int, float)) or isinstance(price, bool) or price < 0:
+            errors.append(f"{label} ({product_id}): `price` no válido ({price!r})")
+        ofertas = product.get('ofertas', {})
+        if ofertas and not isinstance(ofertas.get('precio_oferta', 0), (int, float)):
+            errors.append(f"{label} ({product_id}): `ofertas.precio_oferta` no válido")
+    return errors
+
+
+def diff_products(old_products, new_products):
+    """Comparar dos listas de productos por `id`; devuelve (añadidos, eliminados, modificados)"""
+    old = {product.get('id'): product for product in old_products}
+    new = {product.get('id'): product for product in new_products}
+    added = [product_id for product_id in new if product_id not in old]
+    removed = [product_id for product_id in old if product_id not in new]
+    changed = [product_id for product_id in new if product_id in old and old[product_id] != new[product_id]]
+    return added, removed, changed
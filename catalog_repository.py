@@ -0,0 +1,358 @@
+import os
+import re
+import json
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from catalog import normalize_text
+from catalog_snapshot import CatalogSnapshot, load_products_data
+
+logger = logging.getLogger(__name__)
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+# Sentencias preparadas que sqlite3 mantiene en caché por conexión
+SQLITE_CACHED_STATEMENTS = int(os.getenv('SQLITE_CACHED_STATEMENTS', '128'))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '16384'))
+
+
+class CatalogRepository(ABC):
+    """
+    Interfaz común de los almacenes del catálogo (JSON/snapshot, MongoDB y SQLite).
+
+    Los productos se devuelven como diccionarios con la misma estructura que
+    `products.json`, así que el resto del bot no depende del almacén elegido.
+    """
+
+    backend = None
+
+    @abstractmethod
+    def store_info(self):
+        """Información de la tienda"""
+
+    @abstractmethod
+    def categories(self):
+        """Nombres de las categorías"""
+
+    @abstractmethod
+    def products(self):
+        """Todos los productos del catálogo"""
+
+    @abstractmethod
+    def get(self, product_id):
+        """Producto con el ID indicado, o None"""
+
+    @abstractmethod
+    def by_category(self, category):
+        """Productos de una categoría"""
+
+    @abstractmethod
+    def active_offers(self):
+        """Productos con una oferta activa"""
+
+    @abstractmethod
+    def search(self, text, limit=10):
+        """Productos cuyo nombre, descripción o categoría coinciden con `text`"""
+
+    def as_products_data(self):
+        """El catálogo completo con la estructura de `products.json`"""
+        return {
+            'store_info': self.store_info(),
+            'categories': self.categories(),
+            'products': self.products(),
+        }
+
+    def close(self):
+        pass
+
+
+def _search_words(text):
+    return re.findall(r'\w+', normalize_text(text))
+
+
+class JsonCatalogRepository(CatalogRepository):
+    """Catálogo en `products.json` o en un snapshot `.snap`, consultado en memoria"""
+
+    backend = 'json'
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        # Un snapshot se abre sin recorrer sus productos: los IDs se buscan en su propio índice
+        self.snapshot = CatalogSnapshot(file_path) if str(file_path).endswith('.snap') else None
+        self.data = self.snapshot.as_products_data() if self.snapshot is not None else load_products_data(file_path)
+        self._by_id = None
+        self._search_text = None
+
+    def store_info(self):
+        return self.data.get('store_info', {})
+
+    def categories(self):
+        return list(self.data.get('categories', []))
+
+    def products(self):
+        return self.data.get('products', [])
+
+    def as_products_data(self):
+        return self.data
+
+    def get(self, product_id):
+        if self.snapshot is not None:
+            # Los IDs del snapshot se guardan como texto
+            return self.snapshot.get(str(product_id))
+        if self._by_id is None:
+            # Índice por ID de products.json, construido en la primera consulta
+            self._by_id = {product.get('id'): product for product in self.products()}
+        return self._by_id.get(product_id)
+
+    def by_category(self, category):
+        return [product for product in self.products() if product.get('category') == category]
+
+    def active_offers(self):
+        return [product for product in self.products() if product.get('ofertas', {}).get('activa', False)]
+
+    def search(self, text, limit=10):
+        words = _search_words(text)
+        if not words:
+            return []
+        if self._search_text is None:
+            # Texto normalizado de cada producto, calculado en la primera búsqueda
+            self._search_text = [
+                (normalize_text(' '.join(str(product.get(field, '')) for field in ('name', 'description', 'category'))),
+                 product)
+                for product in self.products()
+            ]
+        results = []
+        for haystack, product in self._search_text:
+            if all(word in haystack for word in words):
+                results.append(product)
+                if len(results) >= limit:
+                    break
+        return results
+
+
+class MongoCatalogRepository(CatalogRepository):
+    """Catálogo en las colecciones `storeInfo`, `categories` y `products` de MongoDB"""
+
+    backend = 'mongodb'
+
+    def __init__(self, db):
+        self.db = db
+
+    def store_info(self):
+        return self.db.storeInfo.find_one({}, {'_id': 0}) or {}
+
+    def categories(self):
+        return [category['name'] for category in self.db.categories.find({}, {'_id': 0, 'name': 1})]
+
+    def products(self):
+        return list(self.db.products.find({}, {'_id': 0}))
+
+    def get(self, product_id):
+        return self.db.products.find_one({'id': product_id}, {'_id': 0})
+
+    def by_category(self, category):
+        return list(self.db.products.find({'category': category}, {'_id': 0}))
+
+    def active_offers(self):
+        return list(self.db.products.find({'ofertas.activa': True}, {'_id': 0}))
+
+    def search(self, text, limit=10):
+        words = re.findall(r'\w+', text)
+        if not words:
+            return []
+        # Cada palabra debe aparecer en el nombre, la descripción o la categoría
+        query = {'$and': [
+            {'$or': [{field: {'$regex': re.escape(word), '$options': 'i'}}
+                     for field in ('name', 'description', 'category')]}
+            for word in words
+        ]}
+        return list(self.db.products.find(query, {'_id': 0}).limit(limit))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS store_info (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS categories (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS products (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    category TEXT,
+    description TEXT,
+    oferta_activa INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_category ON products (category);
+CREATE INDEX IF NOT EXISTS idx_products_oferta_activa ON products (oferta_activa) WHERE oferta_activa = 1;
+"""
+
+SQLITE_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, description, category,
+    content='products', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, name, description, category)
+    VALUES (new.rowid, new.name, new.description, new.category);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, description, category)
+    VALUES ('delete', old.rowid, old.name, old.description, old.category);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, description, category)
+    VALUES ('delete', old.rowid, old.name, old.description, old.category);
+    INSERT INTO products_fts (rowid, name, description, category)
+    VALUES (new.rowid, new.name, new.description, new.category);
+END;
+"""
+
+# Consultas fijas: al reutilizar el mismo texto SQL, sqlite3 reutiliza la sentencia preparada
+SQL_STORE_INFO = "SELECT data FROM store_info WHERE id = 1"
+SQL_CATEGORIES = "SELECT name FROM categories ORDER BY position"
+SQL_PRODUCTS = "SELECT data FROM products ORDER BY rowid"
+SQL_GET = "SELECT data FROM products WHERE id = ?"
+SQL_BY_CATEGORY = "SELECT data FROM products WHERE category = ? ORDER BY rowid"
+SQL_ACTIVE_OFFERS = "SELECT data FROM products WHERE oferta_activa = 1 ORDER BY rowid"
+SQL_SEARCH_FTS = (
+    "SELECT products.data FROM products_fts JOIN products ON products.rowid = products_fts.rowid "
+    "WHERE products_fts MATCH ? ORDER BY bm25(products_fts, 10.0, 1.0, 5.0) LIMIT ?"
+)
+SQL_SEARCH_LIKE = "SELECT data FROM products WHERE name LIKE ? OR description LIKE ? OR category LIKE ? LIMIT ?"
+SQL_UPSERT_PRODUCT = (
+    "INSERT INTO products (id, name, category, description, oferta_activa, data) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET name = excluded.name, category = excluded.category, "
+    "description = excluded.description, oferta_activa = excluded.oferta_activa, data = excluded.data"
+)
+
+
+class SqliteCatalogRepository(CatalogRepository):
+    """
+    Catálogo embebido en un archivo SQLite, sin servidor.
+
+    La base de datos usa WAL (las lecturas no se bloquean mientras se escribe),
+    índices por categoría y por ofertas activas y una tabla FTS5 sincronizada por
+    triggers para la búsqueda de texto. Cada hilo usa su propia conexión.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, file_path, create=False):
+        if not create and not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        self.file_path = file_path
+        self._local = threading.local()
+        self.has_fts = self._setup(self._connection())
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_path, cached_statements=SQLITE_CACHED_STATEMENTS,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+            connection.execute("PRAGMA temp_store = MEMORY")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _setup(connection):
+        with connection:
+            connection.executescript(SQLITE_SCHEMA)
+            try:
+                connection.executescript(SQLITE_FTS_SCHEMA)
+                return True
+            except sqlite3.OperationalError as e:
+                # SQLite compilado sin FTS5: la búsqueda usa LIKE
+                logger.warning(f"⚠️ FTS5 no disponible en SQLite ({str(e)}), la búsqueda usará LIKE")
+                return False
+
+    def _rows(self, sql, params=()):
+        return [json.loads(row[0]) for row in self._connection().execute(sql, params)]
+
+    def store_info(self):
+        row = self._connection().execute(SQL_STORE_INFO).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def categories(self):
+        return [row[0] for row in self._connection().execute(SQL_CATEGORIES)]
+
+    def products(self):
+        return self._rows(SQL_PRODUCTS)
+
+    def get(self, product_id):
+        row = self._connection().execute(SQL_GET, (product_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def by_category(self, category):
+        return self._rows(SQL_BY_CATEGORY, (category,))
+
+    def active_offers(self):
+        return self._rows(SQL_ACTIVE_OFFERS)
+
+    def search(self, text, limit=10):
+        words = re.findall(r'\w+', text)
+        if not words:
+            return []
+        if self.has_fts:
+            # Cada palabra como prefijo entre comillas: el texto del usuario nunca se interpreta como sintaxis FTS
+            query = ' '.join(f'"{word}"*' for word in words)
+            return self._rows(SQL_SEARCH_FTS, (query, limit))
+        pattern = f"%{' '.join(words)}%"
+        return self._rows(SQL_SEARCH_LIKE, (pattern, pattern, pattern, limit))
+
+    @staticmethod
+    def _product_row(product):
+        return (
+            product.get('id'),
+            product.get('name', ''),
+            product.get('category'),
+            product.get('description', ''),
+            1 if product.get('ofertas', {}).get('activa', False) else 0,
+            json.dumps(product, ensure_ascii=False),
+        )
+
+    def upsert_products(self, products):
+        """Insertar o actualizar productos por ID en una sola transacción"""
+        connection = self._connection()
+        with connection:
+            connection.executemany(SQL_UPSERT_PRODUCT, (self._product_row(product) for product in products))
+
+    def replace_all(self, data):
+        """Sustituir el catálogo completo (tienda, categorías y productos) en una sola transacción"""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM store_info")
+            connection.execute("INSERT INTO store_info (id, data) VALUES (1, ?)",
+                               (json.dumps(data.get('store_info', {}), ensure_ascii=False),))
+            connection.execute("DELETE FROM categories")
+            connection.executemany("INSERT INTO categories (name) VALUES (?)",
+                                   ((category,) for category in data.get('categories', [])))
+            connection.execute("DELETE FROM products")
+            connection.executemany(SQL_UPSERT_PRODUCT,
+                                   (self._product_row(product) for product in data.get('products', [])))
+        if self.has_fts:
+            with connection:
+                connection.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+        connection.execute("PRAGMA optimize")
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def open_catalog(file_path):
+    """Abrir el catálogo de un archivo según su extensión (.json, .snap o SQLite)"""
+    if str(file_path).lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteCatalogRepository(file_path)
+    return JsonCatalogRepository(file_path)
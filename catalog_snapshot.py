@@ -0,0 +1,405 @@
+import os
+import mmap
+import json
+import struct
+import logging
+from collections.abc import Mapping, MutableMapping, Sequence
+
+from catalog import format_product_line
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'CATSNAP\0'
+SNAPSHOT_VERSION = 1
+
+# Cabecera: magic, versión, reservado, nº de productos, nº de cadenas,
+# y las referencias (índices de cadena) a store_info, categorías y bloque de contexto
+HEADER = struct.Struct('<8sHHIIIII')
+# Tabla de secciones: desplazamiento de cada sección dentro del archivo
+SECTIONS = ('price', 'offer_price', 'stock', 'flags', 'strings', 'string_offsets', 'id_index', 'offer_rows')
+SECTION_TABLE = struct.Struct('<' + 'Q' * len(SECTIONS))
+
+# Columnas de texto: un índice de cadena (u32) por producto, con su propia tabla de desplazamientos
+STRING_COLUMNS = ('id', 'name', 'category', 'description', 'descuento', 'fecha_inicio', 'fecha_fin', 'specs')
+COLUMN_TABLE = struct.Struct('<' + 'Q' * len(STRING_COLUMNS))
+HEADER_SIZE = HEADER.size + SECTION_TABLE.size + COLUMN_TABLE.size
+
+FLAG_DISPONIBLE = 1
+FLAG_OFERTA_ACTIVA = 2
+FLAG_TIENE_OFERTA = 4
+FLAG_TIENE_PRECIO_OFERTA = 8
+
+EMPTY = 0  # Índice de la cadena vacía
+
+
+class SnapshotError(Exception):
+    """Archivo de snapshot inválido o de una versión no soportada"""
+
+
+def _align(buffer, size=8):
+    buffer.extend(b'\0' * (-len(buffer) % size))
+
+
+def write_snapshot(data, file_path):
+    """
+    Escribir un snapshot binario del catálogo (`store_info`, `categories`, `products`).
+
+    Las columnas numéricas son arreglos de ancho fijo, los textos se guardan
+    una sola vez en una tabla de cadenas y se referencian por índice, y un
+    índice ordenado por ID permite buscar productos sin recorrer el archivo.
+    """
+    products = data.get('products', [])
+    strings = ['']
+    string_ids = {'': EMPTY}
+
+    def intern(value):
+        if value is None:
+            return EMPTY
+        value = str(value)
+        index = string_ids.get(value)
+        if index is None:
+            index = string_ids[value] = len(strings)
+            strings.append(value)
+        return index
+
+    store_ref = intern(json.dumps(data.get('store_info', {}), ensure_ascii=False))
+    categories_ref = intern(json.dumps(data.get('categories', []), ensure_ascii=False))
+    context_ref = intern("\n".join(format_product_line(product) for product in products))
+
+    count = len(products)
+    prices, offer_prices, stocks, flags = [], [], [], bytearray()
+    columns = {column: [] for column in STRING_COLUMNS}
+    offer_rows = []
+    for row, product in enumerate(products):
+        ofertas = product.get('ofertas') or {}
+        prices.append(float(product.get('price', 0) or 0))
+        offer_prices.append(float(ofertas.get('precio_oferta', 0) or 0))
+        stocks.append(int(product.get('stock', 0) or 0))
+        flag = FLAG_DISPONIBLE if product.get('disponible', False) else 0
+        if ofertas.get('activa', False):
+            flag |= FLAG_OFERTA_ACTIVA
+        if 'ofertas' in product:
+            flag |= FLAG_TIENE_OFERTA
+        if 'precio_oferta' in ofertas:
+            flag |= FLAG_TIENE_PRECIO_OFERTA
+        flags.append(flag)
+        if ofertas.get('activa', False) or ofertas.get('fecha_inicio'):
+            offer_rows.append(row)
+
+        for column in STRING_COLUMNS:
+            if column in ('descuento', 'fecha_inicio', 'fecha_fin'):
+                value = ofertas.get(column)
+            elif column == 'specs':
+                value = json.dumps(product['specs'], ensure_ascii=False) if 'specs' in product else None
+            else:
+                value = product.get(column)
+            columns[column].append(intern(value))
+
+    id_index = sorted(range(count), key=lambda row: strings[columns['id'][row]])
+
+    encoded = [value.encode('utf-8') for value in strings]
+    string_offsets = [0]
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    buffer = bytearray(HEADER_SIZE)
+    sections = {}
+
+    def section(name, payload):
+        _align(buffer)
+        sections[name] = len(buffer)
+        buffer.extend(payload)
+
+    section('price', struct.pack(f'<{count}d', *prices))
+    section('offer_price', struct.pack(f'<{count}d', *offer_prices))
+    section('stock', struct.pack(f'<{count}i', *stocks))
+    section('flags', bytes(flags))
+    for column in STRING_COLUMNS:
+        section(f'col_{column}', struct.pack(f'<{count}I', *columns[column]))
+    section('string_offsets', struct.pack(f'<{len(string_offsets)}Q', *string_offsets))
+    section('id_index', struct.pack(f'<{count}I', *id_index))
+    section('offer_rows', struct.pack(f'<I{len(offer_rows)}I', len(offer_rows), *offer_rows))
+    section('strings', b''.join(encoded))
+
+    HEADER.pack_into(buffer, 0, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, count, len(strings),
+                     store_ref, categories_ref, context_ref)
+    SECTION_TABLE.pack_into(buffer, HEADER.size, *(sections[name] for name in SECTIONS))
+    COLUMN_TABLE.pack_into(buffer, HEADER.size + SECTION_TABLE.size,
+                           *(sections[f'col_{column}'] for column in STRING_COLUMNS))
+
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(buffer)
+    # Reemplazo atómico: los procesos que ya tienen el archivo mapeado siguen viendo el anterior
+    os.replace(temp_path, file_path)
+    logger.info(f"✅ Snapshot del catálogo escrito en {file_path}: {count} productos, {len(strings)} cadenas")
+    return file_path
+
+
+class ProductView(MutableMapping):
+    """
+    Producto leído bajo demanda desde el snapshot.
+
+    Se comporta como el diccionario de `products.json`; los campos se
+    decodifican al pedirlos y las modificaciones se guardan en memoria sin
+    tocar el archivo.
+    """
+
+    __slots__ = ('_snapshot', '_row', '_overrides')
+
+    def __init__(self, snapshot, row):
+        self._snapshot = snapshot
+        self._row = row
+        self._overrides = {}
+
+    def _fields(self):
+        snapshot, row = self._snapshot, self._row
+        fields = ['id', 'name', 'category', 'price', 'description', 'stock', 'disponible']
+        if snapshot._column('specs')[row] != EMPTY:
+            fields.append('specs')
+        if snapshot._flags[row] & FLAG_TIENE_OFERTA:
+            fields.append('ofertas')
+        return fields
+
+    def __getitem__(self, key):
+        if key in self._overrides:
+            return self._overrides[key]
+        snapshot, row = self._snapshot, self._row
+        if key in ('id', 'name', 'category', 'description'):
+            index = snapshot._column(key)[row]
+            if index == EMPTY and key not in ('name', 'description'):
+                raise KeyError(key)
+            return snapshot.string(index)
+        if key == 'price':
+            return snapshot._price[row]
+        if key == 'stock':
+            return snapshot._stock[row]
+        if key == 'disponible':
+            return bool(snapshot._flags[row] & FLAG_DISPONIBLE)
+        if key == 'specs' and snapshot._column('specs')[row] != EMPTY:
+            return json.loads(snapshot.string(snapshot._column('specs')[row]))
+        if key == 'ofertas' and snapshot._flags[row] & FLAG_TIENE_OFERTA:
+            return snapshot._ofertas(row)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        # Guardar el valor decodificado para que las modificaciones posteriores persistan
+        if key not in self._overrides:
+            self._overrides[key] = self.get(key, default)
+        return self._overrides[key]
+
+    def __setitem__(self, key, value):
+        self._overrides[key] = value
+
+    def __delitem__(self, key):
+        raise TypeError("Los productos del snapshot no permiten borrar campos")
+
+    def __iter__(self):
+        fields = self._fields()
+        yield from fields
+        yield from (key for key in self._overrides if key not in fields)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def __repr__(self):
+        return f"ProductView({self.get('id')!r})"
+
+
+class ProductSequence(Sequence):
+    """Lista de productos del snapshot, creados bajo demanda"""
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def context_block(self):
+        return self._snapshot.context_block()
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self._snapshot.product(i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self._snapshot.product(row)
+
+
+class CatalogSnapshot(Mapping):
+    """
+    Snapshot binario del catálogo abierto con `mmap`.
+
+    Abrir el archivo solo lee la cabecera: las columnas numéricas se exponen
+    como `memoryview` sobre el mapa (sin copias) y cada producto se decodifica
+    al accederse. Se puede usar como diccionario ID → producto.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._map)
+
+        magic, version, _, count, string_count, store_ref, categories_ref, context_ref = \
+            HEADER.unpack_from(self._buffer, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"{file_path} no es un snapshot de catálogo")
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Versión de snapshot no soportada: {version}")
+
+        self.count = count
+        self.string_count = string_count
+        offsets = dict(zip(SECTIONS, SECTION_TABLE.unpack_from(self._buffer, HEADER.size)))
+        column_offsets = COLUMN_TABLE.unpack_from(self._buffer, HEADER.size + SECTION_TABLE.size)
+
+        self._price = self._array(offsets['price'], 'd', count)
+        self._offer_price = self._array(offsets['offer_price'], 'd', count)
+        self._stock = self._array(offsets['stock'], 'i', count)
+        self._flags = self._buffer[offsets['flags']:offsets['flags'] + count]
+        self._columns = {
+            column: self._array(offset, 'I', count) for column, offset in zip(STRING_COLUMNS, column_offsets)
+        }
+        self._string_offsets = self._array(offsets['string_offsets'], 'Q', string_count + 1)
+        self._strings = offsets['strings']
+        self._id_index = self._array(offsets['id_index'], 'I', count)
+        offer_count = struct.unpack_from('<I', self._buffer, offsets['offer_rows'])[0]
+        self._offer_rows = self._array(offsets['offer_rows'] + 4, 'I', offer_count)
+
+        self._store_ref = store_ref
+        self._categories_ref = categories_ref
+        self._context_ref = context_ref
+        self._views = {}
+        logger.info(f"✅ Snapshot del catálogo abierto: {file_path} ({count} productos)")
+
+    def _array(self, offset, fmt, length):
+        size = struct.calcsize(fmt) * length
+        return self._buffer[offset:offset + size].cast(fmt)
+
+    def _column(self, name):
+        return self._columns[name]
+
+    def string(self, index):
+        """Decodificar la cadena `index` de la tabla de cadenas"""
+        start = self._strings + self._string_offsets[index]
+        end = self._strings + self._string_offsets[index + 1]
+        return str(self._buffer[start:end], 'utf-8')
+
+    def _ofertas(self, row):
+        flags = self._flags[row]
+        ofertas = {'activa': bool(flags & FLAG_OFERTA_ACTIVA)}
+        for key in ('descuento', 'fecha_inicio', 'fecha_fin'):
+            index = self._columns[key][row]
+            if index != EMPTY:
+                ofertas[key] = self.string(index)
+        if flags & FLAG_TIENE_PRECIO_OFERTA:
+            ofertas['precio_oferta'] = self._offer_price[row]
+        return ofertas
+
+    def product(self, row):
+        """Vista del producto en la fila `row` (la misma vista en cada acceso)"""
+        view = self._views.get(row)
+        if view is None:
+            # setdefault: si otro hilo creó la vista a la vez, ambos usan la misma
+            view = self._views.setdefault(row, ProductView(self, row))
+        return view
+
+    def _find_row(self, product_id):
+        """Búsqueda binaria en el índice ordenado por ID"""
+        low, high = 0, self.count
+        ids = self._columns['id']
+        while low < high:
+            middle = (low + high) // 2
+            row = self._id_index[middle]
+            current = self.string(ids[row])
+            if current == product_id:
+                return row
+            if current < product_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def row_of(self, product_id):
+        """Fila del producto con ID `product_id` (None si no está en el snapshot)"""
+        return self._find_row(product_id)
+
+    def __getitem__(self, product_id):
+        row = self._find_row(product_id)
+        if row is None:
+            raise KeyError(product_id)
+        return self.product(row)
+
+    def __iter__(self):
+        ids = self._columns['id']
+        for row in range(self.count):
+            yield self.string(ids[row])
+
+    def __len__(self):
+        return self.count
+
+    def values(self):
+        return ProductSequence(self)
+
+    def items(self):
+        ids = self._columns['id']
+        return [(self.string(ids[row]), self.product(row)) for row in range(self.count)]
+
+    @property
+    def products(self):
+        return ProductSequence(self)
+
+    @property
+    def store_info(self):
+        return json.loads(self.string(self._store_ref))
+
+    @property
+    def categories(self):
+        return json.loads(self.string(self._categories_ref))
+
+    def context_block(self):
+        """Líneas de productos para el contexto de GPT, renderizadas al exportar el snapshot"""
+        return self.string(self._context_ref)
+
+    def context_lines(self):
+        """
+        Línea de contexto de cada fila, en orden de fila, o None si alguna ocupa
+        varias líneas (descripciones con saltos de línea) y no se pueden separar
+        """
+        lines = self.context_block().split("\n") if self.count else []
+        return lines if len(lines) == self.count else None
+
+    def offer_products(self):
+        """Productos con oferta activa o programada, sin recorrer el catálogo"""
+        return [self.product(row) for row in self._offer_rows]
+
+    def as_products_data(self):
+        """Estructura equivalente a `products.json` con productos perezosos"""
+        return {'store_info': self.store_info, 'categories': self.categories, 'products': self.products}
+
+    def close(self):
+        for array in [self._price, self._offer_price, self._stock, self._flags, self._string_offsets,
+                      self._id_index, self._offer_rows, *self._columns.values()]:
+            array.release()
+        self._buffer.release()
+        self._map.close()
+        self._file.close()
+
+
+def load_products_data(file_path):
+    """Cargar `products.json` o un snapshot `.snap` con la misma estructura"""
+    if str(file_path).endswith('.snap'):
+        return CatalogSnapshot(file_path).as_products_data()
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
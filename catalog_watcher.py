@@ -0,0 +1,137 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Eventos de inotify que indican que el archivo tiene contenido nuevo
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _load_inotify():
+    """Funciones de inotify de libc, o None si el sistema no las ofrece"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    """
+    Vigila un archivo desde un hilo en segundo plano y llama a `callback` cuando cambia.
+
+    Usa inotify sobre el directorio (para detectar también los reemplazos
+    atómicos por renombrado) y, si no está disponible, compara `mtime` y tamaño
+    cada `poll_interval` segundos. Los eventos seguidos se agrupan durante
+    `debounce` segundos para no recargar un archivo a medio escribir.
+    """
+
+    def __init__(self, file_path, callback, poll_interval=2.0, debounce=0.3):
+        self.file_path = os.path.abspath(file_path)
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='catalog-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        libc = _load_inotify()
+        if libc is not None:
+            try:
+                self._watch_inotify(libc)
+                return
+            except OSError as e:
+                logger.warning(f"⚠️ inotify no disponible ({str(e)}), se usará sondeo por mtime")
+        self._watch_polling()
+
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception as e:
+            logger.error(f"❌ Error al procesar el cambio de {self.file_path}: {str(e)}")
+
+    def _watch_inotify(self, libc):
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        try:
+            directory = os.path.dirname(self.file_path).encode()
+            if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            self.mode = 'inotify'
+            logger.info(f"👀 Vigilando {self.file_path} con inotify")
+            name = os.path.basename(self.file_path).encode()
+
+            while not self._stop.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable or not self._drain(fd, name):
+                    continue
+                # Esperar a que terminen las escrituras seguidas antes de recargar
+                while select.select([fd], [], [], self.debounce)[0]:
+                    self._drain(fd, name)
+                self._notify()
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _drain(fd, name):
+        """Leer los eventos pendientes; indica si alguno se refiere al archivo vigilado"""
+        matched = False
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return matched
+                raise
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                event_name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                matched = matched or event_name == name
+                offset += INOTIFY_EVENT.size + length
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.file_path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _watch_polling(self):
+        self.mode = 'polling'
+        logger.info(f"👀 Vigilando {self.file_path} por sondeo cada {self.poll_interval:.1f} segundos")
+        last = self._signature()
+        while not self._stop.wait(self.poll_interval):
+            current = self._signature()
+            if current != last and current is not None:
+                time.sleep(self.debounce)
+                current = self._signature()
+                self._notify()
+            last = current
@@ -0,0 +1,205 @@
+import os
+import time
+import uuid
+import logging
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from catalog import normalize_text
+from recommendations import effective_price, in_stock
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Productos destacados que se guardan por categoría (en oferta y en stock primero)
+CATEGORY_TOP_ITEMS = int(os.getenv('CATEGORY_TOP_ITEMS', '3'))
+
+SUMMARIES_COLLECTION = 'category_summaries'
+UNCATEGORIZED = 'Sin categoría'
+# Prefijo de `callback_data` de los botones de categoría (Telegram admite hasta 64 bytes)
+CATEGORY_PREFIX = 'category:'
+MAX_CALLBACK_DATA = 64
+
+# Precio que paga el cliente: el de oferta si hay una oferta activa (como `effective_price`)
+_EFFECTIVE_PRICE = {'$cond': [
+    {'$and': [{'$eq': ['$ofertas.activa', True]}, {'$gt': ['$ofertas.precio_oferta', 0]}]},
+    '$ofertas.precio_oferta',
+    {'$ifNull': ['$price', 0]},
+]}
+# Los productos sin categoría (campo ausente, null o vacío) se resumen en UNCATEGORIZED, como en memoria
+_CATEGORY = {'$cond': [{'$in': [{'$ifNull': ['$category', None]}, [None, '']]}, UNCATEGORIZED, '$category']}
+_IN_STOCK = {'$and': [{'$eq': ['$disponible', True]}, {'$gt': [{'$ifNull': ['$stock', 0]}, 0]}]}
+
+
+def summary_pipeline(categories=None, top_items=CATEGORY_TOP_ITEMS, refresh=None):
+    """
+    Pipeline de agregación que recalcula el resumen de `categories` (todas si es
+    None) y lo escribe en `category_summaries` con `$merge`. Cada documento
+    lleva la marca `refresh` para reconocer después los resúmenes que no se
+    volvieron a escribir (categorías que se quedaron sin productos).
+    """
+    pipeline = []
+    if categories is not None:
+        # Los productos sin categoría se resumen en UNCATEGORIZED
+        names = list(categories) + ([None, ''] if UNCATEGORIZED in categories else [])
+        pipeline.append({'$match': {'category': {'$in': names}}})
+    pipeline += [
+        {'$project': {
+            '_id': 0, 'id': 1, 'name': 1,
+            'category': _CATEGORY,
+            'price': _EFFECTIVE_PRICE,
+            'offer': {'$eq': ['$ofertas.activa', True]},
+            'in_stock': _IN_STOCK,
+        }},
+        # Los destacados de cada categoría: en oferta y en stock primero
+        {'$sort': {'offer': -1, 'in_stock': -1, 'name': 1}},
+        {'$group': {
+            '_id': '$category',
+            'products': {'$sum': 1},
+            'in_stock': {'$sum': {'$cond': ['$in_stock', 1, 0]}},
+            'active_offers': {'$sum': {'$cond': ['$offer', 1, 0]}},
+            'min_price': {'$min': '$price'},
+            'max_price': {'$max': '$price'},
+            'top_items': {'$push': {'id': '$id', 'name': '$name', 'price': '$price', 'offer': '$offer'}},
+        }},
+        {'$set': {'top_items': {'$slice': ['$top_items', top_items]}, 'refresh': refresh, 'updated_at': '$$NOW'}},
+        {'$merge': {'into': SUMMARIES_COLLECTION, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ]
+    return pipeline
+
+
+def summarize_products(products, top_items=CATEGORY_TOP_ITEMS):
+    """Los mismos resúmenes que `summary_pipeline`, calculados en memoria"""
+    summaries = {}
+    ranked = sorted(products, key=lambda product: (
+        not product.get('ofertas', {}).get('activa', False), not in_stock(product), product.get('name', '')
+    ))
+    for product in ranked:
+        category = product.get('category') or UNCATEGORIZED
+        price = effective_price(product)
+        offer = product.get('ofertas', {}).get('activa', False)
+        summary = summaries.get(category)
+        if summary is None:
+            summary = summaries[category] = {
+                '_id': category, 'products': 0, 'in_stock': 0, 'active_offers': 0,
+                'min_price': price, 'max_price': price, 'top_items': [],
+            }
+        summary['products'] += 1
+        summary['in_stock'] += 1 if in_stock(product) else 0
+        summary['active_offers'] += 1 if offer else 0
+        summary['min_price'] = min(summary['min_price'], price)
+        summary['max_price'] = max(summary['max_price'], price)
+        if len(summary['top_items']) < top_items:
+            summary['top_items'].append({'id': product.get('id'), 'name': product.get('name', ''),
+                                         'price': price, 'offer': offer})
+    return list(summaries.values())
+
+
+class CategorySummaries:
+    """
+    Colección materializada `category_summaries`: un documento pequeño por
+    categoría con el número de productos, los que hay en stock, el rango de
+    precios, las ofertas activas y los productos destacados.
+
+    Se calcula en MongoDB con un pipeline de agregación que termina en `$merge`.
+    `rebuild` recalcula todas las categorías (al migrar) y `refresh` solo las
+    de los productos escritos; los resúmenes de categorías que se quedan sin
+    productos se borran. `/productos` solo lee esta colección.
+    """
+
+    def __init__(self, db, top_items=CATEGORY_TOP_ITEMS, metrics=None, tenant=None):
+        self.products = db.products
+        self.collection = db[SUMMARIES_COLLECTION]
+        self.top_items = top_items
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+
+    def _run(self, categories=None):
+        refresh = uuid.uuid4().hex
+        start = time.time()
+        self.products.aggregate(summary_pipeline(categories, self.top_items, refresh), allowDiskUse=True)
+        stale = {'refresh': {'$ne': refresh}}
+        if categories is not None:
+            stale['_id'] = {'$in': list(categories)}
+        self.collection.delete_many(stale)
+        self.metrics.observe('storebot_category_summaries_seconds', time.time() - start, tenant=self.tenant)
+
+    def rebuild(self):
+        """Recalcular los resúmenes de todas las categorías"""
+        self._run()
+        logger.info("📊 Resúmenes de categorías recalculados")
+
+    def ensure(self):
+        """Calcular los resúmenes si la colección aún está vacía (catálogos migrados antes de existir)"""
+        try:
+            if self.collection.find_one({}, {'_id': 1}) is None:
+                self.rebuild()
+        except Exception as e:
+            logger.error(f"❌ Error al preparar los resúmenes de categorías: {str(e)}")
+
+    def refresh(self, categories):
+        """Recalcular solo los resúmenes de `categories` tras escribir productos"""
+        categories = sorted({category or UNCATEGORIZED for category in categories})
+        if not categories:
+            return
+        try:
+            self._run(categories)
+            logger.info(f"📊 Resúmenes actualizados: {', '.join(categories)}")
+        except Exception as e:
+            logger.error(f"❌ Error al actualizar los resúmenes de categorías: {str(e)}")
+
+    def all(self):
+        """Resúmenes de todas las categorías, por nombre"""
+        return sorted(self.collection.find({}, {'refresh': 0, 'updated_at': 0}), key=lambda summary: summary['_id'])
+
+    def categories(self):
+        return [summary['_id'] for summary in self.collection.find({}, {'_id': 1})]
+
+
+def find_category(summaries, text):
+    """Resumen de la categoría que nombra `text` (sin distinguir mayúsculas ni acentos), o None"""
+    wanted = normalize_text(text).strip()
+    if not wanted:
+        return None
+    for summary in summaries:
+        if normalize_text(summary['_id']) == wanted:
+            return summary
+    matches = [summary for summary in summaries if normalize_text(summary['_id']).startswith(wanted)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def format_overview(summaries):
+    """Mensaje de /productos: una entrada por categoría"""
+    lines = ["📋 Nuestro catálogo por categorías:"]
+    for summary in summaries:
+        lines.append(f"\n📁 {summary['_id']}: {summary['products']} productos ({summary['in_stock']} en stock)")
+        if summary['min_price'] == summary['max_price']:
+            price_text = f"${summary['min_price']:.2f}"
+        else:
+            price_text = f"desde ${summary['min_price']:.2f} hasta ${summary['max_price']:.2f}"
+        offers = f" · 🔥 {summary['active_offers']} en oferta" if summary['active_offers'] else ""
+        lines.append(f"   💰 {price_text}{offers}")
+        if summary.get('top_items'):
+            lines.append(f"   ⭐ {', '.join(item['name'] for item in summary['top_items'])}")
+    lines.append("\nToca una categoría para ver sus productos o usa /productos todo para el listado completo.")
+    return "\n".join(lines)
+
+
+def category_keyboard(summaries):
+    """Un botón por categoría (dos por fila)"""
+    buttons = []
+    for summary in summaries:
+        data = CATEGORY_PREFIX + summary['_id']
+        if len(data.encode()) <= MAX_CALLBACK_DATA:
+            buttons.append(InlineKeyboardButton(f"📁 {summary['_id']} ({summary['products']})", callback_data=data))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup([buttons[position:position + 2] for position in range(0, len(buttons), 2)])
+
+
+def format_category(category, lines, limit=50):
+    """Listado de los productos de una categoría (los primeros `limit`, para no superar el tamaño de un mensaje)"""
+    shown = lines[:limit]
+    if len(lines) > limit:
+        shown.append(f"… y {len(lines) - limit} más")
+    return "\n".join([f"📁 {category}:"] + shown + ["\nToca un producto para ver su ficha completa."])
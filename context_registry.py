@@ -0,0 +1,110 @@
+import os
+import logging
+import threading
+
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# 1 = cada conversación se queda con la versión del contexto con la que empezó; 0 = siempre la última
+CONTEXT_PIN_CONVERSATIONS = os.getenv('CONTEXT_PIN_CONVERSATIONS', '0') == '1'
+
+# Referencia de una conversación que sigue siempre a la última versión
+LATEST = None
+
+
+class ContextRegistry:
+    """
+    Versiones inmutables del contexto del sistema de una tienda.
+
+    Las conversaciones no copian el prompt (varios KB por usuario): su primer
+    mensaje es `{"role": "system", "context": referencia}`, que se resuelve al
+    texto en el momento de cada solicitud con `render`. La referencia es
+    `LATEST` (se usa siempre la última versión) o, con `pin`, el número de la
+    versión con la que empezó la conversación. Las versiones antiguas se
+    liberan en cuanto ninguna conversación las referencia.
+    """
+
+    def __init__(self, pin=CONTEXT_PIN_CONVERSATIONS, metrics=None, tenant=None):
+        self.pin = pin
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._refs = {}
+        self._latest = None
+        self._next_version = 1
+
+    @property
+    def latest(self):
+        return self._latest
+
+    def publish(self, text):
+        """Registrar una nueva versión del contexto (si el texto no cambió, se conserva la actual)"""
+        with self._lock:
+            if self._latest is not None and self._versions[self._latest] == text:
+                return self._latest
+            version = self._next_version
+            self._next_version += 1
+            self._versions[version] = text
+            previous, self._latest = self._latest, version
+            self._collect(previous)
+            retained = len(self._versions)
+        self.metrics.set('storebot_context_version', version, tenant=self.tenant)
+        self.metrics.set('storebot_context_versions_retained', retained, tenant=self.tenant)
+        logger.info(f"🧾 Contexto del sistema v{version} publicado ({len(text)} caracteres, {retained} versiones en memoria)")
+        return version
+
+    def _collect(self, version):
+        """Liberar `version` si ya no es la última y ninguna conversación la usa (con el lock tomado)"""
+        if version is None or version == self._latest or self._refs.get(version):
+            return
+        self._versions.pop(version, None)
+
+    def reference(self):
+        """Referencia para una conversación nueva"""
+        if not self.pin:
+            return LATEST
+        with self._lock:
+            self._refs[self._latest] = self._refs.get(self._latest, 0) + 1
+            return self._latest
+
+    def release(self, reference):
+        """Una conversación deja de usar `reference` (al reiniciarse o descartarse)"""
+        if reference is LATEST:
+            return
+        with self._lock:
+            count = self._refs.get(reference, 0) - 1
+            if count > 0:
+                self._refs[reference] = count
+                return
+            self._refs.pop(reference, None)
+            self._collect(reference)
+            retained = len(self._versions)
+        self.metrics.set('storebot_context_versions_retained', retained, tenant=self.tenant)
+
+    def resolve(self, reference=LATEST):
+        """Texto de la versión referenciada (la última si es `LATEST` o si ya no existe)"""
+        with self._lock:
+            text = self._versions.get(self._latest if reference is LATEST else reference)
+            return text if text is not None else self._versions.get(self._latest, '')
+
+    def start_conversation(self):
+        """Primer mensaje de una conversación nueva: solo la referencia al contexto"""
+        return {"role": "system", "context": self.reference()}
+
+    def render(self, messages):
+        """Mensajes listos para OpenAI: las referencias al contexto se sustituyen por su texto"""
+        return [
+            {"role": "system", "content": self.resolve(message["context"])} if "context" in message else message
+            for message in messages
+        ]
+
+    def release_conversation(self, messages):
+        """Liberar las versiones referenciadas por una conversación que se descarta"""
+        for message in messages:
+            if "context" in message:
+                self.release(message["context"])
+
+    def __len__(self):
+        return len(self._versions)
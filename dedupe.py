@@ -0,0 +1,175 @@
+import os
+import time
+import hashlib
+import asyncio
+import logging
+import functools
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from catalog import normalize_text
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Tiempo durante el que se recuerda un update_id ya atendido (segundos)
+DEDUPE_UPDATE_TTL = float(os.getenv('DEDUPE_UPDATE_TTL', '600'))
+# Máximo de entradas en memoria de cada tabla (las más antiguas se descartan antes de caducar)
+DEDUPE_MAX_ENTRIES = int(os.getenv('DEDUPE_MAX_ENTRIES', '10000'))
+# Compartir los update_id atendidos entre instancias a través de MongoDB (colección `processed_updates`)
+DEDUPE_SHARED_STORE = os.getenv('DEDUPE_SHARED_STORE', '0') == '1'
+
+UPDATE = 'update'
+INFLIGHT = 'inflight'
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Diccionario acotado cuyas entradas caducan tras `ttl` segundos.
+
+    Las entradas se guardan en orden de inserción, así que las caducadas se
+    purgan desde el principio sin recorrer toda la tabla; si se supera
+    `max_entries` se descartan las más antiguas.
+    """
+
+    def __init__(self, ttl, max_entries=DEDUPE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def _purge(self, now):
+        entries = self._entries
+        while entries:
+            key, (expires, _) = next(iter(entries.items()))
+            if expires > now and len(entries) <= self.max_entries:
+                break
+            entries.popitem(last=False)
+
+    def get(self, key, default=None, now=None):
+        now = time.monotonic() if now is None else now
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            return default
+        return entry[1]
+
+    def set(self, key, value, now=None):
+        now = time.monotonic() if now is None else now
+        self._entries.pop(key, None)
+        self._entries[key] = (now + self.ttl, value)
+        self._purge(now)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MongoUpdateStore:
+    """
+    update_id atendidos compartidos entre instancias del bot.
+
+    Cada update_id se inserta con `_id` único; si la inserción falla por
+    clave duplicada, otra instancia ya lo atendió. Un índice TTL sobre
+    `expires_at` (creado por migration/migrate-to-mongodb.py) borra las
+    entradas antiguas.
+    """
+
+    def __init__(self, collection, ttl=DEDUPE_UPDATE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+
+    def claim(self, key):
+        """True si esta instancia es la primera en atender `key`"""
+        from pymongo.errors import DuplicateKeyError
+
+        try:
+            self.collection.insert_one({
+                "_id": key,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            # Si MongoDB falla se atiende la actualización: mejor una respuesta repetida que ninguna
+            logger.error(f"❌ Error al registrar la actualización {key}: {str(e)}")
+            return True
+
+
+class UpdateDeduplicator:
+    """
+    Descarta actualizaciones repetidas antes de que lleguen a OpenAI.
+
+    - Por `update_id`: Telegram puede reenviar la misma actualización al
+      reconectar el polling o reintentar un webhook. Se recuerda en memoria y,
+      opcionalmente, en un almacén compartido entre instancias.
+    - Por contenido: el mismo texto del mismo usuario mientras su primera
+      solicitud sigue en curso se descarta (la respuesta en camino sirve para
+      las dos). Una vez respondido, el mismo texto es un mensaje nuevo: sin
+      ver la conversación no se distingue un reenvío de un "sí" que responde
+      a la siguiente pregunta del bot.
+
+    `saved_calls` cuenta las llamadas al modelo evitadas.
+    """
+
+    def __init__(self, store=None, update_ttl=DEDUPE_UPDATE_TTL, max_entries=DEDUPE_MAX_ENTRIES,
+                 metrics=None, tenant=None):
+        self.store = store
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+        self.updates = TTLCache(update_ttl, max_entries)
+        self.inflight = set()
+        self.saved_calls = 0
+
+    def _saved(self, reason, model_call=True):
+        self.metrics.inc('storebot_duplicates_total', tenant=self.tenant, reason=reason)
+        if model_call:
+            self.saved_calls += 1
+            self.metrics.inc('storebot_dedupe_saved_calls_total', tenant=self.tenant, reason=reason)
+
+    async def is_duplicate_update(self, update, model_call=False):
+        """True si esta actualización ya se atendió (y entonces se descarta)"""
+        update_id = getattr(update, 'update_id', None)
+        if update_id is None:
+            return False
+        if update_id in self.updates:
+            self._saved(UPDATE, model_call)
+            return True
+        self.updates.set(update_id, True)
+        if self.store is not None and not await asyncio.to_thread(self.store.claim, f"{self.tenant}:{update_id}"):
+            self._saved(UPDATE, model_call)
+            return True
+        return False
+
+    def wrap(self, callback, model_call=False):
+        """Envolver un handler de Telegram para que ignore las actualizaciones repetidas"""
+        @functools.wraps(callback)
+        async def deduplicated(update, context):
+            if await self.is_duplicate_update(update, model_call):
+                logger.info(f"♻️ Actualización {update.update_id} repetida descartada")
+                return None
+            return await callback(update, context)
+        return deduplicated
+
+    @staticmethod
+    def content_key(user_id, text):
+        digest = hashlib.blake2b(normalize_text(text or '').strip().encode(), digest_size=12).hexdigest()
+        return user_id, digest
+
+    def begin(self, key):
+        """
+        Registrar una solicitud al modelo para `key`.
+        Devuelve INFLIGHT si ya hay una en curso (y esta se descarta), o None si debe continuar.
+        """
+        if key in self.inflight:
+            self._saved(INFLIGHT)
+            return INFLIGHT
+        self.inflight.add(key)
+        return None
+
+    def finish(self, key):
+        """Terminar la solicitud de `key`"""
+        self.inflight.discard(key)
@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import heapq
+import logging
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+from catalog import normalize_text
+from recommendations import effective_price, in_stock
+from product_cards import card_key, format_card
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Resultados precalculados por prefijo y devueltos en cada consulta (Telegram admite hasta 50)
+INLINE_RESULTS = int(os.getenv('INLINE_RESULTS', '10'))
+# Longitud máxima de los prefijos indexados; las palabras más largas se comprueban al buscar
+INLINE_MAX_PREFIX = int(os.getenv('INLINE_MAX_PREFIX', '12'))
+# Segundos que Telegram puede reutilizar los resultados de una misma consulta
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '30'))
+
+# Consultas de varias palabras cuyos resultados se recuerdan hasta el próximo cambio del catálogo
+QUERY_CACHE_SIZE = 1024
+
+
+def search_words(text):
+    """Palabras normalizadas (minúsculas, sin acentos) de un nombre, categoría o consulta"""
+    return re.findall(r'\w+', normalize_text(text or ''))
+
+
+class _Node:
+    __slots__ = ('children', 'keys', 'top', 'ordered')
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()
+        self.top = []
+        # Todos los productos del nodo ordenados, solo para consultas de varias palabras (se calcula al usarse)
+        self.ordered = None
+
+
+class InlineSearchIndex:
+    """
+    Trie de prefijos sobre los nombres y categorías normalizados del catálogo.
+
+    Cada palabra de un producto se inserta carácter a carácter (hasta
+    `max_prefix`) y cada nodo guarda los productos que tienen alguna palabra
+    con ese prefijo y, precalculados, los `limit` mejores: en stock primero,
+    luego en oferta, luego por nombre. Una consulta de una sola palabra es un
+    recorrido de tantos nodos como letras tiene y devuelve esa lista tal cual;
+    con varias palabras se filtran los productos del nodo más selectivo.
+    `upsert` y `remove` solo tocan las ramas de los productos cambiados; los
+    mejores de un nodo se actualizan en el sitio y solo se recalculan (sobre
+    todos sus productos) cuando sale de él uno que estaba entre ellos.
+    """
+
+    def __init__(self, limit=INLINE_RESULTS, max_prefix=INLINE_MAX_PREFIX):
+        self.limit = limit
+        self.max_prefix = max_prefix
+        self.root = _Node()
+        self.products = {}
+        self.words = {}
+        self.ranks = {}
+        self._queries = {}
+
+    def __len__(self):
+        return len(self.products)
+
+    @staticmethod
+    def rank(product):
+        ofertas = product.get('ofertas', {})
+        return (not in_stock(product), not ofertas.get('activa', False), normalize_text(product.get('name', '')))
+
+    def _paths(self, words):
+        """Nodos de todos los prefijos de `words` (se crean si no existen)"""
+        nodes = {id(self.root): self.root}
+        for word in words:
+            node = self.root
+            for char in word[:self.max_prefix]:
+                node = node.children.setdefault(char, _Node())
+                nodes[id(node)] = node
+        return nodes
+
+    def _insert(self, key, product, dirty):
+        words = frozenset(search_words(product.get('name', '')) + search_words(product.get('category', '')))
+        rank = self.rank(product)
+        self.products[key] = product
+        self.words[key] = words
+        self.ranks[key] = rank
+        ranks = self.ranks
+        for node_id, node in self._paths(words).items():
+            node.keys.add(key)
+            node.ordered = None
+            # Los mejores se actualizan en el sitio, salvo en los nodos que ya hay que recalcular
+            if node_id in dirty:
+                continue
+            if len(node.top) < self.limit or rank < ranks[node.top[-1]]:
+                top = node.top + [key]
+                top.sort(key=ranks.__getitem__)
+                node.top = top[:self.limit]
+
+    def _delete(self, key, dirty):
+        words = self.words.pop(key, None)
+        if words is None:
+            return
+        self.products.pop(key, None)
+        self.ranks.pop(key, None)
+        self.root.keys.discard(key)
+        self.root.ordered = None
+        if key in self.root.top:
+            dirty[id(self.root)] = self.root
+        for word in words:
+            node = self.root
+            for char in word[:self.max_prefix]:
+                child = node.children.get(char)
+                if child is None:
+                    break
+                child.keys.discard(key)
+                child.ordered = None
+                if not child.keys:
+                    # Los descendientes de un nodo vacío también lo están: se quita la rama entera
+                    del node.children[char]
+                    break
+                # Solo hay que recalcular los mejores del nodo si el producto estaba entre ellos
+                if key in child.top:
+                    dirty[id(child)] = child
+                node = child
+
+    def _recompute(self, dirty):
+        ranks = self.ranks
+        for node in dirty.values():
+            node.top = heapq.nsmallest(self.limit, node.keys, key=ranks.__getitem__)
+        dirty.clear()
+
+    def build(self, products):
+        self.root = _Node()
+        self.products, self.words, self.ranks = {}, {}, {}
+        self.upsert(products)
+
+    def upsert(self, products):
+        """Insertar o actualizar productos; solo se recalculan los nodos de sus palabras"""
+        dirty = {}
+        for product in products:
+            key = card_key(product.get('id'))
+            self._delete(key, dirty)
+            self._insert(key, product, dirty)
+        if dirty:
+            self._recompute(dirty)
+        self._queries.clear()
+
+    def remove(self, product_ids):
+        dirty = {}
+        for product_id in product_ids:
+            self._delete(card_key(product_id), dirty)
+        if dirty:
+            self._recompute(dirty)
+        self._queries.clear()
+
+    def _find(self, word):
+        node = self.root
+        for char in word[:self.max_prefix]:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _matches(self, key, words):
+        product_words = self.words[key]
+        return all(any(candidate.startswith(word) for candidate in product_words) for word in words)
+
+    def search(self, text, limit=None):
+        """Productos cuyas palabras empiezan por las de `text` (la última puede estar a medio escribir)"""
+        limit = limit or self.limit
+        words = search_words(text)
+        if not words:
+            return [self.products[key] for key in self.root.top[:limit]]
+
+        nodes = []
+        for word in words:
+            node = self._find(word)
+            if node is None:
+                return []
+            nodes.append(node)
+        # Una palabra dentro de la longitud indexada: la lista precalculada del nodo es la respuesta
+        if len(words) == 1 and len(words[0]) <= self.max_prefix and limit <= self.limit:
+            return [self.products[key] for key in nodes[0].top[:limit]]
+
+        cache_key = (tuple(words), limit)
+        cached = self._queries.get(cache_key)
+        if cached is not None:
+            return cached
+        # Se recorren en orden los productos del nodo más selectivo hasta reunir `limit` que cumplan todas las palabras
+        node = min(nodes, key=lambda node: len(node.keys))
+        if node.ordered is None:
+            node.ordered = sorted(node.keys, key=self.ranks.__getitem__)
+        others = [other.keys for other in nodes if other is not node]
+        long_words = [word for word in words if len(word) > self.max_prefix]
+        results = []
+        for key in node.ordered:
+            if all(key in keys for keys in others) and (not long_words or self._matches(key, long_words)):
+                results.append(self.products[key])
+                if len(results) >= limit:
+                    break
+        if len(self._queries) >= QUERY_CACHE_SIZE:
+            self._queries.clear()
+        self._queries[cache_key] = results
+        return results
+
+
+class InlineSearch:
+    """Respuestas a las consultas inline (`@bot portátil…`) a partir del trie y las fichas de producto"""
+
+    def __init__(self, cards, limit=INLINE_RESULTS, max_prefix=INLINE_MAX_PREFIX, cache_time=INLINE_CACHE_TIME,
+                 metrics=None, tenant=None):
+        self.cards = cards
+        self.index = InlineSearchIndex(limit, max_prefix)
+        self.cache_time = cache_time
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+
+    def build(self, products):
+        start = time.time()
+        self.index.build(products)
+        logger.info(f"🔎 Índice de búsqueda inline construido: {len(self.index)} productos "
+                    f"en {(time.time() - start) * 1000:.0f} ms")
+
+    def upsert(self, products):
+        self.index.upsert(products)
+
+    def remove(self, product_ids):
+        self.index.remove(product_ids)
+
+    def result(self, product):
+        """Artículo de un producto: al elegirlo se envía su ficha al chat"""
+        key = card_key(product.get('id'))
+        price = f"${effective_price(product):.2f}"
+        if product.get('ofertas', {}).get('activa', False):
+            price += " 🔥 oferta"
+        state = "en stock" if in_stock(product) else "sin stock"
+        return InlineQueryResultArticle(
+            id=key[:64],
+            title=product.get('name', 'Producto sin nombre'),
+            description=f"{price} · {product.get('category', 'Sin categoría')} · {state}",
+            input_message_content=InputTextMessageContent(self.cards.get(key) or format_card(product)),
+        )
+
+    def answer(self, text):
+        """Resultados para el texto de una consulta inline"""
+        start = time.perf_counter()
+        products = self.index.search(text)
+        self.metrics.inc('storebot_inline_queries_total', tenant=self.tenant)
+        self.metrics.observe('storebot_inline_search_seconds', time.perf_counter() - start, tenant=self.tenant)
+        return [self.result(product) for product in products]
@@ -2,9 +2,12 @@ import os
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
+# Cargar variables de entorno antes de importar los módulos que leen su configuración al importarse
+load_dotenv()
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
 from telegram import Update
 import openai
+from openai_client import get_openai_client, acquire_openai_client, release_openai_client
 import time
 
 # Configurar logging
@@ -14,8 +17,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno
-load_dotenv()
+# Variables de entorno
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
@@ -28,9 +30,6 @@ if not OPENAI_API_KEY:
     logger.error("⚠️ OPENAI_API_KEY no encontrado en el archivo .env")
     exit(1)
 
-# Configurar OpenAI
-openai.api_key = OPENAI_API_KEY
-
 class ChatBot:
     def __init__(self):
         self.conversations = {}
@@ -161,7 +160,7 @@ class ChatBot:
         try:
             logger.info(f"🔄 Enviando solicitud a OpenAI con {len(conversation_history)} mensajes en el historial")
             
-            response = await openai.ChatCompletion.acreate(
+            response = await get_openai_client().chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=conversation_history,
                 max_tokens=1000,
@@ -170,10 +169,10 @@ class ChatBot:
             
             logger.info(f"✅ Respuesta recibida de OpenAI exitosamente")
             return response.choices[0].message.content
-        except openai.error.RateLimitError:
+        except openai.RateLimitError:
             logger.error("⚠️ Error de límite de tasa (Rate Limit) en OpenAI API")
             raise Exception("Se ha alcanzado el límite de solicitudes a OpenAI. Por favor, intenta más tarde.")
-        except openai.error.AuthenticationError:
+        except openai.AuthenticationError:
             logger.error("🔑 Error de autenticación en OpenAI API")
             raise Exception("Error de autenticación con OpenAI. Verifica tu API key.")
         except Exception as e:
@@ -184,12 +183,26 @@ class ChatBot:
         """Manejador global de errores"""
         logger.error(f"⚠️ Error en la actualización {update}: {context.error}")
 
+    async def post_init(self, app):
+        """Crear el cliente de OpenAI (con su pool de conexiones) una vez creado el bucle de eventos"""
+        acquire_openai_client()
+
+    async def post_shutdown(self, app):
+        """Cerrar las conexiones con OpenAI"""
+        await release_openai_client()
+
     def run(self):
         """Iniciar el bot"""
         logger.info("🤖 Iniciando el bot de Telegram...")
         
         # Crear la aplicación
-        app = Application.builder().token(TELEGRAM_TOKEN).build()
+        app = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
 
         # Añadir handlers
         app.add_handler(CommandHandler("start", self.start_command))
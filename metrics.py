@@ -0,0 +1,137 @@
+import os
+import logging
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Límites de los histogramas de latencia (segundos)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in items) + '}'
+
+
+class Metrics:
+    """
+    Registro de métricas compartido por todos los bots del proceso.
+
+    Contadores, gauges e histogramas con etiquetas (por ejemplo `tenant`),
+    exportados en formato de texto compatible con Prometheus.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(float))
+        self._gauges = defaultdict(dict)
+        self._histograms = defaultdict(dict)
+        self._gauge_callbacks = []
+
+    def inc(self, name, amount=1, **labels):
+        """Incrementar un contador"""
+        with self._lock:
+            self._counters[name][_label_key(labels)] += amount
+
+    def set(self, name, value, **labels):
+        """Fijar el valor de un gauge"""
+        with self._lock:
+            self._gauges[name][_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Registrar una observación en un histograma"""
+        key = _label_key(labels)
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def register_gauge_callback(self, callback):
+        """Registrar una función que actualiza gauges justo antes de exportar"""
+        self._gauge_callbacks.append(callback)
+
+    def get(self, name, **labels):
+        """Valor actual de un contador o gauge (0 si no existe)"""
+        key = _label_key(labels)
+        with self._lock:
+            if key in self._gauges.get(name, {}):
+                return self._gauges[name][key]
+            return self._counters.get(name, {}).get(key, 0)
+
+    def render(self):
+        """Exportar todas las métricas en formato de texto de Prometheus"""
+        for callback in self._gauge_callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"❌ Error al actualizar métricas: {str(e)}")
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    for bound, count in zip(self.buckets, histogram['buckets']):
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': bound})} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {histogram['count']}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram['sum']:g}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(metrics, port=METRICS_PORT, host='0.0.0.0'):
+    """Servir `/metrics` en un hilo en segundo plano (desactivado si el puerto es 0)"""
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"📊 Métricas disponibles en http://{host}:{port}/metrics")
+    return server
+
+
+# Registro por defecto del proceso
+metrics = Metrics()
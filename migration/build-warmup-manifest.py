@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+MONGODB_URI = os.getenv('MONGODB_URI')
+MONGODB_DB = os.getenv('MONGODB_DB', 'TechStore')
+
+# Permitir importar los módulos compartidos de la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from warmup import build_manifest, write_manifest, WARMUP_WINDOW_HOURS, WARMUP_TRACKED
+
+
+def load_products(json_file=None):
+    """Productos del catálogo (del archivo JSON o de MongoDB) para reconocer los productos mencionados"""
+    if json_file:
+        try:
+            with open(json_file, 'r', encoding='utf-8') as file:
+                products = json.load(file).get('products', [])
+                print(f"✅ {len(products)} productos leídos desde {json_file}")
+                return products
+        except (OSError, ValueError) as e:
+            print(f"❌ Error al leer el catálogo {json_file}: {str(e)}")
+            return None
+
+    if not MONGODB_URI:
+        print("⚠️ MONGODB_URI no encontrado: el manifiesto no incluirá productos")
+        return None
+
+    from mongo_pool import get_connection_manager
+
+    try:
+        db = get_connection_manager(uri=MONGODB_URI).catalog_database(MONGODB_DB)
+        products = list(db.products.find({}, {'_id': 0}))
+        print(f"✅ {len(products)} productos leídos desde MongoDB: {MONGODB_DB}")
+        return products
+    except Exception as e:
+        print(f"❌ Error al leer el catálogo desde MongoDB: {str(e)}")
+        return None
+
+
+def build_warmup_manifest(traces, output, json_file=None, window_hours=WARMUP_WINDOW_HOURS,
+                          top_questions=50, top_products=100, tracked=WARMUP_TRACKED):
+    """
+    Analiza las trazas grabadas y escribe el manifiesto de calentamiento de cachés
+    """
+    recommender = None
+    products = load_products(json_file)
+    if products:
+        from recommendations import RecommendationIndex
+
+        recommender = RecommendationIndex()
+        recommender.build(products)
+
+    try:
+        manifest = build_manifest(traces, recommender, window_hours=window_hours, top_questions=top_questions,
+                                  top_products=top_products, tracked=tracked)
+        write_manifest(manifest, output)
+    except Exception as e:
+        print(f"❌ Error al construir el manifiesto: {str(e)}")
+        return False
+
+    overall = manifest['overall']
+    print(f"✅ {manifest['events']} eventos analizados en {len(manifest['windows'])} ventanas de {window_hours} h")
+    for entry in overall['questions'][:5]:
+        print(f"   💬 {entry['count']:>6} × {entry['text']}")
+    for entry in overall['products'][:5]:
+        print(f"   📦 {entry['count']:>6} × {entry['id']}")
+    print(f"✅ Manifiesto escrito en {output}")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construir el manifiesto de calentamiento a partir de las trazas grabadas")
+    parser.add_argument('traces', nargs='+', help="Trazas grabadas con TRACE_FILE (se leen todas sus sesiones) o sesiones concretas")
+    parser.add_argument('--output', default='warmup.json', help="Archivo de salida")
+    parser.add_argument('--json', dest='json_file', help="Catálogo JSON (por defecto se lee MongoDB)")
+    parser.add_argument('--window-hours', type=int, default=WARMUP_WINDOW_HOURS, help="Duración de cada ventana horaria")
+    parser.add_argument('--top-questions', type=int, default=50, help="Preguntas por ventana")
+    parser.add_argument('--top-products', type=int, default=100, help="Productos por ventana")
+    parser.add_argument('--tracked', type=int, default=WARMUP_TRACKED,
+                        help="Preguntas y productos distintos que se siguen por ventana")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print(f"🌡️ CONSTRUYENDO MANIFIESTO DE CALENTAMIENTO")
+    print("=" * 50)
+
+    success = build_warmup_manifest(args.traces, args.output, args.json_file, args.window_hours,
+                                    args.top_questions, args.top_products, args.tracked)
+
+    if success:
+        print("\n" + "=" * 50)
+        print("✅ MANIFIESTO CONSTRUIDO EXITOSAMENTE")
+        print("=" * 50)
+    else:
+        print("\n" + "=" * 50)
+        print("❌ NO SE PUDO CONSTRUIR EL MANIFIESTO")
+        print("=" * 50)
+        sys.exit(1)
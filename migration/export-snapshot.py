@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+MONGODB_URI = os.getenv('MONGODB_URI')
+MONGODB_DB = os.getenv('MONGODB_DB', 'TechStore')
+
+# Permitir importar los módulos compartidos de la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog_snapshot import write_snapshot
+
+
+def load_from_json(json_file):
+    """Leer el catálogo desde el archivo JSON"""
+    try:
+        with open(json_file, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+            print(f"✅ Datos cargados correctamente desde {json_file}")
+            return data
+    except FileNotFoundError:
+        print(f"❌ Archivo no encontrado: {json_file}")
+    except json.JSONDecodeError:
+        print(f"❌ Error al decodificar el archivo JSON: {json_file}")
+    return None
+
+
+def load_from_mongodb():
+    """Leer el catálogo desde MongoDB"""
+    if not MONGODB_URI:
+        print("⚠️ MONGODB_URI no encontrado en el archivo .env")
+        return None
+
+    from mongo_pool import get_connection_manager
+
+    try:
+        db = get_connection_manager(uri=MONGODB_URI).catalog_database(MONGODB_DB)
+        store_info = db.storeInfo.find_one({}, {'_id': 0}) or {}
+        categories = [category['name'] for category in db.categories.find({}, {'_id': 0, 'name': 1})]
+        products = list(db.products.find({}, {'_id': 0}))
+        print(f"✅ {len(products)} productos leídos desde MongoDB: {MONGODB_DB}")
+        return {'store_info': store_info, 'categories': categories, 'products': products}
+    except Exception as e:
+        print(f"❌ Error al leer el catálogo desde MongoDB: {str(e)}")
+        return None
+
+
+def export_snapshot(output, json_file=None):
+    """
+    Exporta el catálogo a un snapshot binario que los bots abren con mmap
+    """
+    data = load_from_json(json_file) if json_file else load_from_mongodb()
+    if data is None:
+        return False
+
+    try:
+        write_snapshot(data, output)
+        size = os.path.getsize(output)
+        print(f"✅ Snapshot escrito en {output} ({size / 1024:.1f} KB, {len(data.get('products', []))} productos)")
+        return True
+    except Exception as e:
+        print(f"❌ Error al escribir el snapshot: {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportar el catálogo a un snapshot binario")
+    parser.add_argument('--json', dest='json_file', help="Archivo JSON de origen (por defecto se lee MongoDB)")
+    parser.add_argument('--output', default='products.snap', help="Archivo de salida")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print(f"📦 EXPORTANDO SNAPSHOT DEL CATÁLOGO")
+    print("=" * 50)
+
+    success = export_snapshot(args.output, args.json_file)
+
+    if success:
+        print("\n" + "=" * 50)
+        print("✅ SNAPSHOT EXPORTADO EXITOSAMENTE")
+        print("=" * 50)
+    else:
+        print("\n" + "=" * 50)
+        print("❌ NO SE PUDO EXPORTAR EL SNAPSHOT")
+        print("=" * 50)
+        sys.exit(1)
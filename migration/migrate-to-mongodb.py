@@ -1,11 +1,16 @@
 import json
-import pymongo
-from pymongo import MongoClient
 import os
+import sys
+import argparse
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
+
+# Permitir importar los módulos compartidos de la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mongo_pool import get_connection_manager
+from category_summaries import CategorySummaries
 MONGODB_URI = os.getenv('MONGODB_URI')
 MONGODB_DB = os.getenv('MONGODB_DB', 'TechStore')
 
@@ -32,8 +37,7 @@ def migrate_data_to_mongodb(json_file='products.json'):
     
     # Conectar a MongoDB
     try:
-        client = MongoClient(MONGODB_URI)
-        db = client[MONGODB_DB]
+        db = get_connection_manager(uri=MONGODB_URI).database(MONGODB_DB)
         print(f"✅ Conexión exitosa a MongoDB: {MONGODB_DB}")
     except Exception as e:
         print(f"❌ Error al conectar a MongoDB: {str(e)}")
@@ -85,19 +89,73 @@ def migrate_data_to_mongodb(json_file='products.json'):
         db.products.create_index("category")
         # Índice para búsqueda de ofertas
         db.products.create_index("ofertas.activa")
+        # Índice para la contabilidad diaria de tokens por usuario
+        db.token_usage.create_index([("day", 1), ("user_id", 1)], unique=True)
+        # Índice de clientes para las difusiones
+        db.customers.create_index("chat_id", unique=True)
+        # Las actualizaciones atendidas (deduplicación entre instancias) se borran solas al caducar
+        db.processed_updates.create_index("expires_at", expireAfterSeconds=0)
         print("✅ Índices creados correctamente")
     except Exception as e:
         print(f"❌ Error al crear índices: {str(e)}")
     
+    # Resúmenes materializados por categoría que lee /productos
+    try:
+        CategorySummaries(db).rebuild()
+        print("✅ Resúmenes de categorías calculados correctamente")
+    except Exception as e:
+        print(f"❌ Error al calcular los resúmenes de categorías: {str(e)}")
+    
     print(f"✅ Migración completada con éxito a la base de datos {MONGODB_DB}")
     return True
 
+def migrate_data_to_sqlite(json_file='products.json', sqlite_file='products.db'):
+    """
+    Migra los datos del archivo JSON a una base de datos SQLite (WAL + FTS5)
+    """
+    from catalog_repository import SqliteCatalogRepository
+    
+    # Cargar datos desde el archivo JSON
+    try:
+        with open(json_file, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+            print(f"✅ Datos cargados correctamente desde {json_file}")
+    except FileNotFoundError:
+        print(f"❌ Archivo no encontrado: {json_file}")
+        return False
+    except json.JSONDecodeError:
+        print(f"❌ Error al decodificar el archivo JSON: {json_file}")
+        return False
+    
+    # Sustituir el catálogo completo en una sola transacción (los lectores ven el anterior hasta el final)
+    try:
+        repository = SqliteCatalogRepository(sqlite_file, create=True)
+        repository.replace_all(data)
+        print(f"✅ {len(data.get('categories', []))} categorías y {len(data.get('products', []))} productos migrados con éxito")
+        if not repository.has_fts:
+            print("⚠️ SQLite no incluye FTS5: la búsqueda de productos usará LIKE")
+        repository.close()
+    except Exception as e:
+        print(f"❌ Error al migrar a SQLite: {str(e)}")
+        return False
+    
+    print(f"✅ Migración completada con éxito a la base de datos {sqlite_file}")
+    return True
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrar el catálogo de products.json a MongoDB o SQLite")
+    parser.add_argument('--json', dest='json_file', default='products.json', help="Archivo JSON de origen")
+    parser.add_argument('--sqlite', help="Migrar a esta base de datos SQLite en lugar de MongoDB")
+    args = parser.parse_args()
+    
     print("=" * 50)
-    print(f"🚀 INICIANDO MIGRACIÓN DE DATOS A MONGODB")
+    print(f"🚀 INICIANDO MIGRACIÓN DE DATOS A {'SQLITE' if args.sqlite else 'MONGODB'}")
     print("=" * 50)
     
-    success = migrate_data_to_mongodb('products.json')
+    if args.sqlite:
+        success = migrate_data_to_sqlite(args.json_file, args.sqlite)
+    else:
+        success = migrate_data_to_mongodb(args.json_file)
     
     if success:
         print("\n" + "=" * 50)
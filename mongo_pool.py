@@ -0,0 +1,210 @@
+import os
+import time
+import logging
+import threading
+from pymongo import MongoClient, ReadPreference, monitoring
+
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '50'))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '5'))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', '300000'))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', '5000'))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', '10000'))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+
+# Colecciones de solo lectura del catálogo y los índices que usan sus consultas
+CATALOG_INDEXES = {
+    'products': ['id', 'category', 'ofertas.activa'],
+}
+
+
+class PoolHealthListener(monitoring.ConnectionPoolListener):
+    """Contar eventos del pool de conexiones para exponer su salud como métricas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkout_failed = 0
+        self.pools_cleared = 0
+
+    def _bump(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    @property
+    def open_connections(self):
+        return self.created - self.closed
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump('pools_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self._bump('checked_out')
+
+    def connection_checked_in(self, event):
+        self._bump('checked_out', -1)
+
+
+class MongoConnectionManager:
+    """
+    Cliente de MongoDB compartido con pool configurable.
+
+    Las lecturas del catálogo (solo lectura) usan `secondaryPreferred` para
+    repartirse entre réplicas; las escrituras siguen yendo al primario.
+    """
+
+    def __init__(self, uri=None, max_pool_size=MONGODB_MAX_POOL_SIZE, min_pool_size=MONGODB_MIN_POOL_SIZE,
+                 max_idle_time_ms=MONGODB_MAX_IDLE_TIME_MS, connect_timeout_ms=MONGODB_CONNECT_TIMEOUT_MS,
+                 socket_timeout_ms=MONGODB_SOCKET_TIMEOUT_MS,
+                 server_selection_timeout_ms=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                 wait_queue_timeout_ms=MONGODB_WAIT_QUEUE_TIMEOUT_MS, metrics=None):
+        # Se lee al crear el cliente (no al importar el módulo) para respetar el `.env` cargado por el bot
+        self.uri = uri or os.getenv('MONGODB_URI')
+        self.min_pool_size = min_pool_size
+        self._warmed = set()
+        self._warmup_lock = threading.Lock()
+        self.metrics = metrics or default_metrics
+        self.pool_listener = PoolHealthListener()
+        self.client = MongoClient(
+            self.uri,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            maxIdleTimeMS=max_idle_time_ms,
+            connectTimeoutMS=connect_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            waitQueueTimeoutMS=wait_queue_timeout_ms,
+            event_listeners=[self.pool_listener],
+        )
+        self.metrics.register_gauge_callback(self.export_metrics)
+
+    def database(self, name):
+        """Base de datos para lecturas y escrituras (primario)"""
+        return self.client[name]
+
+    def catalog_database(self, name):
+        """Base de datos para las consultas de solo lectura del catálogo"""
+        return self.client.get_database(name, read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    def warmup(self, db_name):
+        """
+        Abrir conexiones y cargar en memoria los índices del catálogo antes de
+        recibir tráfico, para que las primeras solicitudes no paguen la
+        selección de servidor ni el establecimiento de conexiones.
+
+        La base de datos solo se da por precalentada si todo salió bien; si
+        no, la siguiente llamada lo vuelve a intentar. Las llamadas simultáneas
+        esperan a la que está en curso.
+        """
+        with self._warmup_lock:
+            if db_name in self._warmed:
+                return True
+            start = time.time()
+            try:
+                self.client.admin.command('ping')
+                catalog = self.catalog_database(db_name)
+                # Ejecutar consultas en paralelo abre hasta `min_pool_size` conexiones; cada índice se recorre una sola vez
+                indexes = [(collection, field) for collection, fields in CATALOG_INDEXES.items() for field in fields]
+                count = max(1, self.min_pool_size)
+                failures = []
+                threads = [
+                    threading.Thread(target=self._prime_indexes, args=(catalog, indexes[position::count], failures))
+                    for position in range(count)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            except Exception as e:
+                logger.error(f"❌ Error al precalentar MongoDB: {str(e)}")
+                return False
+            if failures:
+                logger.warning(f"⚠️ Precalentamiento de MongoDB incompleto ({len(failures)} fallos), se reintentará")
+                return False
+            self._warmed.add(db_name)
+            elapsed = time.time() - start
+            self.metrics.observe('mongo_warmup_seconds', elapsed)
+            logger.info(f"🔥 Pool de MongoDB precalentado en {elapsed:.2f} segundos "
+                        f"({self.pool_listener.open_connections} conexiones abiertas)")
+            return True
+
+    @staticmethod
+    def _prime_indexes(db, indexes, failures):
+        if not indexes:
+            # Sin índices que recorrer, este hilo solo abre su conexión
+            try:
+                db.command('ping')
+            except Exception as e:
+                failures.append(e)
+                logger.warning(f"⚠️ No se pudo abrir una conexión de precalentamiento: {str(e)}")
+            return
+        for collection, field in indexes:
+            try:
+                # Recorrer el índice completo (consulta cubierta) lo carga en la caché del servidor
+                for _ in db[collection].find({}, {field: 1, '_id': 0}).hint([(field, 1)]):
+                    pass
+            except Exception as e:
+                failures.append(e)
+                logger.warning(f"⚠️ No se pudo precalentar el índice {collection}.{field}: {str(e)}")
+
+    def pool_stats(self):
+        """Resumen de la salud del pool de conexiones"""
+        listener = self.pool_listener
+        return {
+            'open': listener.open_connections,
+            'in_use': listener.checked_out,
+            'created': listener.created,
+            'closed': listener.closed,
+            'checkout_failed': listener.checkout_failed,
+            'pools_cleared': listener.pools_cleared,
+        }
+
+    def export_metrics(self, metrics):
+        for name, value in self.pool_stats().items():
+            metrics.set(f'mongo_pool_{name}', value)
+
+    def close(self):
+        self.client.close()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_connection_manager(**kwargs):
+    """Gestor de conexiones único del proceso (se crea la primera vez que se pide)"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = MongoConnectionManager(**kwargs)
+        return _manager
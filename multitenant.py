@@ -0,0 +1,116 @@
+import os
+import json
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+# Cargar variables de entorno antes de importar los módulos que leen su configuración al importarse
+load_dotenv()
+
+from metrics import metrics, start_metrics_server
+from mongo_pool import get_connection_manager
+from productsv2 import StoreBot, MONGODB_URI
+from tracing import TRACE_FILE
+from warmup import WARMUP_MANIFEST
+
+logger = logging.getLogger(__name__)
+
+TENANTS_FILE = os.getenv('TENANTS_FILE', 'tenants.json')
+
+
+def load_tenants(file_path=TENANTS_FILE):
+    """
+    Cargar la configuración de tiendas desde un archivo JSON:
+    [{"name": "...", "telegram_token": "...", "mongodb_db": "..."}, ...]
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            tenants = json.load(file)
+    except FileNotFoundError:
+        logger.error(f"❌ Archivo de tiendas no encontrado: {file_path}")
+        return []
+    except json.JSONDecodeError:
+        logger.error(f"❌ Error al decodificar el archivo JSON: {file_path}")
+        return []
+
+    valid = []
+    for tenant in tenants:
+        if not tenant.get('telegram_token') or not tenant.get('mongodb_db'):
+            logger.error(f"⚠️ Tienda sin telegram_token o mongodb_db, se omite: {tenant.get('name', 'sin nombre')}")
+            continue
+        valid.append(tenant)
+    logger.info(f"🏬 Tiendas configuradas: {len(valid)}")
+    return valid
+
+
+def tenant_file(file_path):
+    """Con varias tiendas cada una usa su propio archivo (traza, manifiesto): `{tenant}` se añade a la ruta si no está"""
+    if not file_path or '{tenant}' in file_path:
+        return file_path
+    directory, name = os.path.split(file_path)
+    stem, dot, extension = name.partition('.')
+    return os.path.join(directory, f"{stem}-{{tenant}}{dot}{extension}")
+
+
+def create_bots(tenants, connections=None):
+    """Crear un StoreBot por tienda compartiendo el pool de MongoDB y las métricas"""
+    connections = connections or get_connection_manager(uri=MONGODB_URI, metrics=metrics)
+    bots = []
+    for tenant in tenants:
+        bots.append(StoreBot(
+            telegram_token=tenant['telegram_token'],
+            db_name=tenant['mongodb_db'],
+            connections=connections,
+            metrics=metrics,
+            tenant=tenant.get('name') or tenant['mongodb_db'],
+            trace_file=tenant_file(tenant.get('trace_file') or TRACE_FILE),
+            warmup_manifest=tenant_file(tenant.get('warmup_manifest') or WARMUP_MANIFEST),
+        ))
+    return bots
+
+
+async def run_tenants(bots):
+    """Ejecutar todas las tiendas en un único bucle de eventos"""
+    apps = []
+    try:
+        for bot in bots:
+            app = bot.build_application()
+            await app.initialize()
+            # post_init/post_shutdown solo se invocan automáticamente con run_polling()
+            await bot.post_init(app)
+            await app.start()
+            await app.updater.start_polling()
+            apps.append((bot, app))
+            logger.info(f"✅ Tienda {bot.tenant} lista ({bot.store_info.get('name', '')})")
+
+        logger.info(f"🚀 {len(apps)} tiendas en polling en un solo proceso")
+        await asyncio.Event().wait()
+    finally:
+        for bot, app in reversed(apps):
+            await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+            await bot.post_shutdown(app)
+
+
+def main():
+    tenants = load_tenants()
+    if not tenants:
+        logger.error("⚠️ No hay tiendas configuradas")
+        return
+
+    start_metrics_server(metrics)
+    bots = create_bots(tenants)
+    asyncio.run(run_tenants(bots))
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print(f"🏬 INICIANDO BOT MULTI-TIENDA CON GPT-3.5 Y MONGODB")
+    print("=" * 50)
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n" + "=" * 50)
+        print("⛔ Bots detenidos por el usuario")
+        print("=" * 50)
@@ -0,0 +1,243 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+OFFER_FLUSH_INTERVAL = float(os.getenv('OFFER_FLUSH_INTERVAL', '5'))
+# Tiempo máximo de espera entre comprobaciones, por si cambia el reloj del sistema
+OFFER_MAX_SLEEP = float(os.getenv('OFFER_MAX_SLEEP', '3600'))
+
+ACTIVATE = 'activate'
+DEACTIVATE = 'deactivate'
+
+
+def parse_offer_time(value, end=False):
+    """
+    Convertir `fecha_inicio`/`fecha_fin` a marca de tiempo local.
+    Una fecha sin hora (`2025-04-15`) cubre el día completo, así que como fin
+    se interpreta como el final de ese día.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        logger.warning(f"⚠️ Fecha de oferta no válida: {value}")
+        return None
+    if end and len(str(value)) == 10:
+        parsed += timedelta(days=1)
+    return parsed.timestamp()
+
+
+class OfferIndex:
+    """
+    Índice en memoria de las ofertas ordenado por vencimiento.
+
+    Los cambios programados (activar al llegar `fecha_inicio`, desactivar al
+    pasar `fecha_fin`) se guardan en un montículo; las entradas obsoletas se
+    descartan al extraerlas comparando la generación de cada producto.
+    """
+
+    def __init__(self):
+        self.products = {}
+        self.active = {}
+        self._events = []
+        self._generation = {}
+        self._seq = 0
+
+    def load(self, products, now=None):
+        """
+        Indexar el catálogo completo.
+        Devuelve los cambios de estado que hay que aplicar ya (ofertas vencidas
+        o que debieron activarse mientras el bot estaba detenido).
+        """
+        now = time.time() if now is None else now
+        self.products = {}
+        self.active = {}
+        self._events = []
+        self._generation = {}
+        changes = []
+        for product in products:
+            change = self.upsert(product, now)
+            if change is not None:
+                changes.append(change)
+        logger.info(f"🔥 Índice de ofertas cargado: {len(self.active)} activas, {len(self._events)} cambios programados")
+        return changes
+
+    def upsert(self, product, now=None):
+        """Indexar o reindexar un producto; devuelve (id, activa) si su estado debe cambiar ya"""
+        now = time.time() if now is None else now
+        product_id = product.get('id')
+        self.products[product_id] = product
+        generation = self._generation.get(product_id, 0) + 1
+        self._generation[product_id] = generation
+
+        ofertas = product.get('ofertas') or {}
+        start = parse_offer_time(ofertas.get('fecha_inicio'))
+        end = parse_offer_time(ofertas.get('fecha_fin'), end=True)
+        currently_active = bool(ofertas.get('activa', False))
+
+        # Con fecha de inicio el estado lo decide el calendario; sin ella, la bandera `activa`
+        if start is not None:
+            should_be_active = start <= now and (end is None or now < end)
+        else:
+            should_be_active = currently_active and (end is None or now < end)
+
+        if should_be_active:
+            self.active[product_id] = end if end is not None else float('inf')
+            if end is not None:
+                self._push(end, product_id, DEACTIVATE, generation)
+        else:
+            self.active.pop(product_id, None)
+            if start is not None and now < start:
+                self._push(start, product_id, ACTIVATE, generation)
+
+        if should_be_active != currently_active:
+            return product_id, should_be_active
+        return None
+
+    def remove(self, product_id):
+        self.products.pop(product_id, None)
+        self.active.pop(product_id, None)
+        self._generation[product_id] = self._generation.get(product_id, 0) + 1
+
+    def _push(self, when, product_id, action, generation):
+        self._seq += 1
+        heapq.heappush(self._events, (when, self._seq, product_id, action, generation))
+
+    def next_deadline(self):
+        """Marca de tiempo del próximo cambio programado válido, o None"""
+        while self._events:
+            when, _, product_id, _, generation = self._events[0]
+            if self._generation.get(product_id) == generation:
+                return when
+            heapq.heappop(self._events)
+        return None
+
+    def pop_due(self, now=None):
+        """Extraer los cambios vencidos y aplicarlos al índice; devuelve [(id, activa)]"""
+        now = time.time() if now is None else now
+        changes = []
+        while self._events and self._events[0][0] <= now:
+            when, _, product_id, action, generation = heapq.heappop(self._events)
+            if self._generation.get(product_id) != generation:
+                continue
+            product = self.products[product_id]
+            if action == ACTIVATE:
+                end = parse_offer_time((product.get('ofertas') or {}).get('fecha_fin'), end=True)
+                if end is not None and end <= now:
+                    continue
+                self.active[product_id] = end if end is not None else float('inf')
+                if end is not None:
+                    self._push(end, product_id, DEACTIVATE, generation)
+                changes.append((product_id, True))
+            else:
+                self.active.pop(product_id, None)
+                changes.append((product_id, False))
+        return changes
+
+    def active_products(self):
+        """Productos con oferta activa, los que vencen antes primero"""
+        return [self.products[product_id] for product_id, _ in sorted(self.active.items(), key=lambda item: item[1])]
+
+
+class OfferScheduler:
+    """
+    Temporizador que aplica los cambios del índice de ofertas a su hora.
+
+    Cada cambio se aplica en memoria de inmediato mediante `on_change` y se
+    acumula para escribirse en MongoDB por lotes con una sola operación; tras
+    cada escritura se llama a `on_flush` con los IDs escritos.
+    """
+
+    def __init__(self, index, on_change, collection=None, flush_interval=OFFER_FLUSH_INTERVAL, on_flush=None):
+        self.index = index
+        self.on_change = on_change
+        self.collection = collection
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def apply(self, changes):
+        """Aplicar cambios de estado en memoria y encolarlos para MongoDB"""
+        for product_id, active in changes:
+            product = self.index.products.get(product_id)
+            if product is None:
+                continue
+            product.setdefault('ofertas', {})['activa'] = active
+            self._pending[product_id] = active
+            logger.info(f"🔥 Oferta de {product.get('name', product_id)} {'activada' if active else 'desactivada'}")
+        if changes:
+            self.on_change([product_id for product_id, _ in changes])
+
+    def reschedule(self):
+        """Despertar el temporizador tras añadir un cambio más próximo que el actual"""
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    async def _run(self):
+        last_flush = time.time()
+        while True:
+            deadline = self.index.next_deadline()
+            timeout = OFFER_MAX_SLEEP if deadline is None else max(0, deadline - time.time())
+            if self._pending:
+                timeout = min(timeout, max(0, last_flush + self.flush_interval - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(timeout, OFFER_MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                self.apply(self.index.pop_due())
+                if self._pending and time.time() - last_flush >= self.flush_interval:
+                    await asyncio.to_thread(self.flush)
+                    last_flush = time.time()
+            except Exception as e:
+                logger.error(f"❌ Error en el temporizador de ofertas: {str(e)}")
+
+    def flush(self):
+        """Escribir en MongoDB los cambios de estado pendientes en una sola operación por lotes"""
+        if self.collection is None or not self._pending:
+            self._pending = {}
+            return 0
+        pending, self._pending = self._pending, {}
+
+        from pymongo import UpdateOne
+
+        operations = [
+            UpdateOne({"id": product_id}, {"$set": {"ofertas.activa": active}})
+            for product_id, active in pending.items()
+        ]
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+            logger.info(f"💾 {len(operations)} cambios de ofertas guardados en MongoDB")
+        except Exception as e:
+            logger.error(f"❌ Error al guardar cambios de ofertas: {str(e)}")
+            for product_id, active in pending.items():
+                self._pending.setdefault(product_id, active)
+            return 0
+        if self.on_flush is not None:
+            self.on_flush(list(pending))
+        return len(operations)
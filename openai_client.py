@@ -0,0 +1,98 @@
+import os
+import logging
+import threading
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+def client_settings():
+    """
+    Configuración del cliente leída del entorno en el momento de crearlo (y
+    no al importar el módulo), así que también respeta lo que cargue `load_dotenv`.
+    """
+    return {
+        # URL base de la API (por ejemplo un servidor local que la imita); vacío = API de OpenAI
+        'base_url': os.getenv('OPENAI_BASE_URL') or None,
+        # Conexiones HTTP abiertas como máximo y cuántas se mantienen abiertas (keep-alive) entre solicitudes
+        'max_connections': int(os.getenv('OPENAI_MAX_CONNECTIONS', '100')),
+        'max_keepalive': int(os.getenv('OPENAI_MAX_KEEPALIVE', '20')),
+        # Segundos que una conexión inactiva sigue abierta para reutilizarla
+        'keepalive_expiry': float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '60')),
+        # Tiempos de espera (segundos): conexión, lectura de la respuesta completa y espera de una conexión libre del pool
+        'connect_timeout': float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5')),
+        'read_timeout': float(os.getenv('OPENAI_READ_TIMEOUT', '60')),
+        'pool_timeout': float(os.getenv('OPENAI_POOL_TIMEOUT', '10')),
+        # Reintentos del SDK ante errores de red y respuestas 429/5xx
+        'max_retries': int(os.getenv('OPENAI_MAX_RETRIES', '2')),
+    }
+
+
+def create_openai_client(api_key=None, **overrides):
+    """
+    Cliente asíncrono de OpenAI sobre un pool de conexiones HTTP propio.
+
+    Las conexiones se mantienen abiertas (keep-alive) y se reutilizan entre
+    solicitudes, así que solo la primera paga el establecimiento de TCP y TLS.
+    `overrides` sustituye valores de `client_settings()` (por ejemplo `base_url`
+    o `max_keepalive`).
+    """
+    settings = client_settings()
+    unknown = set(overrides) - set(settings)
+    if unknown:
+        raise TypeError(f"Parámetros desconocidos del cliente de OpenAI: {', '.join(sorted(unknown))}")
+    settings.update(overrides)
+    timeout = httpx.Timeout(settings['read_timeout'], connect=settings['connect_timeout'], pool=settings['pool_timeout'])
+    http_client = httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=settings['max_connections'],
+                            max_keepalive_connections=settings['max_keepalive'],
+                            keepalive_expiry=settings['keepalive_expiry']),
+    )
+    return AsyncOpenAI(
+        api_key=api_key or os.getenv('OPENAI_API_KEY'),
+        base_url=settings['base_url'],
+        timeout=timeout,
+        max_retries=settings['max_retries'],
+        http_client=http_client,
+    )
+
+
+_client = None
+_users = 0
+_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Cliente de OpenAI compartido por todos los bots del proceso (se crea la primera vez que se pide)"""
+    global _client
+    with _lock:
+        if _client is None:
+            settings = client_settings()
+            _client = create_openai_client(**settings)
+            logger.info(f"🔌 Cliente de OpenAI creado ({settings['base_url'] or 'api.openai.com'}, "
+                        f"hasta {settings['max_connections']} conexiones, {settings['max_keepalive']} en keep-alive)")
+        return _client
+
+
+def acquire_openai_client():
+    """Registrar un bot que usa el cliente compartido (en `post_init`, ya dentro del bucle de eventos)"""
+    global _users
+    client = get_openai_client()
+    with _lock:
+        _users += 1
+    return client
+
+
+async def release_openai_client():
+    """Liberar el cliente compartido; el último bot en detenerse cierra sus conexiones"""
+    global _client, _users
+    with _lock:
+        _users = max(0, _users - 1)
+        client = _client if _users == 0 else None
+        if client is not None:
+            _client = None
+    if client is not None:
+        await client.close()
+        logger.info("🔌 Cliente de OpenAI cerrado")
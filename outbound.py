@@ -0,0 +1,262 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import httpx
+from telegram.error import RetryAfter, NetworkError
+
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Límites de envío de la Bot API de Telegram
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', '3'))
+OUTBOUND_MAX_CONCURRENCY = int(os.getenv('OUTBOUND_MAX_CONCURRENCY', '8'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+# Un flood wait pausa solo su chat; si llegan de tantos chats distintos en la ventana (segundos),
+# el límite es global y se pausa toda la cola
+OUTBOUND_GLOBAL_FLOOD_CHATS = int(os.getenv('OUTBOUND_GLOBAL_FLOOD_CHATS', '3'))
+OUTBOUND_GLOBAL_FLOOD_WINDOW = float(os.getenv('OUTBOUND_GLOBAL_FLOOD_WINDOW', '10'))
+
+# Errores de conexión en los que la petición no llegó a Telegram: solo estos se reintentan, porque un
+# `TimedOut` o un corte a mitad de la respuesta pueden llegar con el mensaje ya entregado
+UNSENT_ERRORS = (httpx.PoolTimeout, httpx.ConnectTimeout, httpx.ConnectError)
+
+# Prioridades: las respuestas a usuarios siempre salen antes que los envíos masivos
+INTERACTIVE = 0
+BULK = 1
+
+
+class TokenBucket:
+    """Cubeta de tokens: `rate` tokens por segundo con ráfagas de hasta `capacity`"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity=None, now=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        """Consumir un token; devuelve 0 si se concedió o los segundos que faltan para el siguiente"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds, now=None):
+        """Vaciar la cubeta durante `seconds` (por ejemplo tras un flood wait)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def is_full(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundMessage:
+    __slots__ = ('chat_id', 'text', 'kwargs', 'priority', 'future', 'attempts', 'enqueued_at')
+
+    def __init__(self, chat_id, text, kwargs, priority, future):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class OutboundScheduler:
+    """
+    Cola de salida de mensajes con límites por chat y globales.
+
+    Los mensajes listos se ordenan por prioridad; los que están esperando a que
+    su chat recupere tokens pasan a una cola diferida ordenada por hora. Un
+    `RetryAfter` de Telegram pausa la cubeta de su chat y reprograma el
+    mensaje; solo si llegan de `global_flood_chats` chats distintos en
+    `global_flood_window` segundos se trata como límite global y se pausa
+    también la cubeta global. Los errores de red solo se reintentan si la
+    petición no llegó a enviarse, para no entregar un mensaje dos veces.
+    """
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 chat_burst=OUTBOUND_CHAT_BURST, max_concurrency=OUTBOUND_MAX_CONCURRENCY,
+                 max_retries=OUTBOUND_MAX_RETRIES, global_flood_chats=OUTBOUND_GLOBAL_FLOOD_CHATS,
+                 global_flood_window=OUTBOUND_GLOBAL_FLOOD_WINDOW, metrics=None, tenant=None):
+        # Sin ráfagas globales: los envíos se espacian uniformemente
+        self.global_bucket = TokenBucket(global_rate, capacity=1)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.global_flood_chats = max(1, global_flood_chats)
+        self.global_flood_window = global_flood_window
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+        self.bot = None
+
+        self._chat_buckets = {}
+        # Chats con un flood wait reciente: {chat_id: instante}
+        self._flood_chats = {}
+        self._ready = []
+        self._delayed = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def pending(self, priority=None):
+        """Mensajes en cola (opcionalmente solo los de una prioridad)"""
+        items = [item[2] for item in self._ready] + [item[2] for item in self._delayed]
+        if priority is None:
+            return len(items)
+        return sum(1 for message in items if message.priority == priority)
+
+    def start(self, bot):
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def send(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        """Encolar un mensaje; devuelve un futuro con el `Message` enviado"""
+        future = asyncio.get_running_loop().create_future()
+        self._push_ready(OutboundMessage(chat_id, text, kwargs, priority, future))
+        return future
+
+    def _push_ready(self, message):
+        self._seq += 1
+        heapq.heappush(self._ready, (message.priority, self._seq, message))
+        self._wakeup.set()
+
+    def _push_delayed(self, message, ready_at):
+        self._seq += 1
+        heapq.heappush(self._delayed, (ready_at, self._seq, message))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_chat_buckets(self):
+        """Olvidar las cubetas llenas para que la memoria no crezca con cada chat"""
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_full(now)]:
+            del self._chat_buckets[chat_id]
+
+    async def _run(self):
+        last_prune = time.monotonic()
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, message = heapq.heappop(self._delayed)
+                self._push_ready(message)
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, message = heapq.heappop(self._ready)
+            if message.future.cancelled():
+                continue
+
+            chat_wait = self._chat_bucket(message.chat_id).take()
+            if chat_wait > 0:
+                self._push_delayed(message, now + chat_wait)
+                continue
+
+            global_wait = self.global_bucket.take()
+            while global_wait > 0:
+                await asyncio.sleep(global_wait)
+                global_wait = self.global_bucket.take()
+
+            await self._slots.acquire()
+            asyncio.get_running_loop().create_task(self._deliver(message))
+
+            if now - last_prune > 60:
+                self._prune_chat_buckets()
+                last_prune = now
+
+    async def _deliver(self, message):
+        try:
+            result = await self.bot.send_message(chat_id=message.chat_id, text=message.text, **message.kwargs)
+            if not message.future.done():
+                message.future.set_result(result)
+            self.metrics.inc('outbound_sent_total', tenant=self.tenant, priority=message.priority)
+            self.metrics.observe('outbound_queue_seconds', time.monotonic() - message.enqueued_at,
+                                 tenant=self.tenant, priority=message.priority)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+            scope = self._flood_wait(message.chat_id, retry_after)
+            logger.warning(f"⏳ Flood wait de Telegram ({'global' if scope == 'global' else f'chat {message.chat_id}'}): "
+                           f"reintentando en {retry_after:.0f} segundos")
+            self.metrics.inc('outbound_flood_waits_total', tenant=self.tenant, scope=scope)
+            self._retry(message, retry_after, e)
+        except NetworkError as e:
+            # python-telegram-bot envuelve el error de httpx: la causa dice si la petición salió
+            if isinstance(e.__cause__, UNSENT_ERRORS):
+                self._retry(message, 2 ** message.attempts, e)
+            else:
+                logger.warning(f"⚠️ Envío al chat {message.chat_id} sin confirmar, no se reintenta: {str(e)}")
+                self._fail(message, e)
+        except Exception as e:
+            self._fail(message, e)
+        finally:
+            self._slots.release()
+
+    def _flood_wait(self, chat_id, seconds):
+        """Pausar el chat de un flood wait (y toda la cola si varios chats lo reciben a la vez); devuelve el alcance"""
+        now = time.monotonic()
+        self._chat_bucket(chat_id).pause(seconds, now)
+        self._flood_chats[chat_id] = now
+        for stale in [chat for chat, at in self._flood_chats.items() if now - at > self.global_flood_window]:
+            del self._flood_chats[stale]
+        if len(self._flood_chats) < self.global_flood_chats:
+            return 'chat'
+        self.global_bucket.pause(seconds, now)
+        self._flood_chats.clear()
+        return 'global'
+
+    def _fail(self, message, error):
+        self.metrics.inc('outbound_failed_total', tenant=self.tenant, priority=message.priority)
+        if not message.future.done():
+            message.future.set_exception(error)
+
+    def _retry(self, message, delay, error):
+        message.attempts += 1
+        if message.attempts > self.max_retries:
+            self._fail(message, error)
+            return
+        self.metrics.inc('outbound_retries_total', tenant=self.tenant)
+        self._push_delayed(message, time.monotonic() + delay)
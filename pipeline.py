@@ -0,0 +1,105 @@
+import os
+import time
+import asyncio
+import logging
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se renueva "escribiendo..." mientras se genera la respuesta (Telegram lo muestra unos 5 segundos)
+TYPING_INTERVAL = float(os.getenv('TYPING_INTERVAL', '4'))
+
+
+class StageTimer:
+    """
+    Tiempos de las etapas de atención de un mensaje.
+
+    Las etapas que se esperan una tras otra forman el camino crítico; las que
+    corren en segundo plano (por ejemplo el indicador de escritura) se
+    registran aparte para ver cuánto se solapan.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.background = set()
+
+    @contextlib.contextmanager
+    def stage(self, name, background=False):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            if background:
+                self.background.add(name)
+
+    async def run(self, name, awaitable, background=False):
+        """Esperar `awaitable` contando su duración como la etapa `name`"""
+        with self.stage(name, background):
+            return await awaitable
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        critical = ' | '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.stages.items()
+                              if name not in self.background)
+        parallel = ', '.join(f"{name} {self.stages[name] * 1000:.0f} ms" for name in self.background)
+        text = f"{critical} | total {self.total * 1000:.0f} ms"
+        return f"{text} (en paralelo: {parallel})" if parallel else text
+
+    def observe(self, metrics, **labels):
+        """Exportar la duración de cada etapa y la total como histogramas"""
+        for name, seconds in self.stages.items():
+            metrics.observe('storebot_stage_seconds', seconds, stage=name, **labels)
+        metrics.observe('storebot_message_seconds', self.total, **labels)
+
+
+class TypingIndicator:
+    """
+    Muestra "escribiendo..." en un chat desde una tarea en segundo plano.
+
+    La primera acción se envía sin esperar su respuesta, de modo que la
+    solicitud a OpenAI sale a la vez; después se renueva cada `interval`
+    segundos hasta que se llama a `stop`, para que el indicador no
+    desaparezca durante las respuestas largas. Los errores de Telegram se
+    registran y detienen el indicador, sin afectar a la respuesta.
+    """
+
+    def __init__(self, bot, chat_id, interval=TYPING_INTERVAL, timer=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.timer = timer
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def _send(self):
+        await self.bot.send_chat_action(chat_id=self.chat_id, action="typing")
+
+    async def _run(self):
+        try:
+            if self.timer is not None:
+                await self.timer.run('typing', self._send(), background=True)
+            else:
+                await self._send()
+            while True:
+                await asyncio.sleep(self.interval)
+                await self._send()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo mostrar 'escribiendo...' en el chat {self.chat_id}: {str(e)}")
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
@@ -0,0 +1,427 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from openai_client import get_openai_client
+from quota import extract_usage
+from recommendations import effective_price, in_stock
+from category_summaries import UNCATEGORIZED
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Redactar con GPT un texto breve de cada producto para su ficha (una sola vez por producto y descripción)
+PRODUCT_CARDS_COPY = os.getenv('PRODUCT_CARDS_COPY', '1') == '1'
+# Solicitudes simultáneas a OpenAI al redactar las fichas
+PRODUCT_CARDS_CONCURRENCY = int(os.getenv('PRODUCT_CARDS_CONCURRENCY', '4'))
+PRODUCT_CARDS_MODEL = os.getenv('PRODUCT_CARDS_MODEL', 'gpt-3.5-turbo')
+PRODUCT_CARDS_MAX_TOKENS = int(os.getenv('PRODUCT_CARDS_MAX_TOKENS', '120'))
+# Botones de producto por página en el teclado de /productos
+PRODUCT_CARDS_PAGE_SIZE = int(os.getenv('PRODUCT_CARDS_PAGE_SIZE', '8'))
+# Productos similares que se muestran (y se enlazan) en cada ficha
+PRODUCT_CARDS_SIMILAR = int(os.getenv('PRODUCT_CARDS_SIMILAR', '3'))
+
+# Prefijos de `callback_data` (Telegram admite hasta 64 bytes)
+CARD_PREFIX = 'card:'
+PAGE_PREFIX = 'cards:'
+MAX_CALLBACK_DATA = 64
+# Segundos seguidos de renderizado (y de cálculo de similares) antes de ceder el bucle de eventos
+RENDER_SLICE = 0.005
+
+
+def card_key(product_id):
+    """Clave de un producto en las fichas y en los botones (los IDs pueden ser números o texto)"""
+    return str(product_id)
+
+
+def copy_digest(product):
+    """Huella de los campos que usa el texto redactado: cambiar el precio o el stock no obliga a redactarlo de nuevo"""
+    source = '\x00'.join(str(product.get(field, '')) for field in ('name', 'category', 'description'))
+    return hashlib.blake2b(source.encode(), digest_size=12).hexdigest()
+
+
+def format_card(product, copy=None, similar=()):
+    """Ficha de un producto: texto redactado (o descripción), precio, oferta, stock y similares"""
+    lines = [f"📦 {product.get('name', 'Producto sin nombre')}"]
+    if product.get('category'):
+        lines.append(f"📁 {product.get('category')}")
+    lines.append("")
+    lines.append(copy or product.get('description') or "Sin descripción disponible.")
+    lines.append("")
+
+    price = product.get('price', 0) or 0
+    ofertas = product.get('ofertas', {})
+    if ofertas.get('activa', False):
+        lines.append(f"💰 Precio: ${ofertas.get('precio_oferta', 0):.2f} (antes ${price:.2f})")
+        lines.append(f"🔥 OFERTA: {ofertas.get('descuento', '')} de descuento, "
+                     f"válida hasta {ofertas.get('fecha_fin', 'tiempo limitado')}")
+    else:
+        lines.append(f"💰 Precio: ${price:.2f}")
+    if in_stock(product):
+        lines.append(f"✅ Disponible ({product.get('stock', 0)} unidades)")
+    else:
+        lines.append("❌ Sin stock por ahora")
+
+    if similar:
+        lines.append("")
+        lines.append("🧭 También te puede interesar:")
+        lines.extend(f"• {candidate.get('name', '')}: ${effective_price(candidate):.2f}" for candidate in similar)
+    return "\n".join(lines)
+
+
+def product_button(product):
+    """Botón que abre la ficha de un producto, o None si su ID no cabe en `callback_data`"""
+    data = CARD_PREFIX + card_key(product.get('id'))
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        return None
+    label = product.get('name', 'Producto sin nombre')
+    if product.get('ofertas', {}).get('activa', False):
+        label += " 🔥"
+    return InlineKeyboardButton(label[:60], callback_data=data)
+
+
+class ProductCards:
+    """
+    Fichas de producto pregeneradas para servirlas al instante desde botones.
+
+    Cada vez que cambia el catálogo (`refresh`) se construyen en segundo plano
+    las fichas de esa versión del catálogo. Si se indican los productos
+    cambiados, solo se vuelven a renderizar sus fichas, las que los enlazan
+    como similares y aquellas en las que ahora entrarían como similares (la
+    similitud es simétrica, así que basta con compararlos con el umbral de
+    cada ficha); el resto se reutiliza de la versión anterior. El renderizado
+    cede el bucle de eventos cada `RENDER_SLICE` segundos. El texto
+    redactado por GPT se pide una sola vez por producto y descripción, en lote
+    y con como mucho `concurrency` solicitudes simultáneas; se guarda por la
+    huella de la descripción (en memoria y, si hay colección, en MongoDB), así
+    que un cambio de precio u oferta solo vuelve a renderizar la plantilla.
+    Mientras se construye una versión se siguen sirviendo las fichas de la
+    anterior; un producto sin ficha se renderiza al momento sin texto redactado.
+    """
+
+    def __init__(self, collection=None, copy=PRODUCT_CARDS_COPY, concurrency=PRODUCT_CARDS_CONCURRENCY,
+                 model=PRODUCT_CARDS_MODEL, max_tokens=PRODUCT_CARDS_MAX_TOKENS, page_size=PRODUCT_CARDS_PAGE_SIZE,
+                 similar=PRODUCT_CARDS_SIMILAR, store_name=None, metrics=None, tenant=None):
+        self.collection = collection
+        self.copy = copy
+        self.concurrency = max(1, concurrency)
+        self.model = model
+        self.max_tokens = max_tokens
+        self.page_size = max(1, page_size)
+        self.similar = similar
+        self.store_name = store_name or 'nuestra tienda'
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+        # Fichas por versión del catálogo: {versión: {clave del producto: texto}}
+        self.cards = {}
+        self.version = None
+        # Similares de cada ficha de la última versión: {clave: (claves de los similares, similitud mínima)}
+        self.links = {}
+        # Productos cambiados desde la última versión construida (None: hay que renderizar todas las fichas)
+        self._dirty = None
+        self.copies = {}
+        self._unsaved = set()
+        self._products = {}
+        self._order = []
+        self._by_category = {}
+        self._recommender = None
+        self._revision = None
+        self._pending = None
+        self._task = None
+        self._building = None
+        # Fichas precargadas por el calentamiento y fichas servidas desde ellas
+        self._warmed = (None, set())
+        self.warm_hits = 0
+
+    def refresh(self, products, version, recommender=None, changed=None):
+        """
+        Construir las fichas de `version` del catálogo. `changed` son los IDs de
+        los productos añadidos, modificados o eliminados desde la versión
+        anterior; sin ellos (o con otro índice de recomendaciones) se renderizan
+        todas. Sin bucle de eventos en marcha (al arrancar) la construcción
+        espera a `start`.
+        """
+        if changed is None or recommender is not self._recommender:
+            self._dirty = None
+        elif self._dirty is not None:
+            self._dirty.update(map(card_key, changed))
+        products = list(products)
+        self._products = {card_key(product.get('id')): product for product in products}
+        self._order = [product for product in products if product_button(product) is not None]
+        self._by_category = {}
+        for product in self._order:
+            self._by_category.setdefault(product.get('category') or UNCATEGORIZED, []).append(product)
+        self._recommender = recommender
+        if version == self._building or (version == self.version and self._task is None):
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._pending = (products, version)
+            return
+        self._launch(products, version)
+
+    def start(self):
+        """Lanzar la construcción pendiente (en `post_init`, ya dentro del bucle de eventos)"""
+        if self._pending is not None:
+            products, version = self._pending
+            self._pending = None
+            self._launch(products, version)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._building = None
+        await asyncio.to_thread(self.save_copies)
+
+    def _launch(self, products, version):
+        # Una versión más reciente reemplaza a la que se estaba construyendo
+        if self._task is not None:
+            self._task.cancel()
+        self._building = version
+        self._task = asyncio.get_running_loop().create_task(self._build(products, version))
+
+    async def _build(self, products, version):
+        start = time.time()
+        try:
+            keys = {card_key(product.get('id')) for product in products}
+            # Si el índice recalculó toda su matriz, las similitudes de todas las fichas pueden haber cambiado
+            revision = self._recommender.revision if self._recommender is not None else None
+            if self._dirty is None or revision != self._revision:
+                cards, links, render = {}, {}, products
+            else:
+                base = self.cards.get(self.version, {})
+                cards = {key: card for key, card in base.items() if key in keys}
+                links = {key: link for key, link in self.links.items() if key in keys}
+                stale = await self.stale_cards(keys, base)
+                render = [product for product in products if card_key(product.get('id')) in stale]
+            if self.copy:
+                await self.write_copies(render)
+            slice_start = time.perf_counter()
+            for product in render:
+                key = card_key(product.get('id'))
+                cards[key], links[key] = self._render(product)
+                if time.perf_counter() - slice_start >= RENDER_SLICE:
+                    await asyncio.sleep(0)
+                    slice_start = time.perf_counter()
+            self.cards = {version: cards}
+            self.links = links
+            self.version = version
+            self._revision = revision
+            self._dirty = set()
+            elapsed = time.time() - start
+            self.metrics.set('storebot_product_cards', len(cards), tenant=self.tenant)
+            self.metrics.observe('storebot_product_cards_build_seconds', elapsed, tenant=self.tenant)
+            logger.info(f"🗂️ {len(cards)} fichas de producto listas para la versión {version} del catálogo "
+                        f"({len(render)} renderizadas) en {elapsed:.1f} s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error al construir las fichas de producto: {str(e)}")
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+                self._building = None
+        await asyncio.to_thread(self.save_copies)
+
+    async def stale_cards(self, keys, base):
+        """
+        Fichas que hay que volver a renderizar tras cambiar los productos de
+        `_dirty`: las suyas, las que aún no existen, las que los enlazan como
+        similares y aquellas cuyo umbral de similitud superan ahora
+        """
+        dirty = self._dirty
+        stale = {key for key in keys if key in dirty or key not in base}
+        stale.update(key for key, (similar, _) in self.links.items() if not dirty.isdisjoint(similar))
+        if self._recommender is None or not self.similar:
+            return stale
+        slice_start = time.perf_counter()
+        for key in dirty:
+            product = self._products.get(key)
+            # Un producto sin stock no aparece entre los similares de ninguna ficha
+            if product is None or not in_stock(product):
+                continue
+            for product_id, score in self._recommender.similarities(product.get('id')).items():
+                link = self.links.get(card_key(product_id))
+                if link is not None and score > link[1]:
+                    stale.add(card_key(product_id))
+            if time.perf_counter() - slice_start >= RENDER_SLICE:
+                await asyncio.sleep(0)
+                slice_start = time.perf_counter()
+        return stale
+
+    async def write_copies(self, products):
+        """Redactar el texto de los productos que aún no lo tienen, con concurrencia acotada"""
+        missing = {}
+        for product in products:
+            digest = copy_digest(product)
+            if digest not in self.copies:
+                missing.setdefault(digest, product)
+        if missing and self.collection is not None:
+            self.copies.update(await asyncio.to_thread(self.load_copies, list(missing)))
+            missing = {digest: product for digest, product in missing.items() if digest not in self.copies}
+        if not missing:
+            return
+
+        logger.info(f"✍️ Redactando {len(missing)} fichas de producto con GPT ({self.concurrency} a la vez)")
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def write(digest, product):
+            async with slots:
+                copy = await self.write_copy(product)
+            if copy:
+                self.copies[digest] = copy
+                self._unsaved.add(digest)
+
+        await asyncio.gather(*(write(digest, product) for digest, product in missing.items()))
+
+    async def write_copy(self, product):
+        """Texto breve y atractivo de un producto; None si OpenAI falla (la ficha usa la descripción)"""
+        try:
+            response = await get_openai_client().chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": (
+                        f"Eres redactor de {self.store_name}. Escribe en español dos o tres frases atractivas "
+                        f"y precisas sobre el producto. No inventes características y no menciones precios ni stock."
+                    )},
+                    {"role": "user", "content": (
+                        f"Producto: {product.get('name', '')}\n"
+                        f"Categoría: {product.get('category', '')}\n"
+                        f"Descripción: {product.get('description', '')}"
+                    )},
+                ],
+                max_tokens=self.max_tokens,
+                temperature=0.7
+            )
+            usage = extract_usage(response)
+            self.metrics.inc('storebot_product_cards_copies_total', tenant=self.tenant)
+            self.metrics.inc('storebot_tokens_total', usage.get('total_tokens', 0) or 0, tenant=self.tenant)
+            return (response.choices[0].message.content or '').strip() or None
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo redactar la ficha de {product.get('name', '')}: {str(e)}")
+            return None
+
+    def load_copies(self, digests):
+        """Textos ya redactados guardados en MongoDB"""
+        try:
+            return {document['_id']: document['copy']
+                    for document in self.collection.find({"_id": {"$in": digests}}, {"copy": 1})}
+        except Exception as e:
+            logger.error(f"❌ Error al cargar los textos de las fichas: {str(e)}")
+            return {}
+
+    def save_copies(self):
+        """Guardar en MongoDB los textos redactados desde el último guardado"""
+        if self.collection is None or not self._unsaved:
+            return
+        from pymongo import UpdateOne
+
+        digests, self._unsaved = self._unsaved, set()
+        try:
+            self.collection.bulk_write([
+                UpdateOne({"_id": digest}, {"$set": {"copy": self.copies[digest]}}, upsert=True)
+                for digest in digests
+            ], ordered=False)
+        except Exception as e:
+            self._unsaved |= digests
+            logger.error(f"❌ Error al guardar los textos de las fichas: {str(e)}")
+
+    def render(self, product):
+        return self._render(product)[0]
+
+    def _render(self, product):
+        """Ficha de un producto y sus enlaces: (claves de los similares, similitud mínima para entrar entre ellos)"""
+        similar = []
+        if self._recommender is not None and self.similar:
+            similar = self._recommender.similar(product.get('id'), limit=self.similar)
+        # Con la lista incompleta, cualquier producto en stock que cambie puede entrar en ella
+        threshold = similar[-1][1] if len(similar) >= self.similar else float('-inf')
+        card = format_card(product, self.copies.get(copy_digest(product)), [candidate for candidate, _ in similar])
+        return card, (frozenset(card_key(candidate.get('id')) for candidate, _ in similar), threshold)
+
+    def get(self, product_id):
+        """Ficha de un producto de la última versión construida (o renderizada al momento si aún no la tiene)"""
+        key = card_key(product_id)
+        product = self._products.get(key)
+        if product is None:
+            return None
+        card = self.cards.get(self.version, {}).get(key)
+        if card is None:
+            self.metrics.inc('storebot_product_cards_misses_total', tenant=self.tenant)
+            card = self.render(product)
+        elif self._warmed[0] == self.version and key in self._warmed[1]:
+            self.warm_hits += 1
+            self.metrics.inc('storebot_product_cards_warm_hits_total', tenant=self.tenant)
+        return card
+
+    async def warm(self, product_ids):
+        """
+        Renderizar ya las fichas de los productos más consultados (calentamiento
+        al arrancar), sin esperar a que termine la construcción completa. Solo
+        se usan los textos ya guardados en MongoDB: aquí no se llama a OpenAI.
+        """
+        products = [self._products[key] for key in map(card_key, product_ids) if key in self._products]
+        missing = list({copy_digest(product) for product in products} - set(self.copies))
+        if missing and self.collection is not None:
+            self.copies.update(await asyncio.to_thread(self.load_copies, missing))
+        version = self.version
+        cards = self.cards.setdefault(version, {})
+        warmed = set()
+        for product in products:
+            key = card_key(product.get('id'))
+            if key not in cards:
+                cards[key], self.links[key] = self._render(product)
+                warmed.add(key)
+        self._warmed = (version, warmed)
+        return len(warmed)
+
+    def card_keyboard(self, product_id):
+        """Botones de la ficha: productos similares y vuelta al listado"""
+        rows = []
+        product = self._products.get(card_key(product_id))
+        if product is not None and self._recommender is not None and self.similar:
+            for candidate, _ in self._recommender.similar(product.get('id'), limit=self.similar):
+                button = product_button(candidate)
+                if button is not None:
+                    rows.append([button])
+        rows.append([InlineKeyboardButton("📋 Ver todos los productos", callback_data=f"{PAGE_PREFIX}0")])
+        return InlineKeyboardMarkup(rows)
+
+    def keyboard(self, page=0, category=None):
+        """Teclado de /productos: una página de productos (de una categoría o de todas) y botones para pasar de página"""
+        suffix = f":{category}" if category is not None else ""
+        if len(f"{PAGE_PREFIX}{page + 1}{suffix}".encode()) > MAX_CALLBACK_DATA:
+            # El nombre de la categoría no cabe en los botones de página: se pagina el catálogo completo
+            category, suffix = None, ""
+        order = self._order if category is None else self._by_category.get(category, [])
+        if not order:
+            return None
+        pages = (len(order) + self.page_size - 1) // self.page_size
+        page = min(max(page, 0), pages - 1)
+        products = order[page * self.page_size:(page + 1) * self.page_size]
+        rows = [[product_button(product)] for product in products]
+        if pages > 1:
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton("◀️", callback_data=f"{PAGE_PREFIX}{page - 1}{suffix}"))
+            navigation.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"{PAGE_PREFIX}{page}{suffix}"))
+            if page < pages - 1:
+                navigation.append(InlineKeyboardButton("▶️", callback_data=f"{PAGE_PREFIX}{page + 1}{suffix}"))
+            rows.append(navigation)
+        return InlineKeyboardMarkup(rows)
+
+    @staticmethod
+    def parse_page(data):
+        """(página, categoría o None) de la `callback_data` de un botón de página"""
+        page, separator, category = data[len(PAGE_PREFIX):].partition(':')
+        return int(page), (category if separator else None)
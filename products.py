@@ -3,10 +3,30 @@ import json
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+# Cargar variables de entorno antes de importar los módulos que leen su configuración al importarse
+load_dotenv()
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, filters, CallbackContext
 from telegram import Update
+from telegram.error import BadRequest
 import openai
+from openai_client import get_openai_client, acquire_openai_client, release_openai_client
 import time
+import threading
+from catalog import build_system_context, build_catalog_listing, validate_catalog, diff_products, ordered_lines
+from context_registry import ContextRegistry
+from product_cards import ProductCards, CARD_PREFIX, PAGE_PREFIX
+from inline_search import InlineSearch, InlineSearchIndex
+from workers import get_worker_pool, CONTEXT, LISTING
+from recommendations import RecommendationIndex, format_candidates, effective_price, in_stock
+from catalog_watcher import FileWatcher
+from catalog_snapshot import SnapshotError
+from catalog_repository import open_catalog
+import sqlite3
+import asyncio
+from quota import TokenQuotaManager, QuotaExceeded, extract_usage
+from pipeline import StageTimer, TypingIndicator
+from routing import ModelRouter, trim_history
+from dedupe import UpdateDeduplicator, INFLIGHT
 
 # Configurar logging
 logging.basicConfig(
@@ -15,11 +35,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno
-load_dotenv()
+# Variables de entorno
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Recargar el catálogo automáticamente cuando cambia el archivo de productos
+PRODUCTS_WATCH = os.getenv('PRODUCTS_WATCH', '1') == '1'
+PRODUCTS_POLL_INTERVAL = float(os.getenv('PRODUCTS_POLL_INTERVAL', '2'))
+
+# Respuesta de /productos mientras se construye el listado de un snapshot recién abierto
+CATALOG_LOADING = "⏳ Estamos preparando el catálogo, vuelve a intentarlo en unos segundos."
+
 # Verificar que las claves están disponibles
 if not TELEGRAM_TOKEN:
     logger.error("⚠️ TELEGRAM_TOKEN no encontrado en el archivo .env")
@@ -29,96 +55,219 @@ if not OPENAI_API_KEY:
     logger.error("⚠️ OPENAI_API_KEY no encontrado en el archivo .env")
     exit(1)
 
-# Configurar OpenAI
-openai.api_key = OPENAI_API_KEY
-
 class StoreBot:
-    def __init__(self, products_file='products.json'):
+    def __init__(self, products_file='products.json', watch=PRODUCTS_WATCH):
         self.conversations = {}
         self.start_time = datetime.now()
+        self.products_file = products_file
         self.products_data = self.load_products(products_file)
         self.store_info = self.products_data.get('store_info', {})
+        self.product_lines = {}
+        # Pool de procesos para renderizar catálogos grandes sin competir con el bucle de eventos
+        self.workers = get_worker_pool()
+        
+        # Recarga en caliente del catálogo: el archivo se vigila desde un hilo en segundo plano
+        self.loop = None
+        self.reload_lock = threading.Lock()
+        self.last_reload = None
+        self.watcher = FileWatcher(products_file, self.reload_catalog, PRODUCTS_POLL_INTERVAL) if watch else None
+        
+        # Cuotas por usuario (sin persistencia en la versión basada en archivo)
+        self.quota = TokenQuotaManager()
+        
+        # Modelo, max_tokens e historial de cada solicitud según el tipo de consulta y la cuota del usuario
+        self.router = ModelRouter(quota=self.quota)
+        
+        # Actualizaciones repetidas (reintentos de Telegram) y mensajes enviados dos veces
+        self.dedupe = UpdateDeduplicator()
         
         # Crear un contexto del sistema para enviar a GPT
-        self.system_context = self.create_system_context()
+        self.contexts = ContextRegistry()
+        self.contexts.publish(self.create_system_context())
+        
+        # Un snapshot se abre sin recorrer sus filas: el listado, las fichas y los índices se construyen
+        # en segundo plano al arrancar (`index_catalog`) en lugar de crear una vista por producto aquí
+        self.indexing = hasattr(self.products_data.get('products'), 'context_block')
+        self.index_task = None
+        self.catalog_listing = CATALOG_LOADING if self.indexing else self.create_catalog_listing()
+        
+        # Índice vectorizado de productos similares para /similares y los candidatos del prompt
+        self.recommender = RecommendationIndex()
+        if not self.indexing:
+            self.recommender.build(self.products_data.get('products', []))
+        
+        # Fichas de producto pregeneradas para los botones de /productos
+        self.cards = ProductCards(store_name=self.store_info.get('name'))
+        if not self.indexing:
+            self.cards.refresh(self.products_data.get('products', []), self.contexts.latest, self.recommender)
+        
+        # Búsqueda inline (@bot texto) sobre un trie de prefijos en memoria
+        self.search = InlineSearch(self.cards)
+        if not self.indexing:
+            self.search.build(self.products_data.get('products', []))
         
         logger.info(f"📝 Inicializando StoreBot a las {self.start_time.strftime('%Y-%m-%d %H:%M:%S')}")
         logger.info(f"🏪 Información de tienda cargada: {self.store_info.get('name', 'Desconocido')}")
         logger.info(f"📦 Productos cargados: {len(self.products_data.get('products', []))}")
     
+    def read_catalog(self, file_path):
+        """Leer el catálogo completo del archivo (JSON, snapshot `.snap` o base de datos SQLite)"""
+        repository = open_catalog(file_path)
+        try:
+            return repository.as_products_data()
+        finally:
+            repository.close()
+    
     def load_products(self, file_path):
-        """Cargar datos de productos desde un archivo JSON"""
+        """Cargar datos de productos desde un archivo JSON, un snapshot binario (.snap) o SQLite"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                logger.info(f"✅ Datos de productos cargados correctamente desde {file_path}")
-                return data
+            data = self.read_catalog(file_path)
+            logger.info(f"✅ Datos de productos cargados correctamente desde {file_path}")
+            return data
         except FileNotFoundError:
             logger.error(f"❌ Archivo de productos no encontrado: {file_path}")
             return {"store_info": {"name": "Tienda Demo"}, "products": []}
         except json.JSONDecodeError:
             logger.error(f"❌ Error al decodificar el archivo JSON: {file_path}")
             return {"store_info": {"name": "Tienda Demo"}, "products": []}
+        except SnapshotError as e:
+            logger.error(f"❌ Snapshot de catálogo inválido: {str(e)}")
+            return {"store_info": {"name": "Tienda Demo"}, "products": []}
+        except sqlite3.DatabaseError as e:
+            logger.error(f"❌ Error al leer la base de datos SQLite del catálogo: {str(e)}")
+            return {"store_info": {"name": "Tienda Demo"}, "products": []}
     
-    def create_system_context(self):
+    def create_system_context(self, products_data=None, product_lines=None):
         """Crear un contexto del sistema para entrenar al modelo GPT"""
-        store_name = self.store_info.get('name', 'Nuestra Tienda')
-        store_desc = self.store_info.get('description', '')
-        
-        # Crear una representación de los productos para el contexto
-        products_info = []
-        for product in self.products_data.get('products', []):
-            product_info = (
-                f"ID: {product.get('id', 'N/A')}, "
-                f"Nombre: {product.get('name', 'N/A')}, "
-                f"Categoría: {product.get('category', 'N/A')}, "
-                f"Precio: ${product.get('price', 0):.2f}, "
-                f"Descripción: {product.get('description', 'N/A')}, "
-                f"Stock: {product.get('stock', 0)} unidades, "
-                f"Disponible: {'Sí' if product.get('disponible', False) else 'No'}"
-            )
-            
-            # Añadir información de ofertas si existe
-            ofertas = product.get('ofertas', {})
-            if ofertas.get('activa', False):
-                product_info += (
-                    f", OFERTA: {ofertas.get('descuento', '')} de descuento, "
-                    f"Precio de oferta: ${ofertas.get('precio_oferta', 0):.2f}, "
-                    f"Válido hasta: {ofertas.get('fecha_fin', 'N/A')}"
-                )
-            
-            products_info.append(product_info)
-        
-        # Crear el mensaje del sistema
-        system_message = f"""
-Eres un asistente virtual para la tienda {store_name}. 
-{store_desc}
-
-INFORMACIÓN DE LA TIENDA:
-- Nombre: {self.store_info.get('name', 'N/A')}
-- Horario: {self.store_info.get('horario', 'N/A')}
-- Dirección: {self.store_info.get('direccion', 'N/A')}
-- Teléfono: {self.store_info.get('telefono', 'N/A')}
-- Email: {self.store_info.get('email', 'N/A')}
-- Política de envíos: {self.store_info.get('politica_envios', 'N/A')}
-- Política de devoluciones: {self.store_info.get('politica_devoluciones', 'N/A')}
-
-CATÁLOGO DE PRODUCTOS:
-{chr(10).join(products_info)}
-
-INSTRUCCIONES:
-1. Debes actuar siempre como un representante amable y profesional de {store_name}.
-2. Proporciona información precisa sobre los productos, precios y disponibilidad.
-3. Si un producto está en oferta, asegúrate de mencionarlo y destacar el descuento.
-4. Si un cliente pregunta por un producto que no está en el catálogo, indícale amablemente que no está disponible pero sugiere alternativas similares.
-5. Para compras, indica al cliente que puede realizar el pedido en nuestra tienda física, a través de nuestra web o en este mismo chat.
-6. Cuando el cliente pregunte por el proceso de compra, explícale que puede pagar con tarjeta de crédito, PayPal o transferencia bancaria.
-7. Mantén un tono conversacional, amable y cercano en todo momento.
-8. Si te preguntan sobre un tema que no está relacionado con la tienda o los productos, redirígelos amablemente de vuelta a temas relacionados con nuestra tienda.
-"""
+        products_data = self.products_data if products_data is None else products_data
+        product_lines = self.product_lines if product_lines is None else product_lines
+        products = products_data.get('products', [])
+        
+        # Un snapshot binario trae las líneas de productos ya renderizadas
+        if hasattr(products, 'context_block'):
+            products_info = [products.context_block()]
+        else:
+            # Formatear solo los productos que aún no tienen su línea en caché (en el pool si son muchos)
+            missing = [product for product in products if product.get('id') not in product_lines]
+            if missing:
+                product_lines.update(self.workers.run_sync(CONTEXT, missing))
+            products_info = ordered_lines(product_lines, [product.get('id') for product in products])
+        
+        system_message = build_system_context(products_data.get('store_info', {}), products_info)
         logger.info("✅ Contexto del sistema creado para GPT")
         return system_message
         
+    def create_catalog_listing(self, products_data=None):
+        """Mensaje de /productos, renderizado una vez por versión del catálogo"""
+        products_data = self.products_data if products_data is None else products_data
+        return build_catalog_listing(self.workers.run_sync(LISTING, products_data.get('products', [])))
+    
+    def reload_catalog(self):
+        """
+        Volver a leer el archivo de productos (en el hilo del vigilante).
+        Si el archivo no es válido se mantiene el catálogo actual.
+        """
+        with self.reload_lock:
+            start = time.time()
+            try:
+                data = self.read_catalog(self.products_file)
+            except (OSError, json.JSONDecodeError, SnapshotError, sqlite3.DatabaseError) as e:
+                logger.error(f"❌ Recarga del catálogo descartada, no se pudo leer {self.products_file}: {str(e)}")
+                self.last_reload = {"ok": False, "errors": [str(e)], "at": datetime.now()}
+                return False
+            
+            errors = validate_catalog(data)
+            if errors:
+                for error in errors[:10]:
+                    logger.error(f"❌ Catálogo no válido: {error}")
+                logger.error(f"❌ Recarga del catálogo descartada ({len(errors)} errores); se mantiene el catálogo actual")
+                self.last_reload = {"ok": False, "errors": errors, "at": datetime.now()}
+                return False
+            
+            # Reutilizar las líneas de los productos sin cambios y renderizar solo el resto
+            added, removed, changed = diff_products(self.products_data.get('products', []), data.get('products', []))
+            product_lines = dict(self.product_lines)
+            for product_id in removed + changed:
+                product_lines.pop(product_id, None)
+            system_context = self.create_system_context(data, product_lines)
+            catalog_listing = self.create_catalog_listing(data)
+            
+            # Índices de recomendaciones y de búsqueda inline: incrementales si cambian pocos productos,
+            # nuevos (en este hilo) si cambian muchos o aún no se construyeron los del snapshot abierto al arrancar
+            new_products = data.get('products', [])
+            if self.indexing or len(added) + len(changed) + len(removed) > len(new_products) // 2:
+                self.indexing = False
+                recommender = RecommendationIndex()
+                recommender.build(new_products)
+                index_changes = recommender
+                search_index = InlineSearchIndex()
+                search_index.build(new_products)
+            else:
+                search_index = None
+                by_id = {product.get('id'): product for product in new_products}
+                index_changes = ([by_id[product_id] for product_id in added + changed], removed)
+            
+            if self.loop is not None and self.loop.is_running():
+                # Sustituir el catálogo en el hilo del bucle para que ningún handler vea un estado mezclado
+                self.loop.call_soon_threadsafe(self.apply_catalog, data, product_lines, system_context,
+                                               catalog_listing, index_changes, search_index)
+            else:
+                self.apply_catalog(data, product_lines, system_context, catalog_listing, index_changes, search_index)
+            
+            elapsed = time.time() - start
+            self.last_reload = {
+                "ok": True, "at": datetime.now(), "seconds": elapsed,
+                "added": len(added), "removed": len(removed), "changed": len(changed),
+            }
+            logger.info(f"🔄 Catálogo recargado en {elapsed * 1000:.0f} ms: "
+                        f"{len(added)} añadidos, {len(removed)} eliminados, {len(changed)} modificados")
+            return True
+
+    def index_catalog(self):
+        """
+        Construir el listado y los índices del snapshot abierto al arrancar (en un hilo).
+        Si mientras tanto se recargó el catálogo, la recarga ya los construyó.
+        """
+        with self.reload_lock:
+            data = self.products_data
+            if not self.indexing:
+                return
+            self.indexing = False
+            start = time.time()
+            products = data.get('products', [])
+            catalog_listing = self.create_catalog_listing(data)
+            recommender = RecommendationIndex()
+            recommender.build(products)
+            search_index = InlineSearchIndex()
+            search_index.build(products)
+            system_context = self.create_system_context(data, self.product_lines)
+            self.loop.call_soon_threadsafe(self.apply_catalog, data, self.product_lines, system_context,
+                                           catalog_listing, recommender, search_index)
+            logger.info(f"🗂️ Índices del catálogo construidos en {(time.time() - start) * 1000:.0f} ms ({len(products)} productos)")
+
+    def apply_catalog(self, data, product_lines, system_context, catalog_listing, index_changes, search_index=None):
+        """Sustituir el catálogo activo por uno ya validado y renderizado"""
+        self.products_data = data
+        self.store_info = data.get('store_info', {})
+        self.product_lines = product_lines
+        self.contexts.publish(system_context)
+        self.catalog_listing = catalog_listing
+        # Con un índice de recomendaciones nuevo se vuelven a renderizar todas las fichas
+        changed = None
+        if isinstance(index_changes, RecommendationIndex):
+            self.recommender = index_changes
+        else:
+            upserts, removed = index_changes
+            self.recommender.remove(removed)
+            self.recommender.upsert(upserts)
+            self.search.remove(removed)
+            self.search.upsert(upserts)
+            changed = [product.get('id') for product in upserts] + removed
+        if search_index is not None:
+            self.search.index = search_index
+        self.cards.store_name = self.store_info.get('name') or self.cards.store_name
+        self.cards.refresh(data.get('products', []), self.contexts.latest, self.recommender, changed=changed)
+
     async def start_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /start"""
         user = update.message.from_user
@@ -146,6 +295,7 @@ INSTRUCCIONES:
             "/ayuda - Mostrar esta ayuda\n"
             "/productos - Ver listado de productos\n"
             "/ofertas - Ver productos en oferta\n"
+            "/similares <producto> [precio máximo] - Ver alternativas similares en stock\n"
             "/info - Información de la tienda\n"
             "/reset - Reiniciar la conversación\n\n"
             "También puedes preguntarme directamente sobre productos específicos, precios o cualquier duda que tengas 😊"
@@ -163,34 +313,35 @@ INSTRUCCIONES:
             await update.message.reply_text("Lo siento, no hay productos disponibles en este momento.")
             return
         
-        categories = {}
-        for product in products:
-            category = product.get('category', 'Sin categoría')
-            if category not in categories:
-                categories[category] = []
-            
-            price = product.get('price', 0)
-            name = product.get('name', 'Producto sin nombre')
-            
-            # Verificar si hay oferta
-            ofertas = product.get('ofertas', {})
-            if ofertas.get('activa', False):
-                price_text = f"${price:.2f} 🔥 OFERTA: ${ofertas.get('precio_oferta', 0):.2f}"
-            else:
-                price_text = f"${price:.2f}"
-            
-            categories[category].append(f"• {name}: {price_text}")
-        
-        # Construir mensaje por categorías
-        message_parts = ["📋 Nuestro catálogo de productos:\n"]
-        
-        for category, items in categories.items():
-            message_parts.append(f"\n📁 {category}:")
-            message_parts.extend(items)
+        await update.message.reply_text(self.catalog_listing, reply_markup=self.cards.keyboard())
+
+    async def card_callback(self, update: Update, context: CallbackContext):
+        """Manejador de los botones de /productos: fichas de producto y páginas del listado"""
+        query = update.callback_query
+        data = query.data or ''
         
-        message_parts.append("\n\nPara más detalles sobre un producto específico, pregúntame por su nombre.")
+        if data.startswith(PAGE_PREFIX):
+            await query.answer()
+            try:
+                await query.edit_message_reply_markup(reply_markup=self.cards.keyboard(*self.cards.parse_page(data)))
+            except (ValueError, BadRequest):
+                # Página no válida o la misma que ya se muestra
+                pass
+            return
         
-        await update.message.reply_text("\n".join(message_parts))
+        product_id = data[len(CARD_PREFIX):]
+        card = self.cards.get(product_id)
+        if card is None:
+            await query.answer("Este producto ya no está en el catálogo.", show_alert=True)
+            return
+        await query.answer()
+        logger.info(f"🗂️ Usuario {query.from_user.first_name} (ID: {query.from_user.id}) abrió la ficha del producto {product_id}")
+        await query.message.reply_text(card, reply_markup=self.cards.card_keyboard(product_id))
+
+    async def inline_query(self, update: Update, context: CallbackContext):
+        """Manejador de las consultas inline (@bot texto): productos que coinciden mientras se escribe"""
+        query = update.inline_query
+        await query.answer(self.search.answer(query.query), cache_time=self.search.cache_time)
 
     async def offers_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /ofertas"""
@@ -224,6 +375,41 @@ INSTRUCCIONES:
         
         await update.message.reply_text(message)
 
+    async def similar_command(self, update: Update, context: CallbackContext):
+        """Manejador del comando /similares <producto> [precio máximo]"""
+        user = update.message.from_user
+        args = list(context.args or [])
+        logger.info(f"🧭 Usuario {user.first_name} (ID: {user.id}) solicitó productos similares: {' '.join(args)}")
+        
+        # Un número al final se interpreta como precio máximo
+        max_price = None
+        if len(args) > 1:
+            try:
+                max_price = float(args[-1].lstrip('$').replace(',', '.'))
+                args = args[:-1]
+            except ValueError:
+                pass
+        if not args:
+            await update.message.reply_text("Indica un producto, por ejemplo: /similares iPhone 15 Pro 800")
+            return
+        
+        product, candidates = self.recommender.alternatives(' '.join(args), limit=5, max_price=max_price)
+        if product is None and not candidates:
+            await update.message.reply_text("No encontré ese producto en el catálogo. Prueba con otro nombre o usa /productos.")
+            return
+        
+        lines = []
+        if product is not None:
+            state = "✅ Disponible" if in_stock(product) else "❌ Sin stock"
+            lines.append(f"📦 {product.get('name', '')}: ${effective_price(product):.2f} ({state})\n")
+        if candidates:
+            limit_text = f" por menos de ${max_price:.2f}" if max_price is not None else ""
+            lines.append(f"🧭 Alternativas similares en stock{limit_text}:")
+            lines.extend(f"• {candidate.get('name', '')}: ${effective_price(candidate):.2f}" for candidate, _ in candidates)
+        else:
+            lines.append("No hay alternativas similares en stock con esas condiciones.")
+        await update.message.reply_text("\n".join(lines))
+
     async def store_info_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /info"""
         user = update.message.from_user
@@ -249,7 +435,7 @@ INSTRUCCIONES:
         
         if user_id in self.conversations:
             msg_count = len(self.conversations[user_id])
-            del self.conversations[user_id]
+            self.contexts.release_conversation(self.conversations.pop(user_id))
             logger.info(f"🔄 Usuario {user.first_name} (ID: {user_id}) reinició su conversación ({msg_count} mensajes borrados)")
             await update.message.reply_text("🔄 Conversación reiniciada correctamente. ¿En qué puedo ayudarte ahora?")
         else:
@@ -259,18 +445,43 @@ INSTRUCCIONES:
     async def handle_message(self, update: Update, context: CallbackContext):
         """Manejador principal de mensajes"""
         user = update.message.from_user
+        
+        # El mismo texto repetido mientras su respuesta está en camino no vuelve a llegar a OpenAI
+        key = self.dedupe.content_key(user.id, update.message.text)
+        if self.dedupe.begin(key) == INFLIGHT:
+            logger.info(f"♻️ Mensaje repetido de {user.first_name} (ID: {user.id}) descartado: la respuesta ya está en camino")
+            return
+        
+        try:
+            await self.answer_message(update, context)
+        finally:
+            self.dedupe.finish(key)
+
+    async def answer_message(self, update: Update, context: CallbackContext):
+        """Responder a un mensaje con GPT; devuelve la respuesta del modelo, o None si no se consultó"""
+        user = update.message.from_user
         user_id = user.id
         user_message = update.message.text
         
         # Log del mensaje recibido
         logger.info(f"💬 Mensaje recibido de {user.first_name} (ID: {user_id}): '{user_message[:30]}...' si es largo")
 
+        # Comprobar la cuota antes de encolar la solicitud a OpenAI
+        try:
+            self.quota.check(user_id)
+        except QuotaExceeded as e:
+            logger.warning(f"🚫 Usuario {user.first_name} (ID: {user_id}) superó su cuota ({e.reason})")
+            if e.reason == 'rate_limit':
+                quota_message = f"⏳ Estás enviando mensajes muy rápido. Intenta de nuevo en {e.retry_after} segundos."
+            else:
+                quota_message = "⏳ Has alcanzado tu límite diario de consultas. Vuelve mañana o usa /productos, /ofertas e /info."
+            await update.message.reply_text(quota_message)
+            return
+
         # Inicializar o recuperar el historial de conversación
         if user_id not in self.conversations:
             # Si es una nueva conversación, añadir el contexto del sistema
-            self.conversations[user_id] = [
-                {"role": "system", "content": self.system_context}
-            ]
+            self.conversations[user_id] = [self.contexts.start_conversation()]
             logger.info(f"👤 Nueva conversación iniciada con usuario {user.first_name} (ID: {user_id})")
 
         # Añadir el mensaje del usuario al historial
@@ -279,18 +490,25 @@ INSTRUCCIONES:
             "content": user_message
         })
 
+        # "Escribiendo..." en segundo plano: la solicitud a OpenAI sale sin esperar a Telegram
+        timer = StageTimer()
+        typing = TypingIndicator(context.bot, update.effective_chat.id, timer=timer).start()
         try:
-            # Indicar que el bot está escribiendo
-            await context.bot.send_chat_action(
-                chat_id=update.effective_chat.id, 
-                action="typing"
-            )
-            
             start_time = time.time()
             logger.info(f"🤖 Solicitando respuesta a GPT-3.5 para usuario {user.first_name} (ID: {user_id})")
 
+            # Candidatos del catálogo para esta consulta (solo para esta solicitud, no se guardan en el historial)
+            # y parámetros de la solicitud según el tipo de consulta
+            with timer.stage('context'):
+                product, alternatives = self.recommender.alternatives(user_message, limit=3)
+                candidates = format_candidates(product, alternatives)
+                route = self.router.route(user_message, user_id, mentions_product=product is not None)
+                messages = self.contexts.render(trim_history(self.conversations[user_id], route.history))
+            if candidates:
+                messages = messages + [{"role": "system", "content": candidates}]
+            
             # Obtener respuesta de GPT-3.5
-            response = await self.get_gpt_response(self.conversations[user_id])
+            response = await timer.run('model', self.get_gpt_response(messages, user_id, route))
             
             end_time = time.time()
             response_time = end_time - start_time
@@ -305,10 +523,17 @@ INSTRUCCIONES:
                 "content": response
             })
 
-            # Enviar la respuesta
-            await update.message.reply_text(response)
+            # Enviar la respuesta y, a la vez, persistir el uso de tokens por lotes sin bloquear el bucle de eventos
+            await typing.stop()
+            await asyncio.gather(
+                timer.run('reply', update.message.reply_text(response)),
+                timer.run('persist', self.persist_usage(), background=True),
+            )
+            logger.info(f"⏱️ Etapas del mensaje de {user.first_name} (ID: {user_id}): {timer.summary()}")
+            return response
 
         except Exception as e:
+            await typing.stop()
             logger.error(f"❌ Error procesando mensaje del usuario {user.first_name} (ID: {user_id}): {str(e)}")
             error_message = (
                 "❌ Lo siento, ocurrió un error al procesar tu mensaje.\n"
@@ -316,24 +541,38 @@ INSTRUCCIONES:
             )
             await update.message.reply_text(error_message)
 
-    async def get_gpt_response(self, conversation_history):
-        """Obtener respuesta de GPT-3.5"""
+    async def persist_usage(self):
+        """Guardar por lotes el uso de tokens cuando toca"""
+        if self.quota.should_flush():
+            await asyncio.to_thread(self.quota.flush)
+
+    async def get_gpt_response(self, conversation_history, user_id=None, route=None):
+        """Obtener respuesta de GPT-3.5 (con los parámetros de la ruta elegida) y registrar el uso de tokens"""
+        if route is None:
+            route = self.router.route(conversation_history[-1].get('content', ''), user_id)
         try:
-            logger.info(f"🔄 Enviando solicitud a OpenAI con {len(conversation_history)} mensajes en el historial")
+            logger.info(f"🔄 Enviando solicitud a OpenAI con {len(conversation_history)} mensajes en el historial "
+                        f"(ruta {route.name}: {route.model}, max_tokens={route.max_tokens}"
+                        f"{', bajo presión' if route.pressure else ''})")
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
+            start_time = time.time()
+            response = await get_openai_client().chat.completions.create(
+                model=route.model,
                 messages=conversation_history,
-                max_tokens=1000,
-                temperature=0.7
+                max_tokens=route.max_tokens,
+                temperature=route.temperature
             )
             
-            logger.info(f"✅ Respuesta recibida de OpenAI exitosamente")
+            usage = extract_usage(response)
+            self.router.observe(route, time.time() - start_time, usage)
+            if user_id is not None:
+                self.quota.record(user_id, usage)
+            logger.info(f"✅ Respuesta recibida de OpenAI exitosamente ({usage.get('total_tokens', 0)} tokens)")
             return response.choices[0].message.content
-        except openai.error.RateLimitError:
+        except openai.RateLimitError:
             logger.error("⚠️ Error de límite de tasa (Rate Limit) en OpenAI API")
             raise Exception("Se ha alcanzado el límite de solicitudes a OpenAI. Por favor, intenta más tarde.")
-        except openai.error.AuthenticationError:
+        except openai.AuthenticationError:
             logger.error("🔑 Error de autenticación en OpenAI API")
             raise Exception("Error de autenticación con OpenAI. Verifica tu API key.")
         except Exception as e:
@@ -344,22 +583,50 @@ INSTRUCCIONES:
         """Manejador global de errores"""
         logger.error(f"⚠️ Error en la actualización {update}: {context.error}")
 
+    async def post_init(self, app):
+        """Crear el cliente de OpenAI y empezar a vigilar el archivo de productos una vez creado el bucle de eventos"""
+        self.loop = asyncio.get_running_loop()
+        acquire_openai_client()
+        self.cards.start()
+        if self.indexing:
+            self.index_task = asyncio.create_task(asyncio.to_thread(self.index_catalog))
+        if self.watcher is not None:
+            self.watcher.start()
+
+    async def post_shutdown(self, app):
+        """Detener el vigilante y persistir el estado pendiente"""
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.workers.shutdown()
+        await self.cards.stop()
+        await release_openai_client()
+        self.quota.flush()
+
     def run(self):
         """Iniciar el bot"""
         logger.info("🤖 Iniciando el bot de tienda con Telegram...")
         
         # Crear la aplicación
-        app = Application.builder().token(TELEGRAM_TOKEN).build()
+        app = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
 
         # Añadir handlers
-        app.add_handler(CommandHandler("start", self.start_command))
-        app.add_handler(CommandHandler("ayuda", self.help_command))
-        app.add_handler(CommandHandler("help", self.help_command))
-        app.add_handler(CommandHandler("productos", self.products_command))
-        app.add_handler(CommandHandler("ofertas", self.offers_command))
-        app.add_handler(CommandHandler("info", self.store_info_command))
-        app.add_handler(CommandHandler("reset", self.reset_command))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        app.add_handler(CommandHandler("start", self.dedupe.wrap(self.start_command)))
+        app.add_handler(CommandHandler("ayuda", self.dedupe.wrap(self.help_command)))
+        app.add_handler(CommandHandler("help", self.dedupe.wrap(self.help_command)))
+        app.add_handler(CommandHandler("productos", self.dedupe.wrap(self.products_command)))
+        app.add_handler(CommandHandler("ofertas", self.dedupe.wrap(self.offers_command)))
+        app.add_handler(CommandHandler("similares", self.dedupe.wrap(self.similar_command)))
+        app.add_handler(CommandHandler("info", self.dedupe.wrap(self.store_info_command)))
+        app.add_handler(CommandHandler("reset", self.dedupe.wrap(self.reset_command)))
+        app.add_handler(CallbackQueryHandler(self.dedupe.wrap(self.card_callback), pattern=f"^({CARD_PREFIX}|{PAGE_PREFIX})"))
+        app.add_handler(InlineQueryHandler(self.dedupe.wrap(self.inline_query)))
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.dedupe.wrap(self.handle_message, model_call=True)))
         
         # Añadir manejador de errores
         app.add_error_handler(self.error_handler)
@@ -374,7 +641,7 @@ if __name__ == "__main__":
     print("=" * 50)
     print(f"🤖 INICIANDO BOT DE TIENDA CON GPT-3.5")
     print("=" * 50)
-    bot = StoreBot('products.json')
+    bot = StoreBot(os.getenv('PRODUCTS_FILE', 'products.json'))
     try:
         bot.run()
     except KeyboardInterrupt:
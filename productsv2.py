@@ -3,12 +3,38 @@ import json
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+# Cargar variables de entorno antes de importar los módulos que leen su configuración al importarse
+load_dotenv()
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, filters, CallbackContext
 from telegram import Update
+from telegram.error import BadRequest
 import openai
+from openai_client import get_openai_client, acquire_openai_client, release_openai_client
 import time
-import pymongo
-from pymongo import MongoClient
+import asyncio
+import contextlib
+from quota import TokenQuotaManager, QuotaExceeded, extract_usage
+from metrics import metrics as default_metrics, start_metrics_server
+from mongo_pool import get_connection_manager
+from catalog import build_system_context, build_catalog_listing, ordered_lines
+from context_registry import ContextRegistry
+from product_cards import ProductCards, CARD_PREFIX, PAGE_PREFIX
+from inline_search import InlineSearch, InlineSearchIndex
+from category_summaries import (CategorySummaries, CATEGORY_PREFIX, find_category, format_overview,
+                                category_keyboard, format_category)
+from offers import OfferIndex, OfferScheduler
+from catalog_snapshot import CatalogSnapshot
+from catalog_repository import MongoCatalogRepository
+from outbound import OutboundScheduler, INTERACTIVE
+from broadcast import CustomerRegistry, broadcast
+from workers import get_worker_pool, BuildSuperseded, CONTEXT, LISTING
+from recommendations import RecommendationIndex, format_candidates, effective_price, in_stock
+from tracing import TraceRecorder, TRACE_FILE
+from pipeline import StageTimer, TypingIndicator
+from routing import ModelRouter, trim_history
+from dedupe import UpdateDeduplicator, MongoUpdateStore, DEDUPE_SHARED_STORE, INFLIGHT
+from admission import AdmissionController, TemplateResponder, HIGH_DEMAND_MESSAGE, UPSTREAM_TIMEOUT
+from warmup import ResponseCache, CacheWarmup, WARMUP_MANIFEST, LIVE, WARMUP
 
 # Configurar logging
 logging.basicConfig(
@@ -17,18 +43,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno
-load_dotenv()
+# Variables de entorno
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 MONGODB_URI = os.getenv('MONGODB_URI')
 MONGODB_DB = os.getenv('MONGODB_DB', 'TechStore')
+# Snapshot binario del catálogo (migration/export-snapshot.py) para arrancar sin recorrer MongoDB
+CATALOG_SNAPSHOT = os.getenv('CATALOG_SNAPSHOT')
+# Actualizaciones de Telegram procesadas en paralelo (1 = de una en una)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+# IDs de Telegram autorizados para comandos de administración (separados por comas)
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').split(',') if admin_id.strip()}
 
 # Verificar que las claves están disponibles
-if not TELEGRAM_TOKEN:
-    logger.error("⚠️ TELEGRAM_TOKEN no encontrado en el archivo .env")
-    exit(1)
-    
+# (TELEGRAM_TOKEN se comprueba al arrancar: en modo multi-tienda cada tienda tiene el suyo)
 if not OPENAI_API_KEY:
     logger.error("⚠️ OPENAI_API_KEY no encontrado en el archivo .env")
     exit(1)
@@ -37,46 +65,153 @@ if not MONGODB_URI:
     logger.error("⚠️ MONGODB_URI no encontrado en el archivo .env")
     exit(1)
 
-# Configurar OpenAI
-openai.api_key = OPENAI_API_KEY
-
 class StoreBot:
-    def __init__(self):
+    def __init__(self, telegram_token=None, db_name=None, connections=None, metrics=None, tenant=None,
+                 snapshot_path=None, trace_file=None, warmup_manifest=None):
         self.conversations = {}
+        # Turnos de los usuarios con mensajes en curso: {user_id: [candado, mensajes esperando o en curso]}
+        self.user_turns = {}
         self.start_time = datetime.now()
+        self.telegram_token = telegram_token or TELEGRAM_TOKEN
+        self.db_name = db_name or MONGODB_DB
+        self.tenant = tenant or self.db_name
+        self.metrics = metrics or default_metrics
         
-        # Conectar a MongoDB
+        # Grabación opcional de las actualizaciones para reproducirlas en benchmarks/replay.py
+        # (con varias tiendas, `{tenant}` en la ruta separa el archivo de cada una)
+        trace_file = trace_file or TRACE_FILE
+        self.recorder = TraceRecorder(trace_file.format(tenant=self.tenant), tenant=self.tenant) if trace_file else None
+        
+        # Conectar a MongoDB (en modo multi-tienda el gestor de conexiones se comparte entre tiendas)
         try:
-            self.mongo_client = MongoClient(MONGODB_URI)
-            self.db = self.mongo_client[MONGODB_DB]
-            logger.info(f"✅ Conexión exitosa a MongoDB: {MONGODB_DB}")
+            self.connections = connections or get_connection_manager(uri=MONGODB_URI, metrics=self.metrics)
+            self.db = self.connections.database(self.db_name)
+            # Las consultas del catálogo son de solo lectura y pueden ir a las réplicas
+            self.catalog_db = self.connections.catalog_database(self.db_name)
+            self.repository = MongoCatalogRepository(self.catalog_db)
+            self.connections.warmup(self.db_name)
+            logger.info(f"✅ Conexión exitosa a MongoDB: {self.db_name}")
         except Exception as e:
             logger.error(f"❌ Error al conectar a MongoDB: {str(e)}")
             exit(1)
         
-        # Cargar datos desde MongoDB
-        self.store_info = self.load_store_info()
-        self.categories = self.load_categories()
+        # Contabilidad de tokens y cuotas por usuario, persistida por lotes
+        self.quota = TokenQuotaManager(self.db.token_usage)
+        
+        # Resúmenes materializados por categoría (colección `category_summaries`) para /productos
+        self.summaries = CategorySummaries(self.db, metrics=self.metrics, tenant=self.tenant)
+        self.summaries.ensure()
+        
+        # Cola de salida con límites de Telegram y registro de clientes para difusiones
+        self.outbound = OutboundScheduler(metrics=self.metrics, tenant=self.tenant)
+        self.customers = CustomerRegistry(self.db.customers)
+        self.broadcast_task = None
+        
+        # Cargar el catálogo desde el snapshot (si existe) o desde MongoDB
+        self.snapshot = self.open_snapshot(snapshot_path or CATALOG_SNAPSHOT)
+        if self.snapshot is not None:
+            self.store_info = self.snapshot.store_info
+            self.categories = self.snapshot.categories
+            # El snapshot se usa como diccionario ID → producto con lectura perezosa
+            self.products = self.snapshot
+        else:
+            self.store_info = self.load_store_info()
+            self.categories = self.load_categories()
+            # Caché del catálogo en memoria (por ID)
+            self.products = {product.get('id'): product for product in self.load_products()}
+        self.product_lines = {}
+        # Filas de los productos modificados desde que se exportó el snapshot (sus líneas del contexto ya no
+        # son las del archivo), por ID
+        self.snapshot_changes = {}
+        
+        # Los índices derivados del catálogo (recomendaciones, respuestas locales, búsqueda inline y fichas)
+        # de un snapshot se construyen en segundo plano al arrancar (`load_catalog_indexes`) en lugar de crear
+        # aquí una vista por producto; los cambios de mientras se aplican al terminar
+        self.indexes_ready = self.snapshot is None
+        self.pending_changes = set()
+        self.index_task = None
+        
+        # Pool de procesos para renderizar el catálogo (compartido entre tiendas) y caché del listado de /productos
+        self.workers = get_worker_pool(metrics=self.metrics)
+        self.catalog_listing = None
+        self.catalog_groups = None
+        self.listing_task = None
+        
+        # Índice vectorizado de productos similares para /similares y los candidatos del prompt
+        self.recommender = RecommendationIndex()
+        if self.indexes_ready:
+            self.recommender.build(self.products.values())
+        
+        # Control de admisión y respuestas locales para cuando OpenAI está saturado
+        self.admission = AdmissionController(metrics=self.metrics, tenant=self.tenant)
+        self.responder = TemplateResponder()
+        self.responder.update(self.store_info, self.products.values() if self.indexes_ready else ())
+        
+        # Modelo, max_tokens e historial de cada solicitud según el tipo de consulta y la presión actual
+        self.router = ModelRouter(quota=self.quota, admission=self.admission, metrics=self.metrics, tenant=self.tenant)
+        
+        # Actualizaciones repetidas (reintentos de Telegram) y mensajes enviados dos veces
+        self.dedupe = UpdateDeduplicator(
+            store=MongoUpdateStore(self.db.processed_updates) if DEDUPE_SHARED_STORE else None,
+            metrics=self.metrics, tenant=self.tenant
+        )
+        
+        # Versiones del contexto del sistema: las conversaciones lo referencian en lugar de copiarlo
+        self.contexts = ContextRegistry(metrics=self.metrics, tenant=self.tenant)
+        
+        # Fichas de producto pregeneradas para los botones de /productos (textos redactados guardados en MongoDB)
+        self.cards = ProductCards(self.db.product_cards, store_name=self.store_info.get('name'),
+                                  metrics=self.metrics, tenant=self.tenant)
+        
+        # Búsqueda inline (@bot texto) sobre un trie de prefijos en memoria
+        self.search = InlineSearch(self.cards, metrics=self.metrics, tenant=self.tenant)
+        if self.indexes_ready:
+            self.search.build(self.products.values())
+        
+        # Respuestas a primeras preguntas compartidas entre usuarios y calentamiento de cachés al arrancar
+        # (preguntas frecuentes y productos más consultados según las trazas grabadas)
+        self.responses = ResponseCache(metrics=self.metrics, tenant=self.tenant)
+        warmup_manifest = warmup_manifest or WARMUP_MANIFEST
+        self.warmup = CacheWarmup(
+            warmup_manifest.format(tenant=self.tenant) if warmup_manifest else None,
+            self.warm_question, self.warm_products, admission=self.admission,
+            metrics=self.metrics, tenant=self.tenant
+        )
+        
+        # Índice de ofertas por vencimiento: las ofertas se activan y desactivan solas
+        self.offer_index = OfferIndex()
+        self.offer_scheduler = OfferScheduler(self.offer_index, self.on_products_changed, self.db.products,
+                                              on_flush=self.on_products_written)
+        offer_candidates = self.snapshot.offer_products() if self.snapshot is not None else self.products.values()
+        self.offer_scheduler.apply(self.offer_index.load(offer_candidates))
         
         # Crear un contexto del sistema para enviar a GPT
-        self.system_context = self.create_system_context()
+        self.contexts.publish(self.create_system_context())
+        if self.indexes_ready:
+            self.cards.refresh(self.products.values(), self.contexts.latest, self.recommender)
         
         logger.info(f"📝 Inicializando StoreBot a las {self.start_time.strftime('%Y-%m-%d %H:%M:%S')}")
         logger.info(f"🏪 Información de tienda cargada: {self.store_info.get('name', 'Desconocido')}")
         logger.info(f"📦 Categorías cargadas: {len(self.categories)}")
     
+    def open_snapshot(self, file_path):
+        """Abrir el snapshot binario del catálogo con mmap, o None si no está configurado"""
+        if not file_path:
+            return None
+        try:
+            return CatalogSnapshot(file_path)
+        except Exception as e:
+            logger.error(f"❌ Error al abrir el snapshot del catálogo, se usará MongoDB: {str(e)}")
+            return None
+    
     def load_store_info(self):
         """Cargar información de la tienda desde MongoDB"""
         try:
-            store_info = self.db.storeInfo.find_one()
+            store_info = self.repository.store_info()
             if not store_info:
                 logger.warning("⚠️ No se encontró información de la tienda en MongoDB")
                 return {"name": "Tienda Demo"}
             
-            # Eliminar el _id de MongoDB para mantener compatibilidad con el formato anterior
-            if '_id' in store_info:
-                del store_info['_id']
-                
             logger.info(f"✅ Información de tienda cargada desde MongoDB")
             return store_info
         except Exception as e:
@@ -84,10 +219,9 @@ class StoreBot:
             return {"name": "Tienda Demo"}
     
     def load_categories(self):
-        """Cargar categorías desde MongoDB"""
+        """Cargar categorías desde MongoDB (de los resúmenes, que siguen a los productos reales)"""
         try:
-            categories_cursor = self.db.categories.find()
-            categories = [category['name'] for category in categories_cursor]
+            categories = self.summaries.categories() or self.repository.categories()
             logger.info(f"✅ Categorías cargadas desde MongoDB: {len(categories)}")
             return categories
         except Exception as e:
@@ -97,14 +231,7 @@ class StoreBot:
     def load_products(self):
         """Cargar todos los productos desde MongoDB"""
         try:
-            products_cursor = self.db.products.find()
-            products = list(products_cursor)
-            
-            # Eliminar el _id de MongoDB para mantener compatibilidad
-            for product in products:
-                if '_id' in product:
-                    del product['_id']
-            
+            products = self.repository.products()
             logger.info(f"✅ Productos cargados desde MongoDB: {len(products)}")
             return products
         except Exception as e:
@@ -113,66 +240,101 @@ class StoreBot:
     
     def create_system_context(self):
         """Crear un contexto del sistema para entrenar al modelo GPT"""
-        store_name = self.store_info.get('name', 'Nuestra Tienda')
-        store_desc = self.store_info.get('description', '')
-        
-        # Cargar productos solo cuando sea necesario para el contexto
-        products = self.load_products()
-        
-        # Crear una representación de los productos para el contexto
-        products_info = []
-        for product in products:
-            product_info = (
-                f"ID: {product.get('id', 'N/A')}, "
-                f"Nombre: {product.get('name', 'N/A')}, "
-                f"Categoría: {product.get('category', 'N/A')}, "
-                f"Precio: ${product.get('price', 0):.2f}, "
-                f"Descripción: {product.get('description', 'N/A')}, "
-                f"Stock: {product.get('stock', 0)} unidades, "
-                f"Disponible: {'Sí' if product.get('disponible', False) else 'No'}"
-            )
-            
-            # Añadir información de ofertas si existe
-            ofertas = product.get('ofertas', {})
-            if ofertas.get('activa', False):
-                product_info += (
-                    f", OFERTA: {ofertas.get('descuento', '')} de descuento, "
-                    f"Precio de oferta: ${ofertas.get('precio_oferta', 0):.2f}, "
-                    f"Válido hasta: {ofertas.get('fecha_fin', 'N/A')}"
-                )
-            
-            products_info.append(product_info)
-        
-        # Crear el mensaje del sistema
-        system_message = f"""
-Eres un asistente virtual para la tienda {store_name}. 
-{store_desc}
-
-INFORMACIÓN DE LA TIENDA:
-- Nombre: {self.store_info.get('name', 'N/A')}
-- Horario: {self.store_info.get('horario', 'N/A')}
-- Dirección: {self.store_info.get('direccion', 'N/A')}
-- Teléfono: {self.store_info.get('telefono', 'N/A')}
-- Email: {self.store_info.get('email', 'N/A')}
-- Política de envíos: {self.store_info.get('politica_envios', 'N/A')}
-- Política de devoluciones: {self.store_info.get('politica_devoluciones', 'N/A')}
-
-CATÁLOGO DE PRODUCTOS:
-{chr(10).join(products_info)}
-
-INSTRUCCIONES:
-1. Debes actuar siempre como un representante amable y profesional de {store_name}.
-2. Proporciona información precisa sobre los productos, precios y disponibilidad.
-3. Si un producto está en oferta, asegúrate de mencionarlo y destacar el descuento.
-4. Si un cliente pregunta por un producto que no está en el catálogo, indícale amablemente que no está disponible pero sugiere alternativas similares.
-5. Para compras, indica al cliente que puede realizar el pedido en nuestra tienda física, a través de nuestra web o en este mismo chat.
-6. Cuando el cliente pregunte por el proceso de compra, explícale que puede pagar con tarjeta de crédito, PayPal o transferencia bancaria.
-7. Mantén un tono conversacional, amable y cercano en todo momento.
-8. Si te preguntan sobre un tema que no está relacionado con la tienda o los productos, redirígelos amablemente de vuelta a temas relacionados con nuestra tienda.
-"""
+        snapshot_lines = self.snapshot.context_lines() if self.snapshot is not None else None
+        if snapshot_lines is not None:
+            # El snapshot trae las líneas ya renderizadas: solo se formatean los productos modificados desde entonces
+            missing = [self.snapshot.product(row) for product_id, row in self.snapshot_changes.items()
+                       if product_id not in self.product_lines]
+            if missing:
+                self.product_lines.update(self.workers.run_sync(CONTEXT, missing))
+            for product_id, row in self.snapshot_changes.items():
+                snapshot_lines[row] = self.product_lines[product_id]
+            products_info = snapshot_lines
+        else:
+            # Formatear solo los productos que aún no tienen su línea en caché (en el pool si son muchos)
+            missing = [product for product_id, product in self.products.items() if product_id not in self.product_lines]
+            if missing:
+                self.product_lines.update(self.workers.run_sync(CONTEXT, missing))
+            products_info = ordered_lines(self.product_lines)
+        
+        system_message = build_system_context(self.store_info, products_info)
         logger.info("✅ Contexto del sistema creado para GPT")
         return system_message
+
+    def on_products_changed(self, product_ids):
+        """Actualizar de forma incremental las cachés y el contexto tras cambiar productos"""
+        for product_id in product_ids:
+            self.product_lines.pop(product_id, None)
+        if self.snapshot is not None:
+            for product_id in product_ids:
+                row = self.snapshot.row_of(product_id)
+                if row is not None:
+                    self.snapshot_changes[product_id] = row
+        # El listado en construcción ya no corresponde al catálogo actual
+        self.catalog_listing = None
+        self.catalog_groups = None
+        self.listing_task = None
+        self.workers.cancel(self.tenant)
+        self.contexts.publish(self.create_system_context())
+        if not self.indexes_ready:
+            # Los índices del snapshot aún se están construyendo: se ponen al día al terminar
+            self.pending_changes.update(product_ids)
+            return
+        self.update_indexes(product_ids)
+    
+    def update_indexes(self, product_ids):
+        """Aplicar a los índices derivados del catálogo los cambios de `product_ids`"""
+        self.responder.update(self.store_info, self.products.values())
+        changed = [self.products[product_id] for product_id in product_ids if product_id in self.products]
+        self.recommender.upsert(changed)
+        self.search.remove([product_id for product_id in product_ids if product_id not in self.products])
+        self.search.upsert(changed)
+        self.cards.refresh(self.products.values(), self.contexts.latest, self.recommender, changed=product_ids)
         
+    def build_catalog_indexes(self):
+        """Índices de recomendaciones, respuestas locales y búsqueda inline del catálogo (en un hilo)"""
+        products = list(self.products.values())
+        recommender = RecommendationIndex()
+        recommender.build(products)
+        responder = TemplateResponder()
+        responder.update(self.store_info, products)
+        search_index = InlineSearchIndex(self.search.index.limit, self.search.index.max_prefix)
+        search_index.build(products)
+        return recommender, responder, search_index
+    
+    async def load_catalog_indexes(self):
+        """Construir los índices del snapshot sin bloquear el bucle y activarlos junto con las fichas"""
+        start = time.perf_counter()
+        try:
+            recommender, responder, search_index = await asyncio.to_thread(self.build_catalog_indexes)
+        except Exception as e:
+            logger.error(f"❌ Error al construir los índices del catálogo: {str(e)}")
+            return
+        self.recommender = recommender
+        self.responder = responder
+        self.search.index = search_index
+        self.indexes_ready = True
+        # Ofertas activadas o desactivadas mientras se construían los índices
+        changed = [self.products[product_id] for product_id in self.pending_changes if product_id in self.products]
+        self.pending_changes = set()
+        self.recommender.upsert(changed)
+        self.search.upsert(changed)
+        self.cards.refresh(self.products.values(), self.contexts.latest, self.recommender)
+        logger.info(f"🗂️ Índices del catálogo construidos en segundo plano en {time.perf_counter() - start:.2f} s "
+                    f"({len(self.products)} productos)")
+    
+    def on_products_written(self, product_ids):
+        """Actualizar los resúmenes de las categorías de los productos escritos en MongoDB (en el hilo de escritura)"""
+        self.summaries.refresh(
+            self.products[product_id].get('category') for product_id in product_ids if product_id in self.products
+        )
+
+    async def reply(self, update: Update, text, **kwargs):
+        """Responder a través de la cola de salida (o directamente si aún no está en marcha)"""
+        if not self.outbound.running:
+            return await update.effective_message.reply_text(text, **kwargs)
+        return await self.outbound.send(update.effective_chat.id, text, priority=INTERACTIVE, **kwargs)
+
     async def start_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /start"""
         user = update.message.from_user
@@ -187,7 +349,7 @@ INSTRUCCIONES:
             f"¿En qué puedo ayudarte hoy?\n\n"
             f"Usa /productos para ver un listado de nuestros productos o /ayuda para más información."
         )
-        await update.message.reply_text(welcome_message)
+        await self.reply(update, welcome_message)
 
     async def help_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /help o /ayuda"""
@@ -198,95 +360,182 @@ INSTRUCCIONES:
             "📚 Comandos disponibles:\n"
             "/start - Iniciar el asistente\n"
             "/ayuda - Mostrar esta ayuda\n"
-            "/productos - Ver listado de productos\n"
+            "/productos [categoría | todo] - Ver el catálogo por categorías\n"
             "/ofertas - Ver productos en oferta\n"
+            "/similares <producto> [precio máximo] - Ver alternativas similares en stock\n"
             "/info - Información de la tienda\n"
             "/reset - Reiniciar la conversación\n\n"
             "También puedes preguntarme directamente sobre productos específicos, precios o cualquier duda que tengas 😊"
         )
-        await update.message.reply_text(help_message)
+        await self.reply(update, help_message)
 
     async def products_command(self, update: Update, context: CallbackContext):
-        """Manejador del comando /productos"""
+        """Manejador del comando /productos [categoría | todo]"""
         user = update.message.from_user
-        logger.info(f"📦 Usuario {user.first_name} (ID: {user.id}) solicitó listado de productos")
-        
-        # Obtener productos desde MongoDB
-        products = self.load_products()
+        text = " ".join(context.args or []).strip()
+        logger.info(f"📦 Usuario {user.first_name} (ID: {user.id}) solicitó listado de productos {text}")
         
-        if not products:
-            await update.message.reply_text("Lo siento, no hay productos disponibles en este momento.")
+        if not self.products:
+            await self.reply(update, "Lo siento, no hay productos disponibles en este momento.")
             return
         
-        categories = {}
-        for product in products:
-            category = product.get('category', 'Sin categoría')
-            if category not in categories:
-                categories[category] = []
-            
-            price = product.get('price', 0)
-            name = product.get('name', 'Producto sin nombre')
-            
-            # Verificar si hay oferta
-            ofertas = product.get('ofertas', {})
-            if ofertas.get('activa', False):
-                price_text = f"${price:.2f} 🔥 OFERTA: ${ofertas.get('precio_oferta', 0):.2f}"
-            else:
-                price_text = f"${price:.2f}"
-            
-            categories[category].append(f"• {name}: {price_text}")
+        # Vista por categorías: solo lee los resúmenes materializados
+        if text.lower() != 'todo':
+            try:
+                summaries = await asyncio.to_thread(self.summaries.all)
+            except Exception as e:
+                logger.error(f"❌ Error al leer los resúmenes de categorías: {str(e)}")
+                summaries = []
+            if summaries:
+                if text:
+                    summary = find_category(summaries, text)
+                    if summary is not None:
+                        await self.send_category(update, summary['_id'])
+                        return
+                    await self.reply(update, f"No encontré la categoría «{text}». Estas son nuestras categorías:")
+                await self.reply(update, format_overview(summaries), reply_markup=category_keyboard(summaries))
+                return
         
-        # Construir mensaje por categorías
-        message_parts = ["📋 Nuestro catálogo de productos:\n"]
-        
-        for category, items in categories.items():
-            message_parts.append(f"\n📁 {category}:")
-            message_parts.extend(items)
+        await self.reply(update, await self.get_catalog_listing(), reply_markup=self.cards.keyboard())
+
+    async def send_category(self, update: Update, category):
+        """Productos de una categoría, con botones para abrir sus fichas"""
+        groups = await self.get_catalog_groups()
+        await self.reply(update, format_category(category, groups.get(category, [])),
+                         reply_markup=self.cards.keyboard(0, category))
+
+    async def category_callback(self, update: Update, context: CallbackContext):
+        """Manejador de los botones de categoría de /productos"""
+        query = update.callback_query
+        category = (query.data or '')[len(CATEGORY_PREFIX):]
+        await query.answer()
+        logger.info(f"📁 Usuario {query.from_user.first_name} (ID: {query.from_user.id}) abrió la categoría {category}")
+        await self.send_category(update, category)
+
+    async def card_callback(self, update: Update, context: CallbackContext):
+        """Manejador de los botones de /productos: fichas de producto y páginas del listado"""
+        query = update.callback_query
+        data = query.data or ''
         
-        message_parts.append("\n\nPara más detalles sobre un producto específico, pregúntame por su nombre.")
+        if data.startswith(PAGE_PREFIX):
+            await query.answer()
+            try:
+                await query.edit_message_reply_markup(reply_markup=self.cards.keyboard(*self.cards.parse_page(data)))
+            except (ValueError, BadRequest):
+                # Página no válida o la misma que ya se muestra
+                pass
+            return
         
-        await update.message.reply_text("\n".join(message_parts))
+        product_id = data[len(CARD_PREFIX):]
+        card = self.cards.get(product_id)
+        if card is None:
+            await query.answer("Este producto ya no está en el catálogo.", show_alert=True)
+            return
+        await query.answer()
+        logger.info(f"🗂️ Usuario {query.from_user.first_name} (ID: {query.from_user.id}) abrió la ficha del producto {product_id}")
+        await self.reply(update, card, reply_markup=self.cards.card_keyboard(product_id))
+
+    async def get_catalog_listing(self):
+        """Listado completo de /productos, cacheado hasta el próximo cambio"""
+        if self.catalog_listing is None:
+            groups = await self.get_catalog_groups()
+            listing = build_catalog_listing(groups)
+            if groups is not self.catalog_groups:
+                # El catálogo cambió mientras tanto: este listado no se guarda
+                return listing
+            self.catalog_listing = listing
+        return self.catalog_listing
+
+    async def get_catalog_groups(self):
+        """Líneas de /productos por categoría, construidas en el pool de procesos y cacheadas hasta el próximo cambio"""
+        while self.catalog_groups is None:
+            # Las solicitudes simultáneas comparten el mismo trabajo
+            if self.listing_task is None:
+                self.listing_task = asyncio.ensure_future(
+                    self.workers.run(LISTING, list(self.products.values()), key=self.tenant)
+                )
+            task = self.listing_task
+            try:
+                categories = await asyncio.shield(task)
+            except BuildSuperseded:
+                # El catálogo cambió mientras se construía: repetir con la versión nueva
+                continue
+            if task is self.listing_task:
+                self.catalog_groups = categories
+                self.listing_task = None
+            else:
+                return categories
+        return self.catalog_groups
+
+    async def inline_query(self, update: Update, context: CallbackContext):
+        """Manejador de las consultas inline (@bot texto): productos que coinciden mientras se escribe"""
+        query = update.inline_query
+        await query.answer(self.search.answer(query.query), cache_time=self.search.cache_time)
 
     async def offers_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /ofertas"""
         user = update.message.from_user
         logger.info(f"🔥 Usuario {user.first_name} (ID: {user.id}) solicitó ofertas")
         
-        # Buscar productos con ofertas activas directamente en MongoDB
-        try:
-            offers_cursor = self.db.products.find({"ofertas.activa": True})
-            offer_products = list(offers_cursor)
-            offers = []
-            
-            for product in offer_products:
-                # Eliminar _id de MongoDB
-                if '_id' in product:
-                    del product['_id']
-                
-                name = product.get('name', 'Producto sin nombre')
-                original_price = product.get('price', 0)
-                ofertas = product.get('ofertas', {})
-                offer_price = ofertas.get('precio_oferta', 0)
-                discount = ofertas.get('descuento', '')
-                end_date = ofertas.get('fecha_fin', 'Tiempo limitado')
-                
-                offers.append(
-                    f"• {name}\n"
-                    f"  Precio original: ${original_price:.2f}\n"
-                    f"  Precio oferta: ${offer_price:.2f} ({discount} descuento)\n"
-                    f"  Válido hasta: {end_date}"
-                )
-            
-            if offers:
-                message = "🔥 OFERTAS ESPECIALES 🔥\n\n" + "\n\n".join(offers)
-                message += "\n\nPara más detalles o realizar una compra, solo pregúntame."
-            else:
-                message = "Lo siento, actualmente no hay ofertas especiales disponibles. ¡Revisa más tarde!"
+        # Las ofertas vigentes se sirven del índice en memoria, sin consultar MongoDB
+        offers = []
+        for product in self.offer_index.active_products():
+            name = product.get('name', 'Producto sin nombre')
+            original_price = product.get('price', 0)
+            ofertas = product.get('ofertas', {})
+            offer_price = ofertas.get('precio_oferta', 0)
+            discount = ofertas.get('descuento', '')
+            end_date = ofertas.get('fecha_fin', 'Tiempo limitado')
             
-            await update.message.reply_text(message)
-        except Exception as e:
-            logger.error(f"❌ Error al buscar ofertas: {str(e)}")
-            await update.message.reply_text("Lo siento, ocurrió un error al buscar las ofertas disponibles.")
+            offers.append(
+                f"• {name}\n"
+                f"  Precio original: ${original_price:.2f}\n"
+                f"  Precio oferta: ${offer_price:.2f} ({discount} descuento)\n"
+                f"  Válido hasta: {end_date}"
+            )
+        
+        if offers:
+            message = "🔥 OFERTAS ESPECIALES 🔥\n\n" + "\n\n".join(offers)
+            message += "\n\nPara más detalles o realizar una compra, solo pregúntame."
+        else:
+            message = "Lo siento, actualmente no hay ofertas especiales disponibles. ¡Revisa más tarde!"
+        
+        await self.reply(update, message)
+
+    async def similar_command(self, update: Update, context: CallbackContext):
+        """Manejador del comando /similares <producto> [precio máximo]"""
+        user = update.message.from_user
+        args = list(context.args or [])
+        logger.info(f"🧭 Usuario {user.first_name} (ID: {user.id}) solicitó productos similares: {' '.join(args)}")
+        
+        # Un número al final se interpreta como precio máximo
+        max_price = None
+        if len(args) > 1:
+            try:
+                max_price = float(args[-1].lstrip('$').replace(',', '.'))
+                args = args[:-1]
+            except ValueError:
+                pass
+        if not args:
+            await self.reply(update, "Indica un producto, por ejemplo: /similares iPhone 15 Pro 800")
+            return
+        
+        product, candidates = self.recommender.alternatives(' '.join(args), limit=5, max_price=max_price)
+        if product is None and not candidates:
+            await self.reply(update, "No encontré ese producto en el catálogo. Prueba con otro nombre o usa /productos.")
+            return
+        
+        lines = []
+        if product is not None:
+            state = "✅ Disponible" if in_stock(product) else "❌ Sin stock"
+            lines.append(f"📦 {product.get('name', '')}: ${effective_price(product):.2f} ({state})\n")
+        if candidates:
+            limit_text = f" por menos de ${max_price:.2f}" if max_price is not None else ""
+            lines.append(f"🧭 Alternativas similares en stock{limit_text}:")
+            lines.extend(f"• {candidate.get('name', '')}: ${effective_price(candidate):.2f}" for candidate, _ in candidates)
+        else:
+            lines.append("No hay alternativas similares en stock con esas condiciones.")
+        await self.reply(update, "\n".join(lines))
 
     async def store_info_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /info"""
@@ -304,7 +553,7 @@ INSTRUCCIONES:
             f"🔄 Devoluciones: {self.store_info.get('politica_devoluciones', 'No disponible')}"
         )
         
-        await update.message.reply_text(info_message)
+        await self.reply(update, info_message)
 
     async def reset_command(self, update: Update, context: CallbackContext):
         """Manejador del comando /reset"""
@@ -313,91 +562,292 @@ INSTRUCCIONES:
         
         if user_id in self.conversations:
             msg_count = len(self.conversations[user_id])
-            del self.conversations[user_id]
+            self.contexts.release_conversation(self.conversations.pop(user_id))
             logger.info(f"🔄 Usuario {user.first_name} (ID: {user_id}) reinició su conversación ({msg_count} mensajes borrados)")
-            await update.message.reply_text("🔄 Conversación reiniciada correctamente. ¿En qué puedo ayudarte ahora?")
+            await self.reply(update, "🔄 Conversación reiniciada correctamente. ¿En qué puedo ayudarte ahora?")
         else:
             logger.info(f"🔄 Usuario {user.first_name} (ID: {user_id}) intentó reiniciar, pero no tiene una conversación activa")
-            await update.message.reply_text("🔄 No hay una conversación activa para reiniciar. ¿En qué puedo ayudarte?")
+            await self.reply(update, "🔄 No hay una conversación activa para reiniciar. ¿En qué puedo ayudarte?")
+
+    async def broadcast_command(self, update: Update, context: CallbackContext):
+        """Manejador del comando /difundir (solo administradores)"""
+        user = update.message.from_user
+        if user.id not in ADMIN_IDS:
+            logger.warning(f"🚫 Usuario {user.first_name} (ID: {user.id}) intentó usar /difundir sin permiso")
+            await self.reply(update, "🚫 Este comando solo está disponible para administradores.")
+            return
+        
+        text = " ".join(context.args).strip()
+        if not text:
+            await self.reply(update, "Uso: /difundir <mensaje para todos los clientes>")
+            return
+        if self.broadcast_task is not None and not self.broadcast_task.done():
+            await self.reply(update, "⏳ Ya hay una difusión en curso.")
+            return
+        
+        logger.info(f"📣 Usuario {user.first_name} (ID: {user.id}) inició una difusión")
+        # Guardar antes los clientes pendientes para que también la reciban
+        await asyncio.to_thread(self.customers.flush)
+        await self.reply(update, "📣 Difusión iniciada. Te avisaré cuando termine.")
+        
+        async def run_broadcast():
+            try:
+                report = await broadcast(self.outbound, self.customers, text)
+                self.metrics.set('broadcast_rate', report.rate, tenant=self.tenant)
+                await self.reply(update, report.summary())
+            except Exception as e:
+                logger.error(f"❌ Error durante la difusión: {str(e)}")
+                await self.reply(update, "❌ La difusión se interrumpió por un error.")
+        
+        self.broadcast_task = asyncio.get_running_loop().create_task(run_broadcast())
 
     async def handle_message(self, update: Update, context: CallbackContext):
         """Manejador principal de mensajes"""
         user = update.message.from_user
+        
+        # El mismo texto repetido mientras su respuesta está en camino no vuelve a llegar a OpenAI
+        key = self.dedupe.content_key(user.id, update.message.text)
+        if self.dedupe.begin(key) == INFLIGHT:
+            logger.info(f"♻️ Mensaje repetido de {user.first_name} (ID: {user.id}) descartado: la respuesta ya está en camino")
+            return
+        
+        try:
+            async with self.user_turn(user.id):
+                await self.answer_message(update, context)
+        finally:
+            self.dedupe.finish(key)
+
+    @contextlib.asynccontextmanager
+    async def user_turn(self, user_id):
+        """
+        Atender de uno en uno los mensajes de un mismo usuario: con
+        `CONCURRENT_UPDATES` > 1 dos mensajes suyos podrían modificar su
+        historial a la vez. Los demás usuarios no esperan.
+        """
+        turn = self.user_turns.get(user_id)
+        if turn is None:
+            turn = self.user_turns[user_id] = [asyncio.Lock(), 0]
+        turn[1] += 1
+        try:
+            async with turn[0]:
+                yield
+        finally:
+            turn[1] -= 1
+            if turn[1] == 0:
+                del self.user_turns[user_id]
+
+    async def answer_message(self, update: Update, context: CallbackContext):
+        """Responder a un mensaje con GPT; devuelve la respuesta del modelo, o None si no se consultó"""
+        user = update.message.from_user
         user_id = user.id
         user_message = update.message.text
         
         # Log del mensaje recibido
         logger.info(f"💬 Mensaje recibido de {user.first_name} (ID: {user_id}): '{user_message[:30]}...' si es largo")
 
+        # Registrar el chat como destinatario de futuras difusiones
+        self.customers.touch(update.effective_chat.id)
+
+        # Comprobar la cuota antes de encolar la solicitud a OpenAI
+        try:
+            self.quota.check(user_id)
+        except QuotaExceeded as e:
+            logger.warning(f"🚫 Usuario {user.first_name} (ID: {user_id}) superó su cuota ({e.reason})")
+            self.metrics.inc('storebot_quota_rejections_total', tenant=self.tenant, reason=e.reason)
+            if e.reason == 'rate_limit':
+                quota_message = f"⏳ Estás enviando mensajes muy rápido. Intenta de nuevo en {e.retry_after} segundos."
+            else:
+                quota_message = "⏳ Has alcanzado tu límite diario de consultas. Vuelve mañana o usa /productos, /ofertas e /info."
+            await self.reply(update, quota_message)
+            return
+
+        # La primera pregunta de una conversación se responde desde la caché si ya se hizo sobre este catálogo
+        new_conversation = user_id not in self.conversations
+        version = self.contexts.latest
+        if new_conversation:
+            cached = self.responses.get(version, user_message)
+            if cached is not None:
+                logger.info(f"⚡ Respuesta en caché para usuario {user.first_name} (ID: {user_id})")
+                self.conversations[user_id] = [self.contexts.start_conversation(),
+                                               {"role": "user", "content": user_message},
+                                               {"role": "assistant", "content": cached}]
+                await self.reply(update, cached)
+                return cached
+
+        # Bajo sobrecarga, las preguntas con respuesta local no se envían a OpenAI
+        fallback = None
+        if self.admission.under_pressure():
+            fallback = self.responder.answer(user_message, self.offer_index.active_products())
+        if not self.admission.try_admit(low_priority=fallback is not None):
+            logger.warning(f"🚦 Mensaje de {user.first_name} (ID: {user_id}) atendido en modo {self.admission.mode}")
+            await self.reply(update, self.degraded_reply(fallback))
+            return
+
         # Inicializar o recuperar el historial de conversación
         if user_id not in self.conversations:
             # Si es una nueva conversación, añadir el contexto del sistema
-            self.conversations[user_id] = [
-                {"role": "system", "content": self.system_context}
-            ]
+            self.conversations[user_id] = [self.contexts.start_conversation()]
             logger.info(f"👤 Nueva conversación iniciada con usuario {user.first_name} (ID: {user_id})")
 
         # Añadir el mensaje del usuario al historial
-        self.conversations[user_id].append({
+        conversation = self.conversations[user_id]
+        question = {
             "role": "user",
             "content": user_message
-        })
+        }
+        conversation.append(question)
 
+        # El cupo de admisión se libera una sola vez, en el `finally` final, pase lo que pase con la solicitud
+        start_time = time.time()
+        upstream_latency = None
+        # "Escribiendo..." en segundo plano: la solicitud a OpenAI sale sin esperar a Telegram
+        timer = StageTimer()
+        typing = TypingIndicator(context.bot, update.effective_chat.id, timer=timer).start()
         try:
-            # Indicar que el bot está escribiendo
-            await context.bot.send_chat_action(
-                chat_id=update.effective_chat.id, 
-                action="typing"
-            )
-            
-            start_time = time.time()
+            self.metrics.inc('storebot_messages_total', tenant=self.tenant)
             logger.info(f"🤖 Solicitando respuesta a GPT-3.5 para usuario {user.first_name} (ID: {user_id})")
 
-            # Obtener respuesta de GPT-3.5
-            response = await self.get_gpt_response(self.conversations[user_id])
+            # Candidatos del catálogo para esta consulta (solo para esta solicitud, no se guardan en el historial)
+            # y parámetros de la solicitud según el tipo de consulta
+            with timer.stage('context'):
+                messages, route = self.build_request(user_message, conversation, user_id)
             
-            end_time = time.time()
-            response_time = end_time - start_time
+            # Obtener respuesta de GPT-3.5 (con límite de espera)
+            try:
+                response = await timer.run('model', asyncio.wait_for(
+                    self.get_gpt_response(messages, user_id, route),
+                    timeout=UPSTREAM_TIMEOUT
+                ))
+            except asyncio.TimeoutError:
+                logger.warning(f"⏱️ OpenAI no respondió en {UPSTREAM_TIMEOUT:.0f} segundos para usuario {user.first_name} (ID: {user_id})")
+                # Se quita esta pregunta (y no otra) del historial en el que se añadió
+                if conversation and conversation[-1] is question:
+                    conversation.pop()
+                await typing.stop()
+                await self.reply(update, self.degraded_reply(
+                    self.responder.answer(user_message, self.offer_index.active_products())
+                ))
+                return
+            finally:
+                # La latencia observada (incluidos errores y esperas agotadas) alimenta el control de admisión
+                upstream_latency = time.time() - start_time
+            
+            response_time = upstream_latency
+            self.metrics.observe('storebot_gpt_latency_seconds', response_time, tenant=self.tenant)
             
             # Log de estadísticas de la respuesta
             logger.info(f"✅ Respuesta generada en {response_time:.2f} segundos para usuario {user.first_name} (ID: {user_id})")
             logger.info(f"📏 Longitud de la respuesta: {len(response)} caracteres")
 
             # Añadir la respuesta al historial
-            self.conversations[user_id].append({
+            conversation.append({
                 "role": "assistant",
                 "content": response
             })
+            # Las respuestas recortadas bajo presión no se reutilizan
+            if new_conversation and not route.pressure:
+                self.responses.set(version, user_message, response, LIVE)
 
-            # Enviar la respuesta
-            await update.message.reply_text(response)
+            # Enviar la respuesta y, a la vez, persistir el uso de tokens por lotes sin bloquear el bucle de eventos
+            await typing.stop()
+            await asyncio.gather(
+                timer.run('reply', self.reply(update, response)),
+                timer.run('persist', self.persist_usage(), background=True),
+            )
+            timer.observe(self.metrics, tenant=self.tenant)
+            logger.info(f"⏱️ Etapas del mensaje de {user.first_name} (ID: {user_id}): {timer.summary()}")
+            return response
 
         except Exception as e:
+            await typing.stop()
             logger.error(f"❌ Error procesando mensaje del usuario {user.first_name} (ID: {user_id}): {str(e)}")
             error_message = (
                 "❌ Lo siento, ocurrió un error al procesar tu mensaje.\n"
                 "Por favor, intenta nuevamente o usa /reset para reiniciar la conversación."
             )
-            await update.message.reply_text(error_message)
+            await self.reply(update, error_message)
+
+        finally:
+            # Si la solicitud falló antes de llegar a OpenAI no hay latencia que observar
+            self.admission.release(upstream_latency if upstream_latency is not None else 0)
+
+    def build_request(self, user_message, conversation, user_id=None):
+        """Mensajes y ruta de una solicitud a OpenAI: historial recortado y candidatos del catálogo para la consulta"""
+        product, alternatives = self.recommender.alternatives(user_message, limit=3)
+        candidates = format_candidates(product, alternatives)
+        route = self.router.route(user_message, user_id, mentions_product=product is not None)
+        messages = self.contexts.render(trim_history(conversation, route.history))
+        if candidates:
+            messages = messages + [{"role": "system", "content": candidates}]
+        return messages, route
+
+    async def warm_question(self, question):
+        """Precargar la respuesta a una pregunta frecuente como primera pregunta de una conversación"""
+        version = self.contexts.latest
+        if self.responses.contains(version, question) or not self.admission.try_admit(low_priority=True):
+            return False
+        conversation = [self.contexts.start_conversation(), {"role": "user", "content": question}]
+        start_time = time.time()
+        try:
+            messages, route = self.build_request(question, conversation)
+            response = await asyncio.wait_for(self.get_gpt_response(messages, route=route), timeout=UPSTREAM_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precargar la respuesta a '{question[:30]}': {str(e)}")
+            return False
+        finally:
+            self.admission.release(time.time() - start_time)
+            self.contexts.release_conversation(conversation)
+        if route.pressure:
+            return False
+        self.responses.set(version, question, response, WARMUP)
+        return True
+
+    async def warm_products(self, product_ids):
+        """Precargar el listado de /productos y las fichas de los productos más consultados"""
+        await self.get_catalog_listing()
+        return await self.cards.warm(product_ids)
+
+    async def persist_usage(self):
+        """Guardar por lotes el uso de tokens y los clientes nuevos cuando toca"""
+        if self.quota.should_flush():
+            await asyncio.to_thread(self.quota.flush)
+        if self.customers.should_flush():
+            await asyncio.to_thread(self.customers.flush)
+
+    def degraded_reply(self, fallback):
+        """Respuesta rápida cuando no se puede consultar a OpenAI"""
+        if fallback is None:
+            return HIGH_DEMAND_MESSAGE
+        return "⚡ Tenemos mucha demanda en este momento, así que te respondo rápido:\n\n" + fallback
 
-    async def get_gpt_response(self, conversation_history):
-        """Obtener respuesta de GPT-3.5"""
+    async def get_gpt_response(self, conversation_history, user_id=None, route=None):
+        """Obtener respuesta de GPT-3.5 (con los parámetros de la ruta elegida) y registrar el uso de tokens"""
+        if route is None:
+            route = self.router.route(conversation_history[-1].get('content', ''), user_id)
         try:
-            logger.info(f"🔄 Enviando solicitud a OpenAI con {len(conversation_history)} mensajes en el historial")
+            logger.info(f"🔄 Enviando solicitud a OpenAI con {len(conversation_history)} mensajes en el historial "
+                        f"(ruta {route.name}: {route.model}, max_tokens={route.max_tokens}"
+                        f"{', bajo presión' if route.pressure else ''})")
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
+            start_time = time.time()
+            response = await get_openai_client().chat.completions.create(
+                model=route.model,
                 messages=conversation_history,
-                max_tokens=1000,
-                temperature=0.7
+                max_tokens=route.max_tokens,
+                temperature=route.temperature
             )
             
-            logger.info(f"✅ Respuesta recibida de OpenAI exitosamente")
+            usage = extract_usage(response)
+            self.router.observe(route, time.time() - start_time, usage)
+            if user_id is not None:
+                self.quota.record(user_id, usage)
+            self.metrics.inc('storebot_tokens_total', usage.get('total_tokens', 0) or 0, tenant=self.tenant)
+            logger.info(f"✅ Respuesta recibida de OpenAI exitosamente ({usage.get('total_tokens', 0)} tokens)")
             return response.choices[0].message.content
-        except openai.error.RateLimitError:
+        except openai.RateLimitError:
             logger.error("⚠️ Error de límite de tasa (Rate Limit) en OpenAI API")
             raise Exception("Se ha alcanzado el límite de solicitudes a OpenAI. Por favor, intenta más tarde.")
-        except openai.error.AuthenticationError:
+        except openai.AuthenticationError:
             logger.error("🔑 Error de autenticación en OpenAI API")
             raise Exception("Error de autenticación con OpenAI. Verifica tu API key.")
         except Exception as e:
@@ -408,25 +858,81 @@ INSTRUCCIONES:
         """Manejador global de errores"""
         logger.error(f"⚠️ Error en la actualización {update}: {context.error}")
 
-    def run(self):
-        """Iniciar el bot"""
-        logger.info("🤖 Iniciando el bot de tienda con Telegram...")
-        
-        # Crear la aplicación
-        app = Application.builder().token(TELEGRAM_TOKEN).build()
+    def build_application(self):
+        """Crear la aplicación de Telegram con todos los handlers registrados"""
+        app = (
+            Application.builder()
+            .token(self.telegram_token)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
 
         # Añadir handlers
-        app.add_handler(CommandHandler("start", self.start_command))
-        app.add_handler(CommandHandler("ayuda", self.help_command))
-        app.add_handler(CommandHandler("help", self.help_command))
-        app.add_handler(CommandHandler("productos", self.products_command))
-        app.add_handler(CommandHandler("ofertas", self.offers_command))
-        app.add_handler(CommandHandler("info", self.store_info_command))
-        app.add_handler(CommandHandler("reset", self.reset_command))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        app.add_handler(CommandHandler("start", self.traced(self.start_command)))
+        app.add_handler(CommandHandler("ayuda", self.traced(self.help_command)))
+        app.add_handler(CommandHandler("help", self.traced(self.help_command)))
+        app.add_handler(CommandHandler("productos", self.traced(self.products_command)))
+        app.add_handler(CommandHandler("ofertas", self.traced(self.offers_command)))
+        app.add_handler(CommandHandler("similares", self.traced(self.similar_command)))
+        app.add_handler(CommandHandler("info", self.traced(self.store_info_command)))
+        app.add_handler(CommandHandler("reset", self.traced(self.reset_command)))
+        app.add_handler(CommandHandler("difundir", self.traced(self.broadcast_command)))
+        app.add_handler(CallbackQueryHandler(self.traced(self.card_callback), pattern=f"^({CARD_PREFIX}|{PAGE_PREFIX})"))
+        app.add_handler(CallbackQueryHandler(self.traced(self.category_callback), pattern=f"^{CATEGORY_PREFIX}"))
+        app.add_handler(InlineQueryHandler(self.traced(self.inline_query)))
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.traced(self.handle_message, model_call=True)))
         
         # Añadir manejador de errores
         app.add_error_handler(self.error_handler)
+        return app
+
+    def traced(self, callback, model_call=False):
+        """Handler envuelto para descartar actualizaciones repetidas y grabar la traza, si la grabación está activada"""
+        handler = callback.__name__
+        callback = self.dedupe.wrap(callback, model_call)
+        if self.recorder is None:
+            return callback
+        return self.recorder.wrap(handler, callback)
+
+    async def post_init(self, app):
+        """Arrancar las tareas en segundo plano una vez creado el bucle de eventos"""
+        acquire_openai_client()
+        self.offer_scheduler.start()
+        self.outbound.start(app.bot)
+        self.workers.start()
+        self.cards.start()
+        if not self.indexes_ready:
+            self.index_task = asyncio.create_task(self.load_catalog_indexes())
+        self.warmup.start()
+
+    async def post_shutdown(self, app):
+        """Detener las tareas en segundo plano y persistir el estado pendiente"""
+        await self.warmup.stop()
+        if self.index_task is not None:
+            self.index_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.index_task
+        await self.offer_scheduler.stop()
+        await self.outbound.stop()
+        await self.cards.stop()
+        self.workers.cancel(self.tenant)
+        await release_openai_client()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.warmup.manifest_path:
+            logger.info(f"🌡️ Aciertos de caché del calentamiento: {self.responses.hits[WARMUP]} respuestas "
+                        f"y {self.cards.warm_hits} fichas")
+        self.quota.flush()
+        self.customers.flush()
+
+    def run(self):
+        """Iniciar el bot"""
+        logger.info("🤖 Iniciando el bot de tienda con Telegram...")
+        
+        # Crear la aplicación
+        app = self.build_application()
 
         # Iniciar el bot
         logger.info(f"✅ Bot de tienda {self.store_info.get('name', '')} configurado y listo para funcionar")
@@ -435,10 +941,15 @@ INSTRUCCIONES:
         logger.info("👋 Bot detenido")
 
 if __name__ == "__main__":
+    if not TELEGRAM_TOKEN:
+        logger.error("⚠️ TELEGRAM_TOKEN no encontrado en el archivo .env")
+        exit(1)
+
     print("=" * 50)
     print(f"🤖 INICIANDO BOT DE TIENDA CON GPT-3.5 Y MONGODB")
     print("=" * 50)
     bot = StoreBot()
+    start_metrics_server(bot.metrics)
     try:
         bot.run()
     except KeyboardInterrupt:
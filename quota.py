@@ -0,0 +1,236 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from collections import defaultdict
+
+from dedupe import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Límites configurables desde el archivo .env
+USER_RATE_LIMIT = int(os.getenv('USER_RATE_LIMIT', '20'))
+USER_RATE_WINDOW = int(os.getenv('USER_RATE_WINDOW', '60'))
+# Máximo de usuarios con ventana de tasa en memoria (se descartan primero los inactivos desde hace más tiempo)
+USER_RATE_MAX_USERS = int(os.getenv('USER_RATE_MAX_USERS', '100000'))
+USER_DAILY_TOKENS = int(os.getenv('USER_DAILY_TOKENS', '50000'))
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '30'))
+USAGE_FLUSH_BATCH = int(os.getenv('USAGE_FLUSH_BATCH', '100'))
+
+
+class SlidingWindowCounter:
+    """
+    Contador de ventana deslizante aproximada.
+
+    Guarda solo el conteo de la ventana actual y de la anterior, y pondera la
+    anterior según cuánto se solapa con la ventana deslizante. Usa memoria
+    constante por usuario, a diferencia de guardar cada marca de tiempo.
+    """
+
+    __slots__ = ('window', 'current_start', 'current_count', 'previous_count')
+
+    def __init__(self, window):
+        self.window = window
+        self.current_start = 0.0
+        self.current_count = 0
+        self.previous_count = 0
+
+    def _advance(self, now):
+        start = now - (now % self.window)
+        if start == self.current_start:
+            return
+        if start - self.current_start == self.window:
+            self.previous_count = self.current_count
+        else:
+            self.previous_count = 0
+        self.current_start = start
+        self.current_count = 0
+
+    def count(self, now=None):
+        """Estimar el número de eventos en los últimos `window` segundos"""
+        now = time.time() if now is None else now
+        self._advance(now)
+        elapsed = (now - self.current_start) / self.window
+        return self.previous_count * (1 - elapsed) + self.current_count
+
+    def add(self, now=None, amount=1):
+        """Registrar eventos en la ventana actual"""
+        now = time.time() if now is None else now
+        self._advance(now)
+        self.current_count += amount
+
+
+class QuotaExceeded(Exception):
+    """Se lanza cuando un usuario supera su cuota de solicitudes o tokens"""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenQuotaManager:
+    """
+    Contabilidad de tokens por usuario y global con cuotas configurables.
+
+    Las cuotas se comprueban en memoria antes de llamar al modelo y el uso
+    acumulado se persiste por lotes en la colección `token_usage` de MongoDB
+    (si se proporciona una colección).
+    """
+
+    def __init__(self, collection=None, rate_limit=USER_RATE_LIMIT, rate_window=USER_RATE_WINDOW,
+                 daily_tokens=USER_DAILY_TOKENS, flush_interval=USAGE_FLUSH_INTERVAL,
+                 flush_batch=USAGE_FLUSH_BATCH, max_users=USER_RATE_MAX_USERS):
+        self.collection = collection
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.daily_tokens = daily_tokens
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        self._lock = threading.Lock()
+        # Tras dos ventanas sin actividad el contador de un usuario vuelve a cero: se puede olvidar
+        self._windows = TTLCache(2 * rate_window, max_entries=max_users)
+        self._daily = defaultdict(int)
+        self._day = self._today()
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._pending_count = 0
+        self._last_flush = time.time()
+
+        self.totals = defaultdict(int)
+        self.rejected = 0
+
+        if self.collection is not None:
+            self._load_daily_usage()
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    def _rollover(self):
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._daily.clear()
+
+    def _load_daily_usage(self):
+        """Recuperar el uso del día para que un reinicio no reinicie las cuotas"""
+        try:
+            for doc in self.collection.find({"day": self._day, "user_id": {"$ne": None}},
+                                            {"user_id": 1, "total_tokens": 1}):
+                self._daily[doc['user_id']] = doc.get('total_tokens', 0)
+            logger.info(f"✅ Uso de tokens del día recuperado: {len(self._daily)} usuarios")
+        except Exception as e:
+            logger.error(f"❌ Error al recuperar el uso de tokens: {str(e)}")
+
+    def check(self, user_id, now=None):
+        """
+        Comprobar y reservar una solicitud para el usuario.
+        Lanza QuotaExceeded si se supera la tasa o la cuota diaria.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._rollover()
+            if self.daily_tokens and self._daily[user_id] >= self.daily_tokens:
+                self.rejected += 1
+                raise QuotaExceeded('daily_tokens')
+
+            window = self._windows.get(user_id, now=now)
+            if window is None:
+                window = SlidingWindowCounter(self.rate_window)
+            if self.rate_limit and window.count(now) >= self.rate_limit:
+                self.rejected += 1
+                retry_after = self.rate_window - (now - window.current_start)
+                raise QuotaExceeded('rate_limit', retry_after=max(1, int(retry_after)))
+            window.add(now)
+            self._windows.set(user_id, window, now=now)
+
+    def record(self, user_id, usage):
+        """Registrar el uso devuelto por OpenAI (`prompt_tokens`, `completion_tokens`, `total_tokens`)"""
+        if not usage:
+            return
+        with self._lock:
+            self._rollover()
+            pending = self._pending[user_id]
+            for field in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+                value = int(usage.get(field, 0) or 0)
+                pending[field] += value
+                self.totals[field] += value
+            pending['requests'] += 1
+            self.totals['requests'] += 1
+            self._daily[user_id] += int(usage.get('total_tokens', 0) or 0)
+            self._pending_count += 1
+
+    def should_flush(self):
+        """Indica si hay suficiente uso pendiente o ha pasado el intervalo de volcado"""
+        if self.collection is None or not self._pending_count:
+            return False
+        return (self._pending_count >= self.flush_batch
+                or time.time() - self._last_flush >= self.flush_interval)
+
+    def flush(self):
+        """Persistir en MongoDB el uso pendiente con una sola escritura por lotes"""
+        if self.collection is None:
+            return 0
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: defaultdict(int))
+            self._pending_count = 0
+            self._last_flush = time.time()
+            day = self._day
+        if not pending:
+            return 0
+
+        from pymongo import UpdateOne
+
+        global_inc = defaultdict(int)
+        operations = []
+        for user_id, counters in pending.items():
+            for field, value in counters.items():
+                global_inc[field] += value
+            operations.append(UpdateOne(
+                {"day": day, "user_id": user_id},
+                {"$inc": dict(counters)},
+                upsert=True
+            ))
+        operations.append(UpdateOne(
+            {"day": day, "user_id": None},
+            {"$inc": dict(global_inc)},
+            upsert=True
+        ))
+
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+            logger.info(f"💾 Uso de tokens persistido para {len(pending)} usuarios")
+        except Exception as e:
+            logger.error(f"❌ Error al persistir el uso de tokens: {str(e)}")
+            # Reintegrar el uso pendiente para el próximo volcado
+            with self._lock:
+                for user_id, counters in pending.items():
+                    for field, value in counters.items():
+                        self._pending[user_id][field] += value
+                self._pending_count += len(pending)
+            return 0
+        return len(pending)
+
+    def usage_for(self, user_id):
+        """Tokens consumidos hoy por el usuario"""
+        with self._lock:
+            self._rollover()
+            return self._daily.get(user_id, 0)
+
+
+def extract_usage(response):
+    """Obtener el campo `usage` de una respuesta de OpenAI como diccionario"""
+    usage = getattr(response, 'usage', None)
+    if usage is None and isinstance(response, dict):
+        usage = response.get('usage')
+    if usage is None:
+        return {}
+    if isinstance(usage, dict):
+        return usage
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0),
+        'completion_tokens': getattr(usage, 'completion_tokens', 0),
+        'total_tokens': getattr(usage, 'total_tokens', 0),
+    }
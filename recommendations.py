@@ -0,0 +1,317 @@
+import os
+import re
+import math
+import zlib
+import logging
+
+import numpy as np
+
+from catalog import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Dimensiones del vector de texto (las palabras se reparten por hashing, sin vocabulario que crezca)
+RECOMMEND_TEXT_DIMS = int(os.getenv('RECOMMEND_TEXT_DIMS', '512'))
+# Peso de cada grupo de características en la similitud (se normalizan para sumar 1)
+RECOMMEND_TEXT_WEIGHT = float(os.getenv('RECOMMEND_TEXT_WEIGHT', '0.6'))
+RECOMMEND_CATEGORY_WEIGHT = float(os.getenv('RECOMMEND_CATEGORY_WEIGHT', '0.25'))
+RECOMMEND_PRICE_WEIGHT = float(os.getenv('RECOMMEND_PRICE_WEIGHT', '0.15'))
+# Fracción del catálogo que debe cambiar antes de recalcular el IDF de toda la matriz
+RECOMMEND_FULL_REFRESH_RATIO = float(os.getenv('RECOMMEND_FULL_REFRESH_RATIO', '0.05'))
+# Similitud de texto mínima para considerar que un mensaje habla de un producto
+RECOMMEND_MIN_SCORE = float(os.getenv('RECOMMEND_MIN_SCORE', '0.25'))
+
+# Las palabras del nombre cuentan más que las de la descripción
+NAME_WEIGHT = 2.0
+STOPWORDS = frozenset(
+    'con para por los las del una uno unos unas que sus como mas muy sin sobre entre hasta desde este esta '
+    'estos estas pero tiene tienen hay son ser the and for with'.split()
+)
+
+
+def tokenize(text):
+    """Palabras normalizadas (minúsculas, sin acentos) útiles para comparar productos"""
+    return [word for word in re.findall(r'\w+', normalize_text(text)) if len(word) > 2 and word not in STOPWORDS]
+
+
+def effective_price(product):
+    """Precio que paga el cliente: el de oferta si hay una oferta activa"""
+    ofertas = product.get('ofertas', {})
+    if ofertas.get('activa', False) and ofertas.get('precio_oferta'):
+        return float(ofertas['precio_oferta'])
+    return float(product.get('price', 0) or 0)
+
+
+def in_stock(product):
+    return bool(product.get('disponible', False)) and (product.get('stock', 0) or 0) > 0
+
+
+class RecommendationIndex:
+    """
+    Índice de productos similares con similitud coseno vectorizada.
+
+    Cada producto se describe con tres grupos de características, cada uno
+    normalizado a norma 1 y ponderado:
+    - TF-IDF del nombre y la descripción (palabras repartidas por hashing en
+      `text_dims` columnas)
+    - categoría en one-hot; su producto escalar es 1 si la categoría coincide,
+      así que se guarda como un código y se compara con `==`
+    - precio normalizado en escala logarítmica, como ángulo en [0, π]: el coseno
+      entre dos precios es el coseno de la diferencia de ángulos
+    La similitud total es la suma ponderada de los cosenos de cada grupo, que
+    equivale al coseno sobre la matriz de características concatenada.
+
+    `upsert` y `remove` solo tokenizan los productos cambiados y, antes de la
+    siguiente consulta, solo se reponderan sus filas con el IDF vigente. El IDF
+    de toda la matriz se recalcula (con NumPy) cuando ha cambiado más de
+    `full_refresh_ratio` del catálogo o un precio supera el máximo conocido.
+    """
+
+    def __init__(self, text_dims=RECOMMEND_TEXT_DIMS, text_weight=RECOMMEND_TEXT_WEIGHT,
+                 category_weight=RECOMMEND_CATEGORY_WEIGHT, price_weight=RECOMMEND_PRICE_WEIGHT,
+                 full_refresh_ratio=RECOMMEND_FULL_REFRESH_RATIO):
+        total = text_weight + category_weight + price_weight
+        self.text_weight = text_weight / total
+        self.category_weight = category_weight / total
+        self.price_weight = price_weight / total
+        self.text_dims = text_dims
+        self.full_refresh_ratio = full_refresh_ratio
+
+        self.rows = {}
+        self.products = []
+        self._free = []
+        self._categories = {}
+        self._revision = 0
+        self._allocate(0)
+
+    def _allocate(self, capacity):
+        self._tf = np.zeros((capacity, self.text_dims), dtype=np.float32)
+        self._category = np.full(capacity, -1, dtype=np.int32)
+        self._price = np.zeros(capacity, dtype=np.float64)
+        self._in_stock = np.zeros(capacity, dtype=bool)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._df = np.zeros(self.text_dims, dtype=np.float64)
+        self._weighted = self._tf
+        self._angle = self._price
+        self._highest_log_price = 0.0
+        self._pending = set()
+        self._full_refresh = True
+
+    def _grow(self, needed):
+        capacity = len(self._alive)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 64)
+        for name in ('_tf', '_category', '_price', '_in_stock', '_alive'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            if name == '_category':
+                new.fill(-1)
+            new[:capacity] = old
+            setattr(self, name, new)
+
+    def _term_vector(self, name, description=''):
+        """Frecuencias sublineales (1 + log) de las palabras del texto, repartidas por hashing"""
+        counts = {}
+        for words, weight in ((tokenize(name), NAME_WEIGHT), (tokenize(description), 1.0)):
+            for word in words:
+                column = zlib.crc32(word.encode()) % self.text_dims
+                counts[column] = counts.get(column, 0.0) + weight
+        vector = np.zeros(self.text_dims, dtype=np.float32)
+        for column, count in counts.items():
+            vector[column] = 1.0 + math.log(count)
+        return vector
+
+    def _category_code(self, category):
+        return self._categories.setdefault(category or '', len(self._categories))
+
+    def build(self, products):
+        """Reconstruir el índice completo"""
+        self.rows = {}
+        self.products = []
+        self._free = []
+        self._categories = {}
+        products = list(products)
+        self._allocate(len(products))
+        self.upsert(products)
+        logger.info(f"✅ Índice de recomendaciones construido: {len(self.rows)} productos")
+
+    def upsert(self, products):
+        """Añadir o actualizar productos (solo se procesan los indicados)"""
+        for product in products:
+            product_id = product.get('id')
+            row = self.rows.get(product_id)
+            if row is None:
+                row = self._free.pop() if self._free else len(self.products)
+                self._grow(row + 1)
+                if row == len(self.products):
+                    self.products.append(product)
+                else:
+                    self.products[row] = product
+                self.rows[product_id] = row
+            else:
+                self.products[row] = product
+                self._df -= self._tf[row] > 0
+
+            self._tf[row] = self._term_vector(product.get('name', ''), product.get('description', ''))
+            self._df += self._tf[row] > 0
+            self._category[row] = self._category_code(product.get('category'))
+            self._price[row] = effective_price(product)
+            self._in_stock[row] = in_stock(product)
+            self._alive[row] = True
+            self._pending.add(row)
+
+    def remove(self, product_ids):
+        for product_id in product_ids:
+            row = self.rows.pop(product_id, None)
+            if row is None:
+                continue
+            self._df -= self._tf[row] > 0
+            self._tf[row] = 0
+            self._alive[row] = False
+            self._in_stock[row] = False
+            self.products[row] = None
+            self._free.append(row)
+            self._pending.add(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _refresh(self):
+        """Poner al día la matriz ponderada antes de una consulta"""
+        if not self._pending and not self._full_refresh:
+            return
+        count = len(self.products)
+        pending = np.fromiter(self._pending, dtype=np.int64, count=len(self._pending))
+        full = (
+            self._full_refresh
+            or count > len(self._weighted)
+            or len(pending) > self.full_refresh_ratio * max(len(self.rows), 1)
+            or np.log1p(self._price[pending]).max(initial=0.0) > self._highest_log_price
+        )
+        if full:
+            self._refresh_all(count)
+        else:
+            # Pocos cambios: el IDF apenas varía, basta con reponderar las filas cambiadas
+            self._weighted[pending] = self._normalize(self._tf[pending] * self._idf)
+            self._angle[pending] = np.log1p(self._price[pending]) / self._highest_log_price * math.pi \
+                if self._highest_log_price > 0 else 0.0
+        self._pending.clear()
+        self._full_refresh = False
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    @property
+    def revision(self):
+        """Número de recálculos completos de la matriz: si cambia, han cambiado las similitudes de todo el catálogo"""
+        self._refresh()
+        return self._revision
+
+    def _refresh_all(self, count):
+        """Recalcular el IDF y reponderar y normalizar toda la matriz (vectorizado)"""
+        self._revision += 1
+        documents = max(len(self.rows), 1)
+        self._idf = (np.log((1.0 + documents) / (1.0 + self._df)) + 1.0).astype(np.float32)
+        self._weighted = self._normalize(self._tf[:count] * self._idf)
+
+        log_price = np.log1p(self._price[:count])
+        self._highest_log_price = float(log_price[self._alive[:count]].max()) if len(self.rows) else 0.0
+        if self._highest_log_price > 0:
+            self._angle = log_price / self._highest_log_price * math.pi
+        else:
+            self._angle = np.zeros(count)
+
+    def _query_vector(self, text):
+        vector = self._term_vector(text) * self._idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _top(self, scores, mask, limit):
+        candidates = np.flatnonzero(mask)
+        if not len(candidates) or limit <= 0:
+            return []
+        candidate_scores = scores[candidates]
+        if len(candidates) > limit:
+            best = np.argpartition(-candidate_scores, limit - 1)[:limit]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(-candidate_scores[best], kind='stable')]
+        return [(self.products[candidates[index]], float(candidate_scores[index])) for index in best]
+
+    def _mask(self, only_in_stock, max_price):
+        count = len(self.products)
+        mask = self._alive[:count].copy()
+        if only_in_stock:
+            mask &= self._in_stock[:count]
+        if max_price is not None:
+            mask &= self._price[:count] <= max_price
+        return mask
+
+    def _scores(self, row):
+        """Similitud de la fila `row` con todas las filas (es simétrica)"""
+        self._refresh()
+        count = len(self.products)
+        scores = self.text_weight * (self._weighted @ self._weighted[row])
+        scores += self.category_weight * (self._category[:count] == self._category[row])
+        scores += self.price_weight * np.cos(self._angle - self._angle[row])
+        return scores
+
+    def similar(self, product_id, limit=5, only_in_stock=True, max_price=None):
+        """Productos más parecidos a `product_id`: lista de (producto, similitud)"""
+        row = self.rows.get(product_id)
+        if row is None:
+            return []
+        scores = self._scores(row)
+        mask = self._mask(only_in_stock, max_price)
+        mask[row] = False
+        return self._top(scores, mask, limit)
+
+    def similarities(self, product_id):
+        """Similitud de `product_id` con cada uno de los demás productos: {ID del producto: similitud}"""
+        row = self.rows.get(product_id)
+        if row is None:
+            return {}
+        scores = self._scores(row).tolist()
+        return {other_id: scores[other_row] for other_id, other_row in self.rows.items() if other_row != row}
+
+    def match_text(self, text, limit=5, only_in_stock=False, max_price=None, min_score=RECOMMEND_MIN_SCORE):
+        """Productos cuyo nombre y descripción se parecen a `text`"""
+        if not self.rows:
+            return []
+        self._refresh()
+        scores = self._weighted @ self._query_vector(text)
+        mask = self._mask(only_in_stock, max_price) & (scores >= min_score)
+        return self._top(scores, mask, limit)
+
+    def alternatives(self, text, limit=5, max_price=None):
+        """
+        Producto mencionado en `text` y alternativas similares en stock.
+        Devuelve (producto mencionado o None, lista de (producto, similitud)).
+        """
+        matches = self.match_text(text, limit=1)
+        if not matches:
+            return None, self.match_text(text, limit=limit, only_in_stock=True, max_price=max_price)
+        product = matches[0][0]
+        return product, self.similar(product.get('id'), limit=limit, max_price=max_price)
+
+
+def format_candidates(product, candidates):
+    """Bloque breve de candidatos del catálogo para añadir al prompt de GPT"""
+    lines = []
+    if product is not None:
+        state = "disponible" if in_stock(product) else "SIN STOCK"
+        lines.append(f"Producto mencionado: {product.get('name', '')} (ID: {product.get('id', '')}, "
+                     f"${effective_price(product):.2f}, {state})")
+    if candidates:
+        lines.append("Alternativas similares en stock:" if product is not None else "Productos relacionados en stock:")
+        lines.extend(
+            f"- {candidate.get('name', '')} (ID: {candidate.get('id', '')}, ${effective_price(candidate):.2f})"
+            for candidate, _ in candidates
+        )
+    if not lines:
+        return None
+    return "CANDIDATOS DEL CATÁLOGO PARA ESTA CONSULTA:\n" + "\n".join(lines)
@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from catalog import normalize_text
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Tabla de rutas en JSON ({"ruta": {"model": ..., "max_tokens": ...}}); se recarga al cambiar el archivo
+ROUTES_FILE = os.getenv('ROUTES_FILE')
+# Cada cuánto se comprueba si el archivo de rutas ha cambiado (segundos)
+ROUTES_CHECK_INTERVAL = float(os.getenv('ROUTES_CHECK_INTERVAL', '10'))
+# Fracción de la cuota diaria consumida a partir de la cual se responde en modo ahorro
+ROUTE_QUOTA_PRESSURE = float(os.getenv('ROUTE_QUOTA_PRESSURE', '0.8'))
+
+GREETING = 'greeting'
+STORE = 'store'
+PRODUCT = 'product'
+DETAILED = 'detailed'
+GENERAL = 'general'
+
+# model, max_tokens, temperature, history (mensajes anteriores que se envían) y sus valores bajo presión
+DEFAULT_ROUTES = {
+    GREETING: {'model': 'gpt-3.5-turbo', 'max_tokens': 150, 'temperature': 0.7, 'history': 2,
+               'pressure_max_tokens': 100, 'pressure_history': 0},
+    STORE: {'model': 'gpt-3.5-turbo', 'max_tokens': 300, 'temperature': 0.3, 'history': 4,
+            'pressure_max_tokens': 200, 'pressure_history': 2},
+    PRODUCT: {'model': 'gpt-3.5-turbo', 'max_tokens': 500, 'temperature': 0.5, 'history': 6,
+              'pressure_max_tokens': 300, 'pressure_history': 2},
+    DETAILED: {'model': 'gpt-3.5-turbo', 'max_tokens': 1000, 'temperature': 0.7, 'history': 10,
+               'pressure_max_tokens': 600, 'pressure_history': 4},
+    GENERAL: {'model': 'gpt-3.5-turbo', 'max_tokens': 600, 'temperature': 0.7, 'history': 8,
+              'pressure_max_tokens': 400, 'pressure_history': 2},
+}
+ROUTE_FIELDS = {
+    'model': str, 'max_tokens': int, 'temperature': float, 'history': int,
+    'pressure_model': str, 'pressure_max_tokens': int, 'pressure_history': int,
+}
+# Rango de temperatura que acepta la API de OpenAI
+MIN_TEMPERATURE = 0
+MAX_TEMPERATURE = 2
+
+GREETING_WORDS = frozenset(
+    'hola buenas buenos dias tardes noches hey saludos gracias muchas adios chao ok vale perfecto genial '
+    'listo entendido bien que tal como estas muy a todos'.split()
+)
+COMPARISON_WORDS = ('diferencia', 'diferencias', 'comparar', 'compara', 'comparacion', 'versus', 'vs',
+                    'mejor', 'ventajas', 'recomiendas', 'recomienda', 'recomendacion', 'cual elijo')
+STORE_WORDS = ('horario', 'horarios', 'abren', 'cierran', 'envio', 'envios', 'entrega', 'pago', 'pagar',
+               'tarjeta', 'paypal', 'devolucion', 'devolver', 'garantia', 'direccion', 'telefono', 'contacto')
+# Mensajes con más palabras que esto se tratan como consultas detalladas
+DETAILED_WORDS = 30
+
+
+class RouteDecision:
+    """Parámetros elegidos para una solicitud a OpenAI"""
+
+    def __init__(self, name, model, max_tokens, temperature, history, pressure=False):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.history = history
+        self.pressure = pressure
+
+    def __repr__(self):
+        return (f"RouteDecision({self.name}, {self.model}, max_tokens={self.max_tokens}, "
+                f"history={self.history}, pressure={self.pressure})")
+
+
+def validate_routes(table):
+    """Lista de errores de una tabla de rutas (vacía si es válida)"""
+    errors = []
+    if not isinstance(table, dict):
+        return ["la tabla de rutas debe ser un objeto JSON"]
+    for name, route in table.items():
+        if name not in DEFAULT_ROUTES:
+            errors.append(f"ruta desconocida '{name}' (rutas: {', '.join(DEFAULT_ROUTES)})")
+            continue
+        if not isinstance(route, dict):
+            errors.append(f"ruta '{name}': debe ser un objeto")
+            continue
+        for field, value in route.items():
+            expected = ROUTE_FIELDS.get(field)
+            if expected is None:
+                errors.append(f"ruta '{name}': campo desconocido '{field}'")
+            elif expected is str and not isinstance(value, str):
+                errors.append(f"ruta '{name}': '{field}' debe ser texto")
+            elif expected is int and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+                errors.append(f"ruta '{name}': '{field}' debe ser un entero no negativo")
+            elif expected is float and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                        or not MIN_TEMPERATURE <= value <= MAX_TEMPERATURE):
+                errors.append(f"ruta '{name}': '{field}' debe ser un número entre {MIN_TEMPERATURE} y {MAX_TEMPERATURE}")
+    return errors
+
+
+def trim_history(messages, history):
+    """Contexto del sistema, los últimos `history` mensajes anteriores y el mensaje actual"""
+    if history is None or len(messages) <= history + 2:
+        return messages
+    return messages[:1] + messages[len(messages) - history - 1:]
+
+
+class ModelRouter:
+    """
+    Elige modelo, `max_tokens`, temperatura y profundidad del historial de cada solicitud.
+
+    El mensaje se clasifica localmente (saludo, pregunta sobre la tienda,
+    consulta de producto, consulta detallada o general) y se aplican los
+    parámetros de esa ruta en la tabla. Bajo presión (modo degradado del
+    control de admisión o usuario cerca de su cuota diaria) se usan los
+    valores `pressure_*` de la ruta. La tabla se cambia en caliente con
+    `update` o editando `ROUTES_FILE`. Cada ruta exporta su latencia y sus
+    tokens para ajustar la tabla con datos reales.
+    """
+
+    def __init__(self, routes_file=ROUTES_FILE, quota=None, admission=None, metrics=None, tenant=None,
+                 check_interval=ROUTES_CHECK_INTERVAL, quota_pressure=ROUTE_QUOTA_PRESSURE):
+        self.routes_file = routes_file
+        self.quota = quota
+        self.admission = admission
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+        self.check_interval = check_interval
+        self.quota_pressure = quota_pressure
+        self.routes = {name: dict(route) for name, route in DEFAULT_ROUTES.items()}
+        self._lock = threading.Lock()
+        self._file_mtime = None
+        self._last_check = 0.0
+        if routes_file:
+            self._reload_file()
+
+    def update(self, table, replace=False):
+        """
+        Aplicar cambios a la tabla de rutas (solo los campos indicados) y devolver los errores, si los hay.
+        Con `replace` los cambios se aplican sobre los valores por defecto en lugar de sobre la tabla actual.
+        """
+        errors = validate_routes(table)
+        if errors:
+            return errors
+        with self._lock:
+            base = DEFAULT_ROUTES if replace else self.routes
+            routes = {name: dict(route) for name, route in base.items()}
+            for name, route in table.items():
+                routes[name].update(route)
+            self.routes = routes
+        logger.info(f"🧭 Tabla de rutas actualizada: {', '.join(sorted(table))}")
+        return []
+
+    def _reload_file(self):
+        try:
+            mtime = os.stat(self.routes_file).st_mtime
+        except OSError as e:
+            logger.error(f"❌ No se pudo leer la tabla de rutas {self.routes_file}: {str(e)}")
+            return
+        if mtime == self._file_mtime:
+            return
+        self._file_mtime = mtime
+        try:
+            with open(self.routes_file, 'r', encoding='utf-8') as file:
+                table = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Tabla de rutas inválida en {self.routes_file}, se mantiene la anterior: {str(e)}")
+            return
+        errors = self.update(table, replace=True)
+        if errors:
+            logger.error(f"❌ Tabla de rutas inválida en {self.routes_file}, se mantiene la anterior: {'; '.join(errors)}")
+
+    def _maybe_reload(self):
+        if not self.routes_file:
+            return
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self._reload_file()
+
+    @staticmethod
+    def classify(text, mentions_product=False):
+        """Ruta de un mensaje según su longitud, sus palabras y si menciona un producto del catálogo"""
+        normalized = normalize_text(text or '')
+        words = re.findall(r'\w+', normalized)
+        if not words:
+            return GREETING
+        word_set = set(words)
+        if any((keyword in normalized) if ' ' in keyword else (keyword in word_set) for keyword in COMPARISON_WORDS) \
+                or len(words) > DETAILED_WORDS:
+            return DETAILED
+        if mentions_product:
+            return PRODUCT
+        if len(words) <= 6 and word_set <= GREETING_WORDS:
+            return GREETING
+        if word_set.intersection(STORE_WORDS):
+            return STORE
+        return GENERAL
+
+    def under_pressure(self, user_id=None):
+        if self.admission is not None and self.admission.under_pressure():
+            return True
+        if self.quota is not None and user_id is not None and self.quota.daily_tokens:
+            return self.quota.usage_for(user_id) >= self.quota.daily_tokens * self.quota_pressure
+        return False
+
+    def route(self, text, user_id=None, mentions_product=False):
+        """Decidir los parámetros de la solicitud para este mensaje"""
+        self._maybe_reload()
+        name = self.classify(text, mentions_product)
+        route = self.routes[name]
+        pressure = self.under_pressure(user_id)
+        if pressure:
+            decision = RouteDecision(
+                name,
+                route.get('pressure_model', route['model']),
+                min(route.get('pressure_max_tokens', route['max_tokens']), route['max_tokens']),
+                route['temperature'],
+                min(route.get('pressure_history', route['history']), route['history']),
+                pressure=True,
+            )
+        else:
+            decision = RouteDecision(name, route['model'], route['max_tokens'], route['temperature'], route['history'])
+        self.metrics.inc('storebot_route_requests_total', tenant=self.tenant, route=name,
+                         model=decision.model, pressure=str(pressure).lower())
+        return decision
+
+    def observe(self, decision, latency, usage):
+        """Registrar la latencia y los tokens de una solicitud atendida por `decision`"""
+        self.metrics.observe('storebot_route_latency_seconds', latency, tenant=self.tenant, route=decision.name)
+        for field in ('prompt_tokens', 'completion_tokens'):
+            self.metrics.inc('storebot_route_tokens_total', int(usage.get(field, 0) or 0),
+                             tenant=self.tenant, route=decision.name, kind=field.split('_')[0])
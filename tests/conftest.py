@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# productsv2 comprueba las claves al importarse; las pruebas usan servicios simulados
+os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('PRODUCT_CARDS_COPY', '0')
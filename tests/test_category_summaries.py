@@ -0,0 +1,30 @@
+import pytest
+
+from category_summaries import summary_pipeline, summarize_products, UNCATEGORIZED
+
+mongomock = pytest.importorskip('mongomock')
+
+PRODUCTS = [
+    {'id': '1', 'name': 'Funda', 'category': '', 'price': 10, 'disponible': True, 'stock': 3},
+    {'id': '2', 'name': 'Cable', 'price': 5, 'disponible': True, 'stock': 0},
+    {'id': '3', 'name': 'Cargador', 'category': None, 'price': 20, 'disponible': True, 'stock': 1},
+    {'id': '4', 'name': 'iPhone', 'category': 'Smartphones', 'price': 999, 'disponible': True, 'stock': 2},
+]
+FIELDS = ('_id', 'products', 'in_stock', 'active_offers', 'min_price', 'max_price')
+
+
+def aggregate(categories=None):
+    db = mongomock.MongoClient().db
+    db.products.insert_many([dict(product) for product in PRODUCTS])
+    # Sin la etapa `$merge` final para leer los resúmenes directamente
+    summaries = db.products.aggregate(summary_pipeline(categories)[:-1])
+    return sorted(({field: summary[field] for field in FIELDS} for summary in summaries), key=lambda s: s['_id'])
+
+
+def test_empty_category_is_uncategorized():
+    expected = sorted(({field: summary[field] for field in FIELDS} for summary in summarize_products(PRODUCTS)),
+                      key=lambda s: s['_id'])
+    assert [summary['_id'] for summary in expected] == ['Sin categoría', 'Smartphones']
+    assert aggregate() == expected
+    # Refrescar la categoría vacía recalcula el mismo resumen que la reconstrucción completa
+    assert aggregate([UNCATEGORIZED]) == expected[:1]
@@ -0,0 +1,70 @@
+import types
+import asyncio
+
+from dedupe import UpdateDeduplicator, INFLIGHT
+from metrics import Metrics
+
+
+def make_bot():
+    from productsv2 import StoreBot
+    from replay import FakeConnections, FakeBot, synthetic_catalog
+
+    bot = StoreBot(telegram_token='test', db_name='Test', connections=FakeConnections(synthetic_catalog(20), 0),
+                   tenant='test')
+    calls = []
+
+    async def get_gpt_response(messages, user_id, route):
+        calls.append(messages[-1]['content'])
+        await asyncio.sleep(0.01)
+        return f"respuesta {len(calls)}"
+
+    bot.get_gpt_response = get_gpt_response
+    return bot, calls, types.SimpleNamespace(bot=FakeBot(0))
+
+
+def test_repeat_in_flight_is_dropped():
+    dedupe = UpdateDeduplicator(metrics=Metrics())
+    key = dedupe.content_key(1, 'Hola ')
+    assert dedupe.begin(key) is None
+    assert dedupe.begin(dedupe.content_key(1, 'hola')) == INFLIGHT
+    assert dedupe.saved_calls == 1
+    dedupe.finish(key)
+    assert dedupe.begin(key) is None
+
+
+def test_double_send_while_answering_calls_the_model_once():
+    from replay import make_update
+
+    async def run():
+        bot, calls, context = make_bot()
+        await bot.post_init(context)
+        try:
+            await asyncio.gather(bot.handle_message(make_update(7, 'sí'), context),
+                                 bot.handle_message(make_update(7, 'sí'), context))
+            return calls, bot.conversations[7][1:]
+        finally:
+            await bot.post_shutdown(None)
+
+    calls, conversation = asyncio.run(run())
+    assert len(calls) == 1
+    assert [message['content'] for message in conversation] == ['sí', 'respuesta 1']
+
+
+def test_sequential_double_send_is_a_new_message():
+    # Sin ver la conversación, un reenvío no se distingue de un "sí" a la siguiente pregunta del bot
+    from replay import make_update
+
+    async def run():
+        bot, calls, context = make_bot()
+        await bot.post_init(context)
+        try:
+            await bot.handle_message(make_update(7, 'sí'), context)
+            await bot.handle_message(make_update(7, 'sí'), context)
+            return calls, bot.conversations[7][1:], bot.dedupe.saved_calls
+        finally:
+            await bot.post_shutdown(None)
+
+    calls, conversation, saved_calls = asyncio.run(run())
+    assert len(calls) == 2
+    assert saved_calls == 0
+    assert [message['content'] for message in conversation] == ['sí', 'respuesta 1', 'sí', 'respuesta 2']
@@ -0,0 +1,52 @@
+from metrics import Metrics
+from mongo_pool import MongoConnectionManager
+
+
+class FakeCursor(list):
+    def hint(self, index):
+        return self
+
+
+class FakeDatabase:
+    def __init__(self, client):
+        self.client = client
+
+    def command(self, name):
+        return self.client.command(name)
+
+    def __getitem__(self, collection):
+        return self
+
+    def find(self, query, projection):
+        if self.client.failing:
+            raise ConnectionError("sin servidor")
+        return FakeCursor()
+
+
+class FakeClient:
+    """Cliente de MongoDB que falla mientras `failing` es verdadero"""
+
+    def __init__(self):
+        self.failing = True
+        self.admin = self
+
+    def command(self, name):
+        if self.failing:
+            raise ConnectionError("sin servidor")
+        return {'ok': 1}
+
+    def get_database(self, name, read_preference=None):
+        return FakeDatabase(self)
+
+
+def test_failed_warmup_is_retried():
+    manager = MongoConnectionManager(uri='mongodb://localhost:1', min_pool_size=2, metrics=Metrics())
+    manager.client.close()
+    manager.client = FakeClient()
+
+    assert manager.warmup('Test') is False
+    manager.client.failing = False
+    assert manager.warmup('Test') is True
+    # Una vez precalentada no se vuelve a recorrer
+    manager.client.failing = True
+    assert manager.warmup('Test') is True
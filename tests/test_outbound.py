@@ -0,0 +1,110 @@
+import time
+import asyncio
+import types
+
+import httpx
+from telegram.error import NetworkError, TimedOut
+
+from metrics import Metrics
+from outbound import OutboundScheduler, INTERACTIVE, BULK
+
+GLOBAL_RATE = 40
+CHAT_RATE = 5
+CHAT_BURST = 2
+# Holgura para la imprecisión del reloj del bucle de eventos
+SLACK = 0.01
+
+
+class FakeBotAPI:
+    """Bot API que registra cuándo llega cada envío y puede fallar con los errores indicados"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.requests = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.requests.append((time.monotonic(), chat_id, text))
+        await asyncio.sleep(0.005)
+        if self.errors:
+            raise self.errors.pop(0)
+        return types.SimpleNamespace(chat_id=chat_id, text=text)
+
+
+def max_in_window(times, window):
+    """Mayor número de envíos dentro de cualquier intervalo de `window` segundos"""
+    times = sorted(times)
+    best, start = 0, 0
+    for end, at in enumerate(times):
+        while at - times[start] > window - SLACK:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def make_scheduler(**kwargs):
+    return OutboundScheduler(global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                             metrics=Metrics(), **kwargs)
+
+
+def test_limits_and_priorities():
+    async def scenario():
+        api = FakeBotAPI()
+        scheduler = make_scheduler()
+        scheduler.start(api)
+        # Una difusión a 4 chats con 8 mensajes cada uno y, detrás, respuestas a 3 usuarios
+        futures = [scheduler.send(chat_id, f"difusión {n}", priority=BULK) for n in range(8) for chat_id in range(4)]
+        futures += [scheduler.send(100 + chat_id, "respuesta", priority=INTERACTIVE) for chat_id in range(3)]
+        await asyncio.gather(*futures)
+        await scheduler.stop()
+        return api.requests
+
+    requests = asyncio.run(scenario())
+    assert len(requests) == 35
+    # Las respuestas salen antes que cualquier mensaje de la difusión
+    assert [text for _, _, text in requests[:3]] == ["respuesta"] * 3
+    # Límite global: capacidad 1, `GLOBAL_RATE` por segundo
+    times = [at for at, _, _ in requests]
+    for window in (0.1, 0.25, 0.5):
+        assert max_in_window(times, window) <= 1 + GLOBAL_RATE * window
+    # Límite por chat: ráfaga de `CHAT_BURST` y `CHAT_RATE` por segundo
+    for chat_id in range(4):
+        chat_times = [at for at, chat, _ in requests if chat == chat_id]
+        for window in (0.2, 0.5):
+            assert max_in_window(chat_times, window) <= CHAT_BURST + CHAT_RATE * window
+
+
+def test_timeout_is_not_retried():
+    async def scenario():
+        api = FakeBotAPI(errors=[TimedOut()])
+        scheduler = make_scheduler()
+        scheduler.start(api)
+        try:
+            await scheduler.send(1, "hola")
+        except TimedOut:
+            pass
+        else:
+            raise AssertionError("el envío debía fallar")
+        finally:
+            await scheduler.stop()
+        return api.requests
+
+    # Telegram pudo haber entregado el mensaje: no se vuelve a enviar
+    assert len(asyncio.run(scenario())) == 1
+
+
+def test_unsent_request_is_retried():
+    async def scenario():
+        error = NetworkError("httpx.ConnectError: sin conexión")
+        error.__cause__ = httpx.ConnectError("sin conexión")
+        api = FakeBotAPI(errors=[error])
+        scheduler = make_scheduler()
+        scheduler.start(api)
+        try:
+            message = await scheduler.send(1, "hola")
+        finally:
+            await scheduler.stop()
+        return message, api.requests
+
+    message, requests = asyncio.run(scenario())
+    assert message.text == "hola"
+    assert len(requests) == 2
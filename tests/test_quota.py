@@ -0,0 +1,24 @@
+import pytest
+
+from quota import TokenQuotaManager, QuotaExceeded
+
+
+def test_rate_limit_and_idle_windows_are_forgotten():
+    quota = TokenQuotaManager(rate_limit=2, rate_window=60, daily_tokens=0)
+    quota.check(1, now=1000)
+    quota.check(1, now=1001)
+    with pytest.raises(QuotaExceeded):
+        quota.check(1, now=1002)
+
+    # Miles de usuarios de paso no se quedan en memoria
+    for user_id in range(2, 5000):
+        quota.check(user_id, now=1010)
+    quota.check(1, now=1200)
+    assert len(quota._windows) == 1
+
+
+def test_rate_windows_are_bounded():
+    quota = TokenQuotaManager(rate_limit=2, rate_window=60, daily_tokens=0, max_users=100)
+    for user_id in range(1000):
+        quota.check(user_id, now=1000)
+    assert len(quota._windows) == 100
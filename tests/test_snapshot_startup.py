@@ -0,0 +1,49 @@
+import types
+import asyncio
+
+from catalog import build_system_context, format_product_line
+from catalog_snapshot import write_snapshot
+
+
+def make_bot(tmp_path, size=200):
+    from productsv2 import StoreBot
+    from replay import FakeConnections, FakeBot, synthetic_catalog
+
+    data = synthetic_catalog(size)
+    path = tmp_path / 'catalog.snap'
+    write_snapshot(data, path)
+    bot = StoreBot(telegram_token='test', db_name='Test', connections=FakeConnections(data, 0),
+                   tenant='test', snapshot_path=str(path))
+    return bot, data, types.SimpleNamespace(bot=FakeBot(0))
+
+
+def test_snapshot_startup_does_not_read_every_product(tmp_path):
+    bot, data, app = make_bot(tmp_path)
+    offers = sum(1 for product in data['products'] if product.get('ofertas'))
+    # Solo se decodifican los productos con oferta (para el índice de vencimientos)
+    assert len(bot.snapshot._views) <= offers
+    assert not bot.indexes_ready
+    # El contexto parte de las líneas del snapshot con las ofertas vencidas al arrancar ya actualizadas
+    assert bot.snapshot_changes
+    assert bot.contexts.resolve(bot.contexts.latest) == build_system_context(
+        data['store_info'], [format_product_line(bot.products[product['id']]) for product in data['products']]
+    )
+
+
+def test_snapshot_indexes_are_built_after_startup(tmp_path):
+    async def scenario():
+        bot, data, app = make_bot(tmp_path)
+        product = data['products'][7]
+        await bot.post_init(app)
+        # Un cambio mientras se construyen los índices se aplica al terminar
+        bot.on_products_changed([product['id']])
+        await bot.index_task
+        try:
+            assert bot.indexes_ready and not bot.pending_changes
+            assert bot.cards.get(product['id']) is not None
+            assert bot.search.answer(product['name'])
+            assert bot.responder.match_product(product['name']) is not None
+        finally:
+            await bot.post_shutdown(app)
+
+    asyncio.run(scenario())
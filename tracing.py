@@ -0,0 +1,237 @@
+import os
+import re
+import hmac
+import glob
+import gzip
+import json
+import zlib
+import time
+import random
+import itertools
+import hashlib
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+# Archivo de traza (JSONL comprimido con gzip); vacío = sin grabación. Cada proceso escribe su propia
+# sesión junto a él (trace.<fecha>-<pid>-<n>.jsonl.gz) y los lectores reúnen todas las sesiones de la ruta
+TRACE_FILE = os.getenv('TRACE_FILE')
+# Fracción de actualizaciones grabadas (se muestrea por usuario para conservar conversaciones completas)
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+# Clave para anonimizar los IDs de usuario; si no se define, cada arranque usa una clave aleatoria
+TRACE_SALT = os.getenv('TRACE_SALT')
+
+TRACE_VERSION = 1
+
+# Sesiones abiertas por este proceso (varias tiendas pueden compartir la misma ruta)
+_sessions = itertools.count(1)
+
+PII_PATTERNS = (
+    (re.compile(r'\S+@\S+\.\w+'), '<email>'),
+    (re.compile(r'https?://\S+'), '<url>'),
+    (re.compile(r'\+?\d[\d\s().-]{6,}\d'), '<numero>'),
+)
+
+
+def split_trace_path(file_path):
+    """(raíz, extensión) de una ruta de traza, con `.jsonl.gz` como una sola extensión"""
+    for extension in ('.jsonl.gz', '.jsonl'):
+        if file_path.endswith(extension):
+            return file_path[:-len(extension)], extension
+    return os.path.splitext(file_path)
+
+
+def session_file(file_path):
+    """Archivo de la sesión de este proceso para la traza `file_path`"""
+    root, extension = split_trace_path(file_path)
+    return f"{root}.{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_sessions)}{extension}"
+
+
+def trace_files(file_path):
+    """
+    Archivos de una traza: la propia ruta si existe (una sesión concreta o una
+    traza antigua) seguida de las sesiones grabadas con ella como `TRACE_FILE`
+    """
+    root, extension = split_trace_path(file_path)
+    sessions = sorted(glob.glob(f"{glob.escape(root)}.*-*{extension}"))
+    files = [file_path] if os.path.exists(file_path) else []
+    files += [session for session in sessions if session != file_path]
+    if not files:
+        raise FileNotFoundError(f"No hay trazas en {file_path}")
+    return files
+
+
+def read_lines(file_path):
+    """
+    Eventos de un archivo de traza. Si el proceso que lo grababa terminó de
+    golpe, el final está truncado: se leen los eventos completos y se para ahí.
+    """
+    try:
+        with gzip.open(file_path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+        logger.warning(f"⚠️ Traza {file_path} truncada; se ignora el final ({type(e).__name__})")
+
+
+def scrub_text(text):
+    """Quitar del texto datos personales evidentes (emails, URLs, teléfonos y números largos)"""
+    for pattern, replacement in PII_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class TraceRecorder:
+    """
+    Graba las actualizaciones que atienden los handlers de `StoreBot` en una
+    traza compacta para reproducirla después (benchmarks/replay.py).
+
+    Cada línea guarda el instante de llegada relativo al inicio, el handler,
+    el usuario anonimizado (HMAC), el texto sin datos personales evidentes y
+    la duración del handler. El archivo es JSONL comprimido con gzip. Cada
+    proceso graba una sesión en su propio archivo (`session_file`), así que
+    una sesión que termina de golpe no deja ilegibles las demás.
+    """
+
+    def __init__(self, file_path, sample_rate=TRACE_SAMPLE_RATE, salt=TRACE_SALT, tenant=None):
+        self.file_path = session_file(file_path)
+        self.sample_rate = sample_rate
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self.tenant = tenant or ''
+        self.started = time.monotonic()
+        self.recorded = 0
+        self._file = gzip.open(self.file_path, 'wt', encoding='utf-8', compresslevel=6)
+        self._write({'type': 'header', 'version': TRACE_VERSION, 'tenant': self.tenant,
+                     'started_at': time.time(), 'sample_rate': sample_rate})
+        logger.info(f"🎙️ Grabando traza de actualizaciones en {self.file_path}")
+
+    def _write(self, event):
+        self._file.write(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def anonymize(self, user_id):
+        return hmac.new(self.salt, str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+    def _sampled(self, user):
+        if self.sample_rate >= 1:
+            return True
+        # Muestreo determinista por usuario: se conservan sus conversaciones completas
+        return int(user[:8], 16) / 0xFFFFFFFF < self.sample_rate
+
+    def record(self, handler, update, arrived, duration, error=None):
+        message = getattr(update, 'message', None)
+        if message is None or message.from_user is None:
+            return
+        user = self.anonymize(message.from_user.id)
+        if not self._sampled(user):
+            return
+        event = {
+            'type': 'update',
+            't': round(arrived - self.started, 4),
+            'handler': handler,
+            'user': user,
+            'text': scrub_text(message.text or ''),
+            'duration': round(duration, 4),
+        }
+        if error is not None:
+            event['error'] = type(error).__name__
+        self._write(event)
+        self.recorded += 1
+
+    def wrap(self, handler, callback):
+        """Envolver un handler de Telegram para grabar cada actualización que atiende"""
+        @functools.wraps(callback)
+        async def recorded(update, context):
+            arrived = time.monotonic()
+            error = None
+            try:
+                return await callback(update, context)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self.record(handler, update, arrived, time.monotonic() - arrived, error)
+        return recorded
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"🎙️ Traza cerrada: {self.recorded} actualizaciones grabadas en {self.file_path}")
+
+
+def read_trace(file_path):
+    """Eventos de actualización de una traza, con los tiempos de cada sesión encadenados"""
+    events = []
+    offset = 0.0
+    session_end = 0.0
+    for path in trace_files(file_path):
+        for event in read_lines(path):
+            if event.get('type') == 'header':
+                # Cada sesión grabada empieza tras la anterior
+                offset = session_end
+                continue
+            event['t'] = event['t'] + offset
+            session_end = max(session_end, event['t'])
+            events.append(event)
+    events.sort(key=lambda event: event['t'])
+    return events
+
+
+def iter_trace(file_path):
+    """
+    Eventos de actualización de una traza en el orden en que se grabaron, de
+    uno en uno y sin cargar el archivo en memoria. `at` es el instante absoluto
+    (epoch) de cada evento.
+    """
+    started_at = 0.0
+    for path in trace_files(file_path):
+        for event in read_lines(path):
+            if event.get('type') == 'header':
+                started_at = event.get('started_at', 0.0)
+                continue
+            event['at'] = started_at + event['t']
+            yield event
+
+
+def write_trace(file_path, events, tenant=''):
+    """Escribir una traza a partir de una lista de eventos (por ejemplo, una traza sintética)"""
+    with gzip.open(file_path, 'wt', encoding='utf-8') as file:
+        file.write(json.dumps({'type': 'header', 'version': TRACE_VERSION, 'tenant': tenant,
+                               'started_at': time.time(), 'sample_rate': 1.0}) + '\n')
+        for event in events:
+            file.write(json.dumps(dict(event, type='update'), ensure_ascii=False, separators=(',', ':')) + '\n')
+
+
+def sample_trace(duration=300, users=200, seed=7):
+    """
+    Traza sintética con la forma del tráfico real: ráfagas tras una promoción,
+    muchas consultas de /ofertas y algunas conversaciones largas.
+    """
+    rng = random.Random(seed)
+    questions = [
+        "hola, ¿tienen el iphone 15 pro?", "¿cuál es el horario de la tienda?", "¿hacen envíos a domicilio?",
+        "busco unos auriculares inalámbricos baratos", "¿qué portátil me recomiendas para programar?",
+        "¿el samsung galaxy tab tiene stock?", "¿puedo pagar con paypal?", "¿cuánto cuesta el pixel 8?",
+        "quiero devolver un producto", "¿tienen ofertas en televisores?", "¿qué diferencia hay entre los dos?",
+        "¿y en otro color?", "gracias!", "¿cuánto tarda el envío?",
+    ]
+    commands = [('offers_command', '/ofertas', 5), ('products_command', '/productos', 2),
+                ('store_info_command', '/info', 1), ('start_command', '/start', 1), ('similar_command', '/similares iphone', 1)]
+    command_weights = [weight for _, _, weight in commands]
+    events = []
+    for index in range(users):
+        user = hashlib.sha256(f'user-{seed}-{index}'.encode()).hexdigest()[:16]
+        # Un 10 % de usuarios mantiene conversaciones largas
+        turns = rng.randint(8, 25) if rng.random() < 0.1 else rng.randint(1, 4)
+        # La mitad llega en la ráfaga posterior a una promoción (en el primer 10 % de la traza)
+        t = rng.uniform(0, duration * 0.1) if rng.random() < 0.5 else rng.uniform(0, duration)
+        for _ in range(turns):
+            if rng.random() < 0.35:
+                handler, text, _ = rng.choices(commands, weights=command_weights)[0]
+            else:
+                handler, text = 'handle_message', rng.choice(questions)
+            events.append({'t': round(t, 4), 'handler': handler, 'user': user, 'text': text, 'duration': 0})
+            t += rng.expovariate(1 / 20)
+    events.sort(key=lambda event: event['t'])
+    return events
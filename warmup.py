@@ -0,0 +1,367 @@
+import os
+import re
+import json
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+from catalog import normalize_text
+from dedupe import TTLCache
+from tracing import iter_trace
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Manifiesto de calentamiento (migration/build-warmup-manifest.py); vacío = sin calentamiento
+WARMUP_MANIFEST = os.getenv('WARMUP_MANIFEST')
+# Preguntas por segundo que el calentamiento envía a OpenAI al arrancar (de una en una)
+WARMUP_RATE = float(os.getenv('WARMUP_RATE', '1'))
+# Preguntas frecuentes y productos más mencionados que se precargan
+WARMUP_MAX_QUESTIONS = int(os.getenv('WARMUP_MAX_QUESTIONS', '20'))
+WARMUP_MAX_PRODUCTS = int(os.getenv('WARMUP_MAX_PRODUCTS', '50'))
+# Duración de las ventanas horarias del manifiesto (horas del día)
+WARMUP_WINDOW_HOURS = int(os.getenv('WARMUP_WINDOW_HOURS', '3'))
+# Preguntas y productos distintos que se siguen por ventana al analizar las trazas (memoria constante)
+WARMUP_TRACKED = int(os.getenv('WARMUP_TRACKED', '1000'))
+# Tiempo que se reutiliza la respuesta a la primera pregunta de una conversación (segundos; 0 = sin caché)
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '900'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2000'))
+
+MANIFEST_VERSION = 1
+
+# Origen de las entradas de la caché de respuestas
+LIVE = 'live'
+WARMUP = 'warmup'
+
+# Handlers de la traza cuyo texto es una pregunta al modelo y los que pueden mencionar un producto
+QUESTION_HANDLERS = frozenset({'handle_message'})
+PRODUCT_HANDLERS = frozenset({'handle_message', 'similar_command'})
+
+# Textos cuyo producto mencionado se recuerda al analizar (los frecuentes se repiten mucho)
+MENTION_CACHE_SIZE = 4096
+
+
+def normalize_question(text):
+    """Pregunta normalizada: minúsculas, sin acentos ni signos de puntuación"""
+    return ' '.join(re.findall(r'\w+', normalize_text(text or '')))
+
+
+class TopCounter:
+    """
+    Elementos más frecuentes de un flujo con memoria acotada (algoritmo Space-Saving).
+
+    Se siguen como mucho `capacity` elementos. Cuando llega uno nuevo con la
+    tabla llena, reemplaza al de menor cuenta y hereda esa cuenta: los
+    elementos realmente frecuentes nunca se pierden y su cuenta se sobrestima
+    como mucho en la del elemento reemplazado.
+    """
+
+    def __init__(self, capacity=WARMUP_TRACKED):
+        self.capacity = max(1, capacity)
+        self.counts = {}
+        self.samples = {}
+        self.total = 0
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def add(self, key, sample=None):
+        self.total += 1
+        count = self.counts.get(key)
+        if count is None:
+            count = self._evict() if len(self.counts) >= self.capacity else 0
+            if sample is not None:
+                self.samples[key] = sample
+        count += 1
+        self.counts[key] = count
+        # El montículo guarda entradas obsoletas (cuentas anteriores); se rehace cuando crece demasiado
+        heapq.heappush(self._heap, (count, next(self._sequence), key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, next(self._sequence), key) for key, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _evict(self):
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                del self.counts[key]
+                self.samples.pop(key, None)
+                return count
+
+    def top(self, limit):
+        """Los `limit` elementos más frecuentes: lista de (elemento, cuenta)"""
+        return heapq.nlargest(limit, self.counts.items(), key=lambda item: item[1])
+
+
+class ProductMentions:
+    """Producto del catálogo mencionado en un texto (el mismo criterio que los candidatos del prompt)"""
+
+    def __init__(self, recommender):
+        self.recommender = recommender
+        self._cache = {}
+
+    def find(self, text):
+        key = normalize_question(text)
+        if not key:
+            return None
+        if key not in self._cache:
+            if len(self._cache) >= MENTION_CACHE_SIZE:
+                self._cache.clear()
+            matches = self.recommender.match_text(text, limit=1)
+            self._cache[key] = matches[0][0].get('id') if matches else None
+        return self._cache[key]
+
+
+# --- Análisis de las trazas ----------------------------------------------------
+
+def read_events(paths):
+    """Eventos de varias trazas, de uno en uno"""
+    return itertools.chain.from_iterable(iter_trace(path) for path in paths)
+
+
+def window_of(at, window_hours=WARMUP_WINDOW_HOURS):
+    """Hora (local) en que empieza la ventana del día a la que pertenece el instante `at`"""
+    return time.localtime(at).tm_hour // window_hours * window_hours
+
+
+def observations(events, mentions=None, window_hours=WARMUP_WINDOW_HOURS):
+    """
+    (ventana, tipo, clave, texto) de cada pregunta y de cada producto
+    mencionado en los eventos, con tipo 'questions' o 'products'
+    """
+    for event in events:
+        handler = event.get('handler')
+        text = event.get('text') or ''
+        window = window_of(event['at'], window_hours)
+        if handler in QUESTION_HANDLERS:
+            key = normalize_question(text)
+            if key:
+                yield window, 'questions', key, text
+        if mentions is not None and handler in PRODUCT_HANDLERS:
+            # En /similares el producto va después del comando
+            product_id = mentions.find(text.split(maxsplit=1)[-1] if text.startswith('/') else text)
+            if product_id is not None:
+                yield window, 'products', product_id, None
+
+
+def aggregate(observed, tracked=WARMUP_TRACKED):
+    """Contadores acotados por ventana y en total: ({ventana: {tipo: TopCounter}}, {tipo: TopCounter})"""
+    windows = {}
+    overall = {'questions': TopCounter(tracked), 'products': TopCounter(tracked)}
+    for window, kind, key, sample in observed:
+        counters = windows.get(window)
+        if counters is None:
+            counters = windows[window] = {'questions': TopCounter(tracked), 'products': TopCounter(tracked)}
+        counters[kind].add(key, sample)
+        overall[kind].add(key, sample)
+    return windows, overall
+
+
+def _section(counters, top_questions, top_products):
+    questions = counters['questions']
+    return {
+        'questions': [{'text': questions.samples.get(key, key), 'key': key, 'count': count}
+                      for key, count in questions.top(top_questions)],
+        'products': [{'id': product_id, 'count': count}
+                     for product_id, count in counters['products'].top(top_products)],
+    }
+
+
+def build_manifest(paths, recommender=None, window_hours=WARMUP_WINDOW_HOURS, top_questions=50,
+                   top_products=100, tracked=WARMUP_TRACKED):
+    """
+    Manifiesto de calentamiento a partir de las trazas grabadas: las preguntas
+    más frecuentes y los productos más mencionados en cada ventana horaria
+    del día y en total. Las trazas se leen en streaming, con memoria
+    constante (`tracked` elementos por ventana).
+    """
+    counted = {'events': 0}
+
+    def counting(events):
+        for event in events:
+            counted['events'] += 1
+            yield event
+
+    mentions = ProductMentions(recommender) if recommender is not None else None
+    windows, overall = aggregate(
+        observations(counting(read_events(paths)), mentions, window_hours), tracked
+    )
+    return {
+        'version': MANIFEST_VERSION,
+        'generated_at': time.time(),
+        'window_hours': window_hours,
+        'events': counted['events'],
+        'windows': {str(window): _section(counters, top_questions, top_products)
+                    for window, counters in sorted(windows.items())},
+        'overall': _section(overall, top_questions, top_products),
+    }
+
+
+def write_manifest(manifest, file_path):
+    """Escribir el manifiesto (se sustituye de una vez: un bot que arranca nunca lee uno a medias)"""
+    temporary = f"{file_path}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    os.replace(temporary, file_path)
+
+
+def load_manifest(file_path):
+    """Manifiesto de calentamiento, o None si no existe o no es válido"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        logger.warning(f"⚠️ No existe el manifiesto de calentamiento {file_path}")
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Manifiesto de calentamiento inválido en {file_path}: {str(e)}")
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        logger.error(f"❌ Versión del manifiesto de calentamiento no compatible en {file_path}")
+        return None
+    return manifest
+
+
+def warmup_plan(manifest, now=None, max_questions=WARMUP_MAX_QUESTIONS, max_products=WARMUP_MAX_PRODUCTS):
+    """Preguntas y productos que se precargan: primero los de la ventana actual, luego los del total"""
+    now = time.time() if now is None else now
+    window = str(window_of(now, manifest.get('window_hours', WARMUP_WINDOW_HOURS)))
+    sections = [manifest.get('windows', {}).get(window, {}), manifest.get('overall', {})]
+
+    questions, seen = [], set()
+    for entry in itertools.chain.from_iterable(section.get('questions', []) for section in sections):
+        key = entry.get('key') or normalize_question(entry.get('text'))
+        if key and key not in seen and len(questions) < max_questions:
+            seen.add(key)
+            questions.append(entry.get('text') or key)
+
+    product_ids, seen = [], set()
+    for entry in itertools.chain.from_iterable(section.get('products', []) for section in sections):
+        product_id = entry.get('id')
+        if product_id is not None and product_id not in seen and len(product_ids) < max_products:
+            seen.add(product_id)
+            product_ids.append(product_id)
+    return questions, product_ids
+
+
+# --- Cachés y calentamiento -----------------------------------------------------
+
+class ResponseCache:
+    """
+    Respuestas del modelo a la primera pregunta de una conversación,
+    compartidas entre usuarios.
+
+    La clave es la versión del contexto del sistema (cambia con el catálogo y
+    las ofertas) y la pregunta normalizada: sin historial, la misma pregunta
+    sobre el mismo catálogo recibe la misma respuesta. Cada entrada recuerda
+    si la escribió el tráfico real o el calentamiento para contar los
+    aciertos de cada origen.
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES, metrics=None, tenant=None):
+        self.ttl = ttl
+        self.entries = TTLCache(ttl, max_entries)
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+        self.hits = {LIVE: 0, WARMUP: 0}
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, version, text):
+        key = normalize_question(text)
+        if not self.enabled or not key:
+            return None
+        entry = self.entries.get((version, key))
+        if entry is None:
+            self.misses += 1
+            self.metrics.inc('storebot_response_cache_misses_total', tenant=self.tenant)
+            return None
+        response, source = entry
+        self.hits[source] += 1
+        self.metrics.inc('storebot_response_cache_hits_total', tenant=self.tenant, source=source)
+        return response
+
+    def set(self, version, text, response, source=LIVE):
+        key = normalize_question(text)
+        if self.enabled and key and response:
+            self.entries.set((version, key), (response, source))
+
+    def contains(self, version, text):
+        return self.enabled and (version, normalize_question(text)) in self.entries
+
+
+class CacheWarmup:
+    """
+    Reproduce el manifiesto de calentamiento en segundo plano al arrancar.
+
+    Primero se precargan las cachés locales de los productos más mencionados
+    (`warm_products`, sin OpenAI) y después las preguntas frecuentes
+    (`warm_question`), de una en una y como mucho `rate` por segundo. Si el
+    servicio entra en un modo degradado el calentamiento se detiene: el
+    tráfico real tiene prioridad.
+    """
+
+    def __init__(self, manifest_path, warm_question, warm_products, admission=None, rate=WARMUP_RATE,
+                 max_questions=WARMUP_MAX_QUESTIONS, max_products=WARMUP_MAX_PRODUCTS, metrics=None, tenant=None):
+        self.manifest_path = manifest_path
+        self.warm_question = warm_question
+        self.warm_products = warm_products
+        self.admission = admission
+        self.rate = rate
+        self.max_questions = max_questions
+        self.max_products = max_products
+        self.metrics = metrics or default_metrics
+        self.tenant = tenant or ''
+        self.questions = 0
+        self.products = 0
+        self._task = None
+
+    def start(self):
+        if self.manifest_path and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def wait(self):
+        """Esperar a que termine el calentamiento (por ejemplo, antes de recibir tráfico en benchmarks/replay.py)"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        manifest = await asyncio.to_thread(load_manifest, self.manifest_path)
+        if manifest is None:
+            return
+        questions, product_ids = warmup_plan(manifest, max_questions=self.max_questions,
+                                             max_products=self.max_products)
+        logger.info(f"🌡️ Calentando cachés: {len(questions)} preguntas frecuentes y {len(product_ids)} productos")
+        start = time.time()
+        try:
+            if product_ids:
+                self.products = await self.warm_products(product_ids)
+            for position, question in enumerate(questions if self.rate > 0 else []):
+                if self.admission is not None and self.admission.under_pressure():
+                    logger.info("🌡️ Calentamiento detenido: el servicio está bajo presión")
+                    break
+                if position:
+                    await asyncio.sleep(1 / self.rate)
+                if await self.warm_question(question):
+                    self.questions += 1
+                    self.metrics.inc('storebot_warmup_responses_total', tenant=self.tenant)
+            self.metrics.set('storebot_warmup_products', self.products, tenant=self.tenant)
+            logger.info(f"🌡️ Calentamiento completado en {time.time() - start:.1f} s: "
+                        f"{self.questions} respuestas y {self.products} fichas precargadas")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error durante el calentamiento de cachés: {str(e)}")
@@ -0,0 +1,275 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from catalog import format_product_line, group_listing_lines
+from metrics import metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+# Procesos para el trabajo de CPU del catálogo (0 = todo en un hilo del proceso principal).
+# Con una sola CPU los procesos solo añaden el coste de enviar los datos, así que por defecto no se usan.
+CATALOG_WORKERS = int(os.getenv('CATALOG_WORKERS', str(os.cpu_count() if (os.cpu_count() or 1) > 1 else 0)))
+# Productos por tarea enviada a un proceso
+CATALOG_WORKER_CHUNK = int(os.getenv('CATALOG_WORKER_CHUNK', '10000'))
+# Por debajo de este número de productos no compensa enviar el trabajo a otros procesos
+CATALOG_WORKER_MIN_PRODUCTS = int(os.getenv('CATALOG_WORKER_MIN_PRODUCTS', '20000'))
+
+# Campos que usan el contexto de GPT y el listado; el resto no viaja a los procesos
+COMPACT_FIELDS = ('id', 'name', 'category', 'price', 'description', 'stock', 'disponible')
+COMPACT_OFFER_FIELDS = ('activa', 'descuento', 'precio_oferta', 'fecha_fin')
+
+CONTEXT = 'context'
+LISTING = 'listing'
+
+
+class BuildSuperseded(Exception):
+    """Una versión más reciente del catálogo reemplazó a la que se estaba procesando"""
+
+
+class _Missing:
+    """Marca de campo ausente en un producto compacto (viaja por referencia, no por valor)"""
+
+
+def compact_product(product):
+    """
+    Tupla con solo los campos necesarios para renderizar el producto.
+    Las tuplas se serializan bastante más rápido que los diccionarios.
+    """
+    ofertas = product.get('ofertas')
+    offer = tuple([ofertas.get(field, _Missing) for field in COMPACT_OFFER_FIELDS]) if ofertas else None
+    return tuple([product.get(field, _Missing) for field in COMPACT_FIELDS]) + (offer,)
+
+
+def expand_product(row):
+    """Reconstruir el diccionario de un producto compacto"""
+    product = {field: value for field, value in zip(COMPACT_FIELDS, row) if value is not _Missing}
+    if row[-1] is not None:
+        product['ofertas'] = {field: value for field, value in zip(COMPACT_OFFER_FIELDS, row[-1])
+                              if value is not _Missing}
+    return product
+
+
+def render_context_chunk(products):
+    """(ID, línea del contexto de GPT) de cada producto"""
+    return [(product.get('id'), format_product_line(product)) for product in products]
+
+
+def render_listing_chunk(products):
+    """Líneas del listado de /productos agrupadas por categoría"""
+    return group_listing_lines(products)
+
+
+def merge_listing(parts):
+    """Unir los grupos de varios trozos conservando el orden de las categorías"""
+    categories = {}
+    for part in parts:
+        for category, lines in part.items():
+            categories.setdefault(category, []).extend(lines)
+    return categories
+
+
+# Los resultados vuelven como una sola cadena por trozo: deserializar miles de cadenas pequeñas cuesta mucho más
+LINE_SEPARATOR = '\x00'
+
+
+def pack_lines(lines):
+    joined = LINE_SEPARATOR.join(lines)
+    if not lines or joined.count(LINE_SEPARATOR) != len(lines) - 1:
+        return list(lines)
+    return joined
+
+
+def unpack_lines(packed):
+    return packed.split(LINE_SEPARATOR) if isinstance(packed, str) else packed
+
+
+def pack_context(lines):
+    return [product_id for product_id, _ in lines], pack_lines([line for _, line in lines])
+
+
+def unpack_context(packed):
+    ids, lines = packed
+    return list(zip(ids, unpack_lines(lines)))
+
+
+def pack_listing(categories):
+    return {category: pack_lines(lines) for category, lines in categories.items()}
+
+
+def unpack_listing(packed):
+    return {category: unpack_lines(lines) for category, lines in packed.items()}
+
+
+def merge_context(parts):
+    return dict(line for part in parts for line in part)
+
+
+# Trabajo: (renderizar, empaquetar en el proceso, desempaquetar, unir los trozos)
+TASKS = {
+    CONTEXT: (render_context_chunk, pack_context, unpack_context, merge_context),
+    LISTING: (render_listing_chunk, pack_listing, unpack_listing, merge_listing),
+}
+
+
+def _render_rows(task, rows):
+    """Punto de entrada en los procesos del pool"""
+    render, pack, _, _ = TASKS[task]
+    return pack(render([expand_product(row) for row in rows]))
+
+
+def _merge(task, parts):
+    _, _, unpack, merge = TASKS[task]
+    return merge([unpack(part) for part in parts])
+
+
+def _noop():
+    return os.getpid()
+
+
+class CatalogWorkerPool:
+    """
+    Pool de procesos para el trabajo de CPU del catálogo (contexto de GPT, listado de /productos).
+
+    El catálogo se reduce a diccionarios compactos y se reparte en trozos entre
+    los procesos; el bucle de eventos solo espera los resultados. Cada trabajo
+    lleva una clave (por ejemplo la tienda y el tipo de trabajo): si llega uno
+    nuevo con la misma clave, el anterior se cancela y lanza `BuildSuperseded`.
+    Los catálogos pequeños se procesan en un hilo, sin pasar por otros procesos.
+    """
+
+    def __init__(self, max_workers=CATALOG_WORKERS, chunk_size=CATALOG_WORKER_CHUNK,
+                 min_products=CATALOG_WORKER_MIN_PRODUCTS, metrics=None):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.min_products = min_products
+        self.metrics = metrics or default_metrics
+        self._executor = None
+        self._started = False
+        self._lock = threading.Lock()
+        self._builds = {}
+        self._generation = 0
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None and self.max_workers > 0:
+                # `spawn`: los procesos no heredan hilos ni sockets (MongoDB, Telegram) del bot
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def start(self):
+        """Arrancar los procesos por adelantado para que el primer trabajo no pague su creación"""
+        if self.executor is not None and not self._started:
+            self._started = True
+            for _ in range(self.max_workers):
+                self.executor.submit(_noop)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._started = False
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _chunks(self, products):
+        chunk = []
+        for product in products:
+            chunk.append(compact_product(product))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _use_processes(self, products):
+        return self.max_workers > 0 and len(products) >= self.min_products
+
+    def run_sync(self, task, products):
+        """Ejecutar un trabajo y esperar el resultado (para el arranque, antes de tener bucle de eventos)"""
+        render, _, _, merge = TASKS[task]
+        if not self._use_processes(products):
+            return merge([render(products)])
+        start = time.perf_counter()
+        parts = self.executor.map(_render_rows, itertools.repeat(task), self._chunks(products))
+        result = _merge(task, parts)
+        self._observe(task, start, len(products))
+        return result
+
+    async def run(self, task, products, key=None):
+        """
+        Ejecutar un trabajo sin bloquear el bucle de eventos.
+
+        Lanza `BuildSuperseded` si mientras tanto se lanza otro trabajo con la
+        misma `key` o se llama a `cancel(key)`.
+        """
+        render, _, _, merge = TASKS[task]
+        key = (key, task)
+        self.cancel(key)
+        self._generation += 1
+        generation = self._generation
+        futures = []
+        self._builds[key] = (generation, futures)
+        start = time.perf_counter()
+
+        try:
+            if not self._use_processes(products):
+                result = await asyncio.to_thread(lambda: merge([render(products)]))
+            else:
+                # Compactar y trocear en un hilo: con catálogos grandes también cuesta CPU
+                chunks = await asyncio.to_thread(lambda: list(self._chunks(products)))
+                self._check(key, generation)
+                futures.extend(asyncio.wrap_future(self.executor.submit(_render_rows, task, chunk)) for chunk in chunks)
+                parts = await asyncio.gather(*futures)
+                result = await asyncio.to_thread(_merge, task, parts)
+            self._check(key, generation)
+        except asyncio.CancelledError:
+            if self._builds.get(key, (None,))[0] == generation:
+                raise
+            raise BuildSuperseded(f"Trabajo {key} reemplazado por una versión más reciente")
+        finally:
+            if self._builds.get(key, (None,))[0] == generation:
+                del self._builds[key]
+
+        self._observe(task, start, len(products))
+        return result
+
+    def _check(self, key, generation):
+        if self._builds.get(key, (None,))[0] != generation:
+            raise BuildSuperseded(f"Trabajo {key} reemplazado por una versión más reciente")
+
+    def cancel(self, key):
+        """Cancelar el trabajo en curso con esta clave (los trozos ya empezados terminan pero se descartan)"""
+        if not isinstance(key, tuple):
+            for task in TASKS:
+                self.cancel((key, task))
+            return
+        build = self._builds.pop(key, None)
+        if build is None:
+            return
+        for future in build[1]:
+            future.cancel()
+        self.metrics.inc('catalog_worker_builds_cancelled_total', task=key[1])
+
+    def _observe(self, task, start, count):
+        elapsed = time.perf_counter() - start
+        self.metrics.observe('catalog_worker_build_seconds', elapsed, task=task)
+        logger.info(f"⚙️ Trabajo de catálogo '{task}' completado: {count} productos en {elapsed * 1000:.0f} ms")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(**kwargs):
+    """Pool de procesos compartido por todas las tiendas del proceso"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CatalogWorkerPool(**kwargs)
+        return _pool